@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+#       ifdbconnections.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compare the time taken by the requests of a story import when each one
+opens a new connection (as urllib2.urlopen does) and when they go through
+the IFDB client's ConnectionPool.
+
+    python bench/ifdbconnections.py [--stories N] [--cert FILE --key FILE]
+
+A threaded HTTP/1.1 server on the loopback interface stands in for IFDB.
+Each story makes one iFiction request and one cover request of about
+20 KB each.  With a certificate and its key, the same is timed over
+HTTPS.  The best of two runs is printed, per story.
+
+"""
+
+
+import argparse
+import BaseHTTPServer
+import httplib
+import os
+import socket
+import SocketServer
+import ssl
+import sys
+import threading
+import time
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "src"))
+
+from grotesque import ifdb
+
+
+# The size of each response, in bytes.
+RESPONSE_SIZE = 20000
+RUNS = 2
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        body = "x" * RESPONSE_SIZE
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Closing the pool's idle connections ends their TLS sessions
+        # abruptly, which is of no interest here.
+        pass
+
+
+class UnverifiedPool(ifdb.ConnectionPool):
+    """A ConnectionPool which accepts the server's self-signed
+    certificate.
+
+    """
+    def __init__(self, context):
+        ifdb.ConnectionPool.__init__(self)
+        self.context = context
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout,
+                                           context=self.context)
+        return ifdb.ConnectionPool._connect(self, key)
+
+
+def serve(cert=None, key=None):
+    server = Server(("127.0.0.1", 0), Handler)
+    if cert is not None:
+        server.socket = ssl.wrap_socket(server.socket, key, cert,
+                                        server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def time_story_requests(get, urls):
+    """Return the best time per story, in milliseconds."""
+    times = []
+    for run in range(RUNS):
+        start = time.time()
+        for ifiction_url, cover_url in urls:
+            get(ifiction_url)
+            get(cover_url)
+        times.append((time.time() - start) / len(urls) * 1000)
+    return min(times)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Time the requests made while importing stories, with "
+        "and without persistent connections.")
+    parser.add_argument("--stories", type=int, default=200,
+                        help="the number of stories to time")
+    parser.add_argument("--cert", help="a certificate, to time HTTPS too")
+    parser.add_argument("--key", help="the certificate's private key")
+    args = parser.parse_args(argv)
+    context = ssl._create_unverified_context()
+    schemes = [("http", None, None)]
+    if args.cert is not None and args.key is not None:
+        schemes.append(("https", args.cert, args.key))
+    for scheme, cert, key in schemes:
+        server = serve(cert, key)
+        base = "{0}://127.0.0.1:{1}".format(scheme, server.server_port)
+        urls = [(base + "/viewgame?ifiction&ifid=STORY-{0}".format(n),
+                 base + "/viewgame?coverart&ifid=STORY-{0}".format(n))
+                for n in range(args.stories)]
+        pool = UnverifiedPool(context)
+        fresh = time_story_requests(
+            lambda url: urllib2.urlopen(url, context=context).read(), urls)
+        pooled = time_story_requests(lambda url: pool.get(url)[1], urls)
+        print "{0:6s} fresh connections {1:.2f} ms, pooled {2:.2f} ms " \
+            "per story".format(scheme.upper(), fresh, pooled)
+        pool.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
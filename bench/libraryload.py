@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+#       libraryload.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Time loading libraries of generated stories at startup.
+
+    python bench/libraryload.py [COUNT ...]
+
+For each number of stories (by default 10,000, 50,000 and 100,000), a
+library is created in a temporary directory.  Then the projection query
+which the library list is filled from is timed on its own.  If PyGObject
+is installed, the whole startup load is timed as well: creating the
+Library builds the row values and the filter stores and bulk loads the
+Gtk.ListStore.
+
+"""
+
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "src"))
+
+from grotesque import db
+
+try:
+    from grotesque.ui.gtk3.library.library import Library
+except ImportError:
+    Library = None
+
+
+DEFAULT_COUNTS = [10000, 50000, 100000]
+AUTHORS = 1000
+
+
+def create_library(filename, count):
+    manager = db.ConnectionManager(filename)
+    conn = manager.writer
+    db.set_up_db(conn, "bench")
+    first_published = datetime.date(1990, 1, 1)
+    with conn.transaction():
+        for n in range(AUTHORS):
+            db.query.insert_author(conn, "Author {0}".format(n))
+        for n in range(count):
+            conn.execute("INSERT INTO stories (title, language, "
+                         "firstpublished) VALUES (?, 'en', ?)",
+                         ("Story {0}".format(n), first_published))
+            conn.execute("INSERT INTO story_author (story_id, author_id) "
+                         "VALUES (?, ?)", (n + 1, n % AUTHORS + 1))
+    return manager
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    counts = [int(arg) for arg in argv] or DEFAULT_COUNTS
+    if Library is None:
+        print "PyGObject is not available: only the query is timed."
+    for count in counts:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            manager = create_library(os.path.join(tmp_dir, "library.db"),
+                                     count)
+            start = time.time()
+            db.query.select_library_rows(manager.writer)
+            query_time = time.time() - start
+            if Library is not None:
+                start = time.time()
+                Library(manager.writer)
+                load = "{0:.2f} s".format(time.time() - start)
+            else:
+                load = "not measured"
+            print "{0:7d} stories: query {1:.2f} s, startup load " \
+                "{2}".format(count, query_time, load)
+            manager.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,54 +21,271 @@
 
 
 import sqlite3
+import collections
+import contextlib
 import datetime
 import os.path
 import subprocess
+import threading
+import traceback
 import warnings
+import Queue
 
-import treatyofbabel
 from treatyofbabel import ifiction
 from treatyofbabel.babelerrors import BabelError
-from treatyofbabel.formats.executable import is_win32_executable
 
+from grotesque import ifdb
 import schema
 import query
+import analysis
 import importexport
 import addremove
+import thumbnails
+import coverstore
+import sync
+
+
+# How long, in seconds, a connection waits for a lock held by another
+# connection before giving up with "database is locked".
+BUSY_TIMEOUT = 5.0
+# The largest number of read-only connections handed out at once.
+MAX_READERS = 4
+# The number of stories which are committed to the database at once when
+# importing many of them.
+IMPORT_BATCH_SIZE = 50
+
+
+class Connection(sqlite3.Connection):
+    '''A connection to the library database which groups statements into
+    explicit transactions.
+
+    Outside of a transaction every statement is committed as soon as it
+    has been executed.  A logical operation which touches several rows is
+    wrapped in "with conn.transaction():" so that it is committed once
+    or, if an exception is raised, rolled back completely.  Transactions
+    may be nested, in which case the inner ones become savepoints within
+    the outermost one.
+
+    A connection may be shared between threads, in which case each thread
+    must do its writing within a transaction: only one thread at a time
+    is let into the outermost transaction.
+
+    The connection also holds the coverstore.CoverStore in use, if any,
+    as cover_store.
+
+    '''
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        # Let transaction() rather than the sqlite3 module decide where
+        # transactions begin and end.
+        self.isolation_level = None
+        self.transaction_depth = 0
+        self.transaction_lock = threading.RLock()
+        self.transaction_callbacks = []
+        self.cover_store = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.transaction_lock:
+            if self.transaction_depth == 0:
+                begin = "BEGIN"
+                end = ["COMMIT"]
+                rollback = ["ROLLBACK"]
+            else:
+                savepoint = "grotesque_{0}".format(self.transaction_depth)
+                begin = "SAVEPOINT {0}".format(savepoint)
+                end = ["RELEASE {0}".format(savepoint)]
+                rollback = ["ROLLBACK TO {0}".format(savepoint),
+                            "RELEASE {0}".format(savepoint)]
+            self.execute(begin)
+            self.transaction_depth += 1
+            try:
+                yield self
+            except:
+                self.transaction_depth -= 1
+                for stmnt in rollback:
+                    self.execute(stmnt)
+                self._run_transaction_callbacks()
+                raise
+            self.transaction_depth -= 1
+            for stmnt in end:
+                self.execute(stmnt)
+            self._run_transaction_callbacks()
+
+    def after_transaction(self, callback):
+        '''Call callback() once the outermost transaction has ended,
+        whether it was committed or rolled back, or straight away outside
+        of a transaction.  This is for work which cannot be rolled back,
+        such as deleting files.
+
+        '''
+        with self.transaction_lock:
+            if self.transaction_depth == 0:
+                callback()
+            else:
+                self.transaction_callbacks.append(callback)
+
+    def _run_transaction_callbacks(self):
+        if self.transaction_depth > 0:
+            return
+        callbacks = self.transaction_callbacks
+        self.transaction_callbacks = []
+        for callback in callbacks:
+            # The transaction is over, so a failing callback must not look
+            # as if it failed.
+            try:
+                callback()
+            except Exception:
+                warnings.warn(traceback.format_exc())
+
+
+class ConnectionManager:
+    '''Owns the connections to the library database.
+
+    The database is put in write-ahead-log mode, so that any number of
+    readers can work alongside the single writer without waiting for it
+    to commit.  The writer connection is shared by the main loop and any
+    background thread which changes the library; read-only connections
+    for background work are borrowed from a small pool with
+    "with manager.reader() as conn:".
+
+    '''
+    def __init__(self, db_file, synchronous="NORMAL", cache_size=-16384,
+                 mmap_size=67108864, temp_store="MEMORY",
+                 busy_timeout=BUSY_TIMEOUT, max_readers=MAX_READERS,
+                 cover_store=None):
+        self.db_file = db_file
+        self.cover_store = cover_store
+        self.pragmas = [("synchronous", synchronous),
+                        ("cache_size", int(cache_size)),
+                        ("mmap_size", int(mmap_size)),
+                        ("temp_store", temp_store)]
+        self.busy_timeout = busy_timeout
+        self.max_readers = max_readers
+        self._idle_readers = Queue.Queue()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self.writer = self._open()
+        # The journal mode is stored in the database file itself, so this
+        # only has to be done by one connection.
+        self.writer.execute("PRAGMA journal_mode=WAL")
+
+    def _open(self, read_only=False):
+        conn = connect(self.db_file, timeout=self.busy_timeout,
+                       check_same_thread=False)
+        for pragma, value in self.pragmas:
+            conn.execute("PRAGMA {0}={1}".format(pragma, value))
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        conn.cover_store = self.cover_store
+        return conn
+
+    @contextlib.contextmanager
+    def reader(self):
+        '''Borrow a read-only connection for the duration of a "with"
+        block.  If all of the pooled connections are in use, wait for one
+        to be returned.
+
+        '''
+        try:
+            conn = self._idle_readers.get_nowait()
+        except Queue.Empty:
+            with self._readers_lock:
+                conn = None
+                if len(self._readers) < self.max_readers:
+                    conn = self._open(read_only=True)
+                    self._readers.append(conn)
+            if conn is None:
+                conn = self._idle_readers.get()
+        try:
+            yield conn
+        finally:
+            self._idle_readers.put(conn)
 
+    def close(self):
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+            self._idle_readers = Queue.Queue()
+        self.writer.close()
 
-def connect(db_file):
+
+def connect(db_file, timeout=BUSY_TIMEOUT, check_same_thread=True):
     conn = sqlite3.connect(
         db_file,
-        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        timeout=timeout,
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        factory=Connection,
+        check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def open_library(settings):
+    return ConnectionManager(
+        settings.get_library_filename(),
+        synchronous=settings.get_db_synchronous(),
+        cache_size=settings.get_db_cache_size(),
+        mmap_size=settings.get_db_mmap_size(),
+        temp_store=settings.get_db_temp_store(),
+        cover_store=coverstore.CoverStore(settings.get_cover_store_dir(),
+                                          settings.get_external_covers()))
+
+
 def close_connection(conn):
     conn.close()
 
 
 def create_tables(conn):
     c = conn.cursor()
-    for stmnt in schema.TABLES:
-        c.execute(stmnt)
-    conn.commit()
+    with conn.transaction():
+        for stmnt in schema.TABLES:
+            c.execute(stmnt)
+        for stmnt in schema.INDEXES:
+            c.execute(stmnt)
 
 
 def set_up_db(conn, grotesque_version):
-    create_tables(conn)
+    with conn.transaction():
+        create_tables(conn)
+        # The tables were created with the current schema, so all the
+        # migrations are already in place.
+        query.set_schema_version(conn, schema.MIGRATIONS[-1][0])
+        query.set_db_version(conn, grotesque_version)
+        query.fill_forgiveness(conn)
+
+
+def upgrade_db(conn, grotesque_version):
+    """Apply all the schema migrations that are newer than the schema
+    version of the database, then record the current version of
+    Grotesque.
+
+    """
+    schema_version = query.get_schema_version(conn)
+    c = conn.cursor()
+    for version, steps in schema.MIGRATIONS:
+        if version <= schema_version:
+            continue
+        with conn.transaction():
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    c.execute(step)
+            query.set_schema_version(conn, version)
     query.set_db_version(conn, grotesque_version)
-    query.fill_forgiveness(conn)
 
 
 def add_story_from_ifiction(conn, story_file, ifid, ific_story, ific_source,
-                            fetch_coverart):
+                            ifdb_cover=None):
     if ific_story is None or ific_source is None:
         return None
-    story_id = addremove.add_story_meta(conn, ifid, ific_story, ific_source)
-    addremove.add_story_cover(conn, story_id, story_file, ific_story,
-                              fetch_coverart)
+    with conn.transaction():
+        story_id = addremove.add_story_meta(conn, ifid, ific_story,
+                                            ific_source)
+        addremove.add_story_cover(conn, story_id, story_file, ific_story,
+                                  ifdb_cover=ifdb_cover)
     return story_id
 
 
@@ -77,29 +294,6 @@ def _file_in_db(conn, filename):
     return file_release is not None
 
 
-def _get_raw_format(filename):
-    try:
-        ifformat = treatyofbabel.deduce_format(filename)
-    except BabelError as e:
-        warnings.warn("{0} is of an unknown format; skipping".format(filename))
-        raise e
-    except ValueError as e:
-        warnings.warn("{0} does not contain any data".format(filename))
-        raise e
-    if "blorbed" in ifformat:
-        raw_format = ifformat.split()[1].strip()
-    elif ifformat.strip() == "executable":
-        with open(filename) as h:
-            buf = h.read()
-        if is_win32_executable(buf):
-            raw_format = "win32"
-        else:
-            raw_format = "dos"
-    else:
-        raw_format = ifformat.strip()
-    return raw_format
-
-
 def _get_story_new_ifids(conn, story_ifids, filename, format_id):
     new_ifids = []
     story_ids = set()
@@ -113,7 +307,8 @@ def _get_story_new_ifids(conn, story_ifids, filename, format_id):
             # If a release with that IFID has been previously added,
             # update its associated file
             query.update_release(conn, ifid, {"uri": filename,
-                                              "format_id": format_id})
+                                              "format_id": format_id,
+                                              "missing": False})
     if len(story_ids) == 0:
         return (None, new_ifids)
     if len(story_ids) > 1:
@@ -123,78 +318,279 @@ def _get_story_new_ifids(conn, story_ifids, filename, format_id):
     return (story_id, new_ifids)
 
 
-def _get_story_ific(filename, ifids, fetch_metadata):
+def _get_story_ific(file_analysis, fetch_metadata):
+    filename = file_analysis["filename"]
+    ifids = file_analysis["ifids"]
     ific_story = None
-    if fetch_metadata:
-        for ifid in ifids:
-            ific_story, ific_source = addremove.get_ifiction(filename, ifid,
-                                                             True)
-            ific_ifid = ifid
-            if ific_story is not None:
-                break
+    # The IFiction is fetched from IFDB before the story is written, never
+    # while its transaction is open.
+    if fetch_metadata and "ifdb" in file_analysis:
+        ific_story, ific_ifid, ifdb_cover = file_analysis["ifdb"]
+        ific_source = "ifdb"
     if ific_story is None:
         for ifid in ifids:
-            ific_story, ific_source = addremove.get_ifiction(filename, ifid,
-                                                             False)
+            ific_story, ific_source = addremove.parse_ifiction(
+                filename, file_analysis["meta"])
             ific_ifid = ifid
     return (ific_story, ific_source, ific_ifid)
 
 
+def _select_cached_analysis(conn, filename):
+    row = query.select_file_analysis(conn, os.path.realpath(filename))
+    if row is None:
+        return None
+    cached = dict(zip(row.keys(), row))
+    if cached["meta"] is not None:
+        cached["meta"] = str(cached["meta"])
+    return cached
+
+
+def _cache_analysis(conn, file_analysis):
+    if file_analysis["error"] is not None or file_analysis["cached"]:
+        return
+    cover = file_analysis["cover"]
+    if cover is not None:
+        cover_info = (file_analysis["cover_offset"], len(cover.data),
+                      cover.img_format, cover.height, cover.width,
+                      cover.description)
+    else:
+        cover_info = (None, None, None, None, None, None)
+    query.replace_file_analysis(
+        conn, file_analysis["path"], file_analysis["size"],
+        file_analysis["mtime"], file_analysis["hash"],
+        file_analysis["format"], "\n".join(file_analysis["ifids"]),
+        file_analysis["meta"], *cover_info)
+    file_analysis["cached"] = True
+
+
+def analyse_file(conn, filename):
+    """Analyse a story file (see analysis.analyse_story_file), reusing
+    and keeping up to date its cached analysis.
+
+    """
+    file_analysis = analysis.analyse_story_file(
+        filename, _select_cached_analysis(conn, filename))
+    _cache_analysis(conn, file_analysis)
+    return file_analysis
+
+
 def add_story_from_file(conn, settings, filename, fetch_metadata,
                         fetch_coverart):
-    fail = False
-    # Check if this file has been added already
+    # Check if this file has been added already before reading it
     if _file_in_db(conn, filename):
         return (None, None)
-    # Get the format and the interpreter command
-    raw_format = _get_raw_format(filename)
-    try:
-        command = settings.get_launcher(raw_format)
-    except:
-        command = None
-    format_rec = query.select_format_by_name(conn, raw_format)
-    if format_rec is not None:
-        format_id = format_rec["id"]
-    else:
-        format_id = addremove.add_story_format(conn, raw_format, command)
-    # Check if any of this file's IFIDs have already been added
-    try:
-        ifids = treatyofbabel.get_ifids(filename)
-    except (BabelError, ValueError) as e:
-        raise e
-    story_id, new_ifids = _get_story_new_ifids(conn, ifids, filename, format_id)
-    if not new_ifids:
-        return (None, None)
-    if story_id is None:
-        ific_story, ific_source, ifid = _get_story_ific(filename, ifids,
-                                                        fetch_metadata)
-        if ific_story is None:
-            story_id = addremove.add_story_stub(conn, ifid, filename)
-            fail = True
+    file_analysis = analysis.analyse_story_file(
+        filename, _select_cached_analysis(conn, filename))
+    if fetch_metadata and file_analysis["error"] is None:
+        file_analysis["ifdb"] = ifdb.fetch_story(file_analysis["ifids"],
+                                                 fetch_coverart)
+    return add_story_from_analysis(conn, settings, file_analysis,
+                                   fetch_metadata, fetch_coverart)
+
+
+def add_story_from_analysis(conn, settings, file_analysis, fetch_metadata,
+                            fetch_coverart):
+    """Add a story to the library from the analysis of its file (see
+    analysis.analyse_story_file).
+
+    """
+    filename = file_analysis["filename"]
+    if file_analysis["error"] is not None:
+        raise file_analysis["error"]
+    with conn.transaction():
+        _cache_analysis(conn, file_analysis)
+        fail = False
+        # Check if this file has been added already
+        if _file_in_db(conn, filename):
+            return (None, None)
+        # Get the format and the interpreter command
+        raw_format = file_analysis["format"]
+        try:
+            command = settings.get_launcher(raw_format)
+        except:
+            command = None
+        format_rec = query.select_format_by_name(conn, raw_format)
+        if format_rec is not None:
+            format_id = format_rec["id"]
         else:
-            story_id = addremove.add_story_meta(conn, ifid, ific_story,
-                                                ific_source)
-            addremove.add_story_cover(conn, story_id, filename, ific_story,
-                                      fetch_coverart)
-    for ifid in new_ifids:
-        addremove.add_story_release(conn, story_id, ifid, raw_format, command,
-                                    os.path.realpath(filename))
-    # Assume that the user wants the most recent version added
-    # to be the default release
-    query.update_story(conn, story_id, {"default_release": new_ifids[0]})
-    return (story_id, fail)
+            format_id = addremove.add_story_format(conn, raw_format, command)
+        # Check if any of this file's IFIDs have already been added
+        ifids = file_analysis["ifids"]
+        story_id, new_ifids = _get_story_new_ifids(conn, ifids, filename,
+                                                   format_id)
+        if not new_ifids:
+            return (None, None)
+        if story_id is None:
+            ific_story, ific_source, ifid = _get_story_ific(file_analysis,
+                                                            fetch_metadata)
+            if ific_story is None:
+                story_id = addremove.add_story_stub(conn, ifid, filename)
+                fail = True
+            else:
+                story_id = addremove.add_story_meta(conn, ifid, ific_story,
+                                                    ific_source)
+                if "ifdb" in file_analysis:
+                    ifdb_cover = file_analysis["ifdb"][2]
+                else:
+                    ifdb_cover = None
+                # Only cover art which was fetched beforehand, along with
+                # the metadata, is used.
+                addremove.add_story_cover(conn, story_id, None, ific_story,
+                                          file_analysis["cover"], ifdb_cover)
+        for ifid in new_ifids:
+            addremove.add_story_release(conn, story_id, ifid, raw_format,
+                                        command, os.path.realpath(filename))
+        # Assume that the user wants the most recent version added
+        # to be the default release
+        query.update_story(conn, story_id, {"default_release": new_ifids[0]})
+        return (story_id, fail)
+
+
+class StoryImporter:
+    '''Imports a set of story files into the library.
+
+    The files are analysed concurrently by the worker processes of the
+    pool opened with analysis.open_pool(), or one at a time in this
+    process if there is none, and the metadata of new stories is fetched
+    from IFDB by the background workers of the IFDB client.  The results
+    are written by a single connection, up to batch_size stories per
+    transaction.
+
+    '''
+    def __init__(self, conn, settings, fetch_metadata, fetch_coverart,
+                 batch_size=IMPORT_BATCH_SIZE):
+        self.conn = conn
+        self.settings = settings
+        self.fetch_metadata = fetch_metadata
+        self.fetch_coverart = fetch_coverart
+        self.batch_size = batch_size
+        self.stopped = False
+
+    def stop(self):
+        '''Stop importing.  The stories which have already been written
+        are kept.
+
+        '''
+        self.stopped = True
+
+    def _needs_ifdb(self, file_analysis):
+        # Metadata is only fetched for stories which are not in the library
+        # under any of the file's IFIDs.
+        if not self.fetch_metadata or file_analysis["error"] is not None:
+            return False
+        for ifid in file_analysis["ifids"]:
+            if query.select_release(self.conn, ifid) is not None:
+                return False
+        return True
+
+    def _prefetch(self, file_analysis, ready):
+        if not self._needs_ifdb(file_analysis):
+            ready.put(file_analysis)
+            return
+
+        def fetched(request):
+            if request.error is not None:
+                warnings.warn("failed to fetch IFDB metadata for {0}: "
+                              "{1}".format(file_analysis["filename"],
+                                           request.error))
+                file_analysis["ifdb"] = (None, None, None)
+            else:
+                file_analysis["ifdb"] = request.result
+            ready.put(file_analysis)
+        ifdb.get_client().submit(
+            ifdb.fetch_story, (file_analysis["ifids"], self.fetch_coverart),
+            callback=fetched)
+
+    def import_files(self, filenames, poll_interval=0.05):
+        '''Import the files, yielding (filename, story_id, failed) after each
+        one has been committed, with the same meaning as the return value of
+        add_story_from_file.  While waiting on the workers, None is
+        yielded every poll_interval seconds so that the caller can keep
+        its user interface responsive.
+
+        The files which are ready are written together, up to batch_size
+        of them per transaction, and nothing is yielded while a
+        transaction is open, so the generator may be run on a thread
+        other than the one that uses the connection the rest of the
+        time.
+
+        '''
+        new_files = []
+        for filename in filenames:
+            if _file_in_db(self.conn, filename):
+                yield (filename, None, None)
+            else:
+                new_files.append(filename)
+        if not new_files or self.stopped:
+            return
+        jobs = [(filename, _select_cached_analysis(self.conn, filename))
+                for filename in new_files]
+        # Analysed files wait here until they are ready to be written.
+        ready = Queue.Queue()
+        # The pool is shared, and is never forked from this thread.  Only
+        # a batch of files is queued in it at a time, so that little is
+        # left for it to do if the import is stopped.
+        pool = analysis.get_pool()
+        jobs = iter(jobs)
+        analysing = collections.deque()
+        remaining = len(new_files)
+        while remaining > 0 and not self.stopped:
+            if pool is None:
+                # Analyse one file per pass, so that the stories are still
+                # written and yielded as they go.
+                job = next(jobs, None)
+                if job is not None:
+                    self._prefetch(analysis.analyse_story_job(job), ready)
+            else:
+                while len(analysing) < self.batch_size:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    analysing.append(pool.apply_async(
+                        analysis.analyse_story_job, (job,)))
+                while analysing and analysing[0].ready():
+                    self._prefetch(analysing.popleft().get(), ready)
+            # Wait for the workers outside of any transaction, so that
+            # the connection is only held while writing.
+            try:
+                batch = [ready.get(True, poll_interval)]
+            except Queue.Empty:
+                yield None
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(ready.get_nowait())
+                except Queue.Empty:
+                    break
+            written = []
+            with self.conn.transaction():
+                for file_analysis in batch:
+                    if self.stopped:
+                        break
+                    try:
+                        story_id, failed = add_story_from_analysis(
+                            self.conn, self.settings, file_analysis,
+                            self.fetch_metadata, self.fetch_coverart)
+                    except (BabelError, ValueError):
+                        story_id, failed = (None, None)
+                    written.append((file_analysis["filename"], story_id,
+                                    failed))
+            remaining -= len(batch)
+            for result in written:
+                yield result
 
 
 def remove_story(conn, story_id):
-    addremove.clean_story_authors(conn, story_id)
-    addremove.clean_story_genres(conn, story_id)
-    addremove.clean_story_groups(conn, story_id)
-    addremove.clean_story_series(conn, story_id)
-    addremove.clean_story_annotation(conn, story_id)
-    addremove.clean_story_ifdb_annotation(conn, story_id)
-    addremove.clean_story_releases(conn, story_id)
-    addremove.clean_story_cover(conn, story_id)
-    query.delete_story(conn, story_id)
+    with conn.transaction():
+        addremove.clean_story_authors(conn, story_id)
+        addremove.clean_story_genres(conn, story_id)
+        addremove.clean_story_groups(conn, story_id)
+        addremove.clean_story_series(conn, story_id)
+        addremove.clean_story_annotation(conn, story_id)
+        addremove.clean_story_ifdb_annotation(conn, story_id)
+        addremove.clean_story_releases(conn, story_id)
+        addremove.clean_story_cover(conn, story_id)
+        query.delete_story(conn, story_id)
 
 
 def export_ifiction(conn, file_handle, story_ids, grotesque_version):
@@ -221,55 +617,58 @@ def export_ifiction(conn, file_handle, story_ids, grotesque_version):
     file_handle.write(xml)
 
 
-def import_ifiction(conn, settings, story_node, fetch_coverart):
-    ific_annot = ifiction.get_annotation(story_node)
-    story_id = addremove.add_story_meta(conn, None, story_node, "import")
-    got_cover = False
-    if (not ific_annot or "grotesque" not in ific_annot or
-        "storyfile" not in ific_annot["grotesque"]):
-        ific_biblio = ifiction.get_bibliographic(story_node)
-        warnings.warn("".join(["not enough information for {0}",
-                               " importing metadata only".format(
-                                   ific_biblio["title"])]))
-        return (story_id, True)
-    story_files = []
-    try:
-        ifid = ific_annot["grotesque"]["storyfile"]["ifid"]
-        filename = ific_annot["grotesque"]["storyfile"]["uri"]
-        story_files.append((ifid, filename))
-    except:
-        for storyfile in ific_annot["grotesque"]["storyfile"]:
-            ifid = storyfile["ifid"]
-            filename = storyfile["uri"]
-            story_files.append((ifid, filename))
-    for ifid, filename in story_files:
-        if not got_cover:
-            got_cover = addremove.add_story_cover(
-                conn, story_id, filename, story_node,
-                fetch_coverart)
+def import_ifiction(conn, settings, story_node, ifdb_cover=None):
+    """Import a story from an IFiction record exported by Grotesque.  Its
+    cover art may be fetched from IFDB beforehand and given as ifdb_cover.
+
+    """
+    error = None
+    with conn.transaction():
+        ific_annot = ifiction.get_annotation(story_node)
+        story_id = addremove.add_story_meta(conn, None, story_node, "import")
+        got_cover = False
+        if (not ific_annot or "grotesque" not in ific_annot or
+            "storyfile" not in ific_annot["grotesque"]):
+            ific_biblio = ifiction.get_bibliographic(story_node)
+            warnings.warn("".join(["not enough information for {0}",
+                                   " importing metadata only".format(
+                                       ific_biblio["title"])]))
+            return (story_id, True)
+        story_files = []
         try:
-            ifformat = treatyofbabel.deduce_format(filename)
-        except BabelError:
-            warnings.warn("{0} is of an unknown format".format(filename))
-            raise BabelError
-        if "blorbed" in ifformat:
-            raw_format = ifformat.split()[1].strip()
-        elif ifformat.strip() == "executable":
-            with open(filename) as h:
-                buf = h.read()
-            if is_win32_executable(buf):
-                raw_format = "win32"
-            else:
-                raw_format = "dos"
-        else:
-            raw_format = ifformat.strip()
-        try:
-            command = settings.get_launcher(raw_format)
+            ifid = ific_annot["grotesque"]["storyfile"]["ifid"]
+            filename = ific_annot["grotesque"]["storyfile"]["uri"]
+            story_files.append((ifid, filename))
         except:
-            command = None
-        addremove.add_story_release(conn, story_id, ifid, ifformat,
+            for storyfile in ific_annot["grotesque"]["storyfile"]:
+                ifid = storyfile["ifid"]
+                filename = storyfile["uri"]
+                story_files.append((ifid, filename))
+        for ifid, filename in story_files:
+            file_analysis = analyse_file(conn, filename)
+            if not got_cover:
+                got_cover = addremove.add_story_cover(
+                    conn, story_id, None, story_node, file_analysis["cover"],
+                    ifdb_cover)
+            if file_analysis["error"] is not None:
+                warnings.warn("{0} is of an unknown format".format(filename))
+                # The story's metadata is kept even though its file cannot
+                # be added, so the error is only raised once it has been
+                # committed.
+                error = file_analysis["error"]
+                break
+            raw_format = file_analysis["format"]
+            try:
+                command = settings.get_launcher(raw_format)
+            except:
+                command = None
+            addremove.add_story_release(conn, story_id, ifid, raw_format,
                                         command, os.path.realpath(filename))
-    query.update_story(conn, story_id, {"default_release": story_files[0][0]})
+        if error is None:
+            query.update_story(conn, story_id,
+                               {"default_release": story_files[0][0]})
+    if error is not None:
+        raise error
     return (story_id, False)
 
 
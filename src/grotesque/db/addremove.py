@@ -28,6 +28,7 @@ from treatyofbabel.babelerrors import BabelError, IFictionError
 from treatyofbabel import ifiction
 import treatyofbabel
 import query
+import coverstore
 
 
 def add_story_biblio(conn, biblio, ident, contact, ific_source=None):
@@ -167,20 +168,7 @@ def add_story_genres(conn, story_id, biblio):
         query.add_genre_to_story(conn, genre_id, story_id)
 
 
-def _fetch_story_cover(conn, story_id, ific_story, orig_cover):
-    annotation = ifiction.get_annotation(ific_story)
-    if annotation is None:
-        return False
-    if "ifdb" not in annotation:
-        return False
-    if "cover_url" in annotation["ifdb"]:
-        data = ifdb.fetch_cover(url=annotation["ifdb"]["cover_url"])
-    elif "tuid" in annotation["ifdb"]:
-        data = ifdb.fetch_cover(tuid=annotation["ifdb"]["tuid"])
-    else:
-        return False
-    if data is None:
-        return False
+def _store_ifdb_cover(conn, story_id, orig_cover, data):
     img_format = _imgfuncs.deduce_img_format(data)
     if img_format == "jpeg":
         width, height = _imgfuncs.get_jpeg_dim(data)
@@ -193,18 +181,8 @@ def _fetch_story_cover(conn, story_id, ific_story, orig_cover):
         warnings.warn("unsupported image format for {0}".format(
             biblio["title"]))
         return False
-    description = None
-    if orig_cover is not None:
-        query.update_cover(conn, orig_cover["id"],
-                           {"height": height,
-                            "width": width,
-                            "format": img_format,
-                            "description": description,
-                            "data": data})
-    else:
-        query.insert_cover(
-            conn, story_id, img_format, height, width,
-            description, data)
+    store_cover(conn, story_id, orig_cover, img_format, height, width, None,
+                data)
     return True
 
 
@@ -213,27 +191,51 @@ def _extract_story_cover(conn, story_id, filename, orig_cover):
         cover = treatyofbabel.get_cover(filename)
     except BabelError:
         return False
+    return _store_story_cover(conn, story_id, cover, orig_cover)
+
+
+def _store_story_cover(conn, story_id, cover, orig_cover):
     if cover is None:
         return False
-    if orig_cover is not None:
-        query.update_cover(conn, orig_cover["id"],
-                           {"height": cover.height,
-                            "width": cover.width,
-                            "format": cover.img_format,
-                            "description": cover.description,
-                            "data": cover.data})
-    else:
-        query.insert_cover(conn, story_id, cover.img_format,
-                           cover.height, cover.width, cover.description,
-                           cover.data)
+    store_cover(conn, story_id, orig_cover, cover.img_format, cover.height,
+                cover.width, cover.description, cover.data)
     return True
 
 
+def store_cover(conn, story_id, orig_cover, img_format, height, width,
+                description, data):
+    """Store a story's cover art, replacing orig_cover if there is one.
+    The thumbnails of the old image are dropped.  Making new ones takes
+    too long to be done inside the transaction, so they are left to
+    thumbnails.make_cover_thumbnails().
+
+    """
+    with conn.transaction():
+        stored_data, cover_hash = coverstore.write_cover(conn, data)
+        if orig_cover is not None:
+            cover_id = orig_cover["id"]
+            query.update_cover(conn, cover_id,
+                               {"height": height,
+                                "width": width,
+                                "format": img_format,
+                                "description": description,
+                                "data": stored_data,
+                                "hash": cover_hash})
+            if orig_cover["hash"] != cover_hash:
+                coverstore.release(conn, orig_cover["hash"])
+        else:
+            cover_id = query.insert_cover(conn, story_id, img_format, height,
+                                          width, description, stored_data,
+                                          cover_hash)
+        query.delete_cover_thumbnails(conn, cover_id)
+
+
 def _add_cover_stub(conn, story_id, ific_story, orig_cover):
     cover_info = ifiction.get_cover(ific_story)
     if cover_info is None:
         return False
-    if orig_cover is not None and orig_cover["data"]:
+    if orig_cover is not None and (orig_cover["data"] or
+                                   orig_cover["hash"]):
         warnings.warn("cowardly refusing to replace existing cover data "
                       "with IFiction skeleton data")
         return False
@@ -243,14 +245,25 @@ def _add_cover_stub(conn, story_id, ific_story, orig_cover):
         cover_info["description"], "")
 
 
-def add_story_cover(conn, story_id, filename, ific_story, fetch_coverart):
+def add_story_cover(conn, story_id, filename, ific_story, cover=None,
+                    ifdb_cover=None):
+    """Add cover art for a story, trying the cover data fetched from IFDB
+    first (if any), then the story file and finally the IFiction record.
+    If the story file has already been analysed, its cover can be given
+    directly instead of the filename.
+
+    Nothing is fetched here, since this is called inside a transaction:
+    the cover art must be fetched beforehand with ifdb.fetch_story_cover().
+
+    """
     orig_cover = query.select_cover_by_story(conn, story_id)
-    if fetch_coverart:
-        fetch_success = _fetch_story_cover(conn, story_id, ific_story,
-                                           orig_cover)
-        if fetch_success:
+    if ifdb_cover is not None:
+        if _store_ifdb_cover(conn, story_id, orig_cover, ifdb_cover):
+            return True
+    if cover is not None:
+        if _store_story_cover(conn, story_id, cover, orig_cover):
             return True
-    if filename is not None:
+    elif filename is not None:
         extract_success = _extract_story_cover(conn, story_id, filename,
                                                orig_cover)
         if extract_success:
@@ -373,6 +386,10 @@ def get_ifiction(filename, ifid, fetch_metadata):
     except:
         warnings.warn("no IFiction found for {0}".format(filename))
         return (None, None)
+    return parse_ifiction(filename, ific_str)
+
+
+def parse_ifiction(filename, ific_str):
     if not ific_str:
         warnings.warn("no IFiction found for {0}".format(filename))
         return (None, None)
@@ -470,3 +487,4 @@ def clean_story_cover(conn, story_id):
     if cover_rec is None:
         return
     query.delete_cover(conn, cover_rec["id"])
+    coverstore.release(conn, cover_rec["hash"])
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+#       analysis.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Analysis of story files.
+
+Nothing in here touches the database, so the functions can be run in
+worker processes while a single connection writes their results.
+
+Each story file is read exactly once; the format handlers of
+treatyofbabel are then all given the same buffer.  If a previous analysis
+of the file is given and the file has not changed since, it is not
+parsed at all.
+
+"""
+
+
+import hashlib
+import multiprocessing
+import os.path
+import warnings
+
+import treatyofbabel
+from treatyofbabel.babelerrors import BabelError
+from treatyofbabel.formats.executable import is_win32_executable
+
+
+# Anything shorter than this (the same arbitrary limit as treatyofbabel's)
+# cannot be a story file.
+MIN_STORY_SIZE = 20
+
+
+class StoryCover(object):
+    """The cover art found in a story file."""
+    def __init__(self, data, img_format, height, width, description=None):
+        self.data = data
+        self.img_format = img_format
+        self.height = height
+        self.width = width
+        self.description = description
+
+
+def read_story_file(filename):
+    with open(filename, 'rb') as h:
+        story_data = h.read()
+    if len(story_data) < MIN_STORY_SIZE:
+        raise ValueError("Truncated story file")
+    return story_data
+
+
+def deduce_handler(filename, story_data):
+    """Find the treatyofbabel handler (a format module or the blorb
+    wrapper) which understands the story data, and the raw format name
+    used by Grotesque for it.
+
+    """
+    blorb = treatyofbabel.wrappers.blorb
+    try:
+        if blorb.claim_story_file(story_data):
+            handler = blorb
+            raw_format = blorb.get_story_format(story_data).split()[0]
+        else:
+            handler = treatyofbabel.deduce_handler(filename, story_data)
+            raw_format = handler.get_format_name().strip()
+    except BabelError as e:
+        warnings.warn("{0} is of an unknown format; skipping".format(filename))
+        raise e
+    if raw_format == "executable":
+        if is_win32_executable(story_data):
+            raw_format = "win32"
+        else:
+            raw_format = "dos"
+    return (handler, raw_format)
+
+
+def _is_unchanged(analysis, cached):
+    if cached is None:
+        return False
+    # A cover which could not be located in the file cannot be reloaded.
+    if cached["cover_format"] is not None and cached["cover_offset"] is None:
+        return False
+    if analysis["hash"] is None:
+        return (cached["size"] == analysis["size"] and
+                cached["mtime"] == analysis["mtime"])
+    return cached["hash"] == analysis["hash"]
+
+
+def _load_cached(analysis, cached):
+    analysis["format"] = cached["format"]
+    analysis["ifids"] = cached["ifids"].split("\n")
+    analysis["meta"] = cached["meta"]
+    if cached["cover_offset"] is not None:
+        try:
+            with open(analysis["filename"], 'rb') as h:
+                h.seek(cached["cover_offset"])
+                data = h.read(cached["cover_length"])
+        except IOError:
+            data = None
+        if data is not None and len(data) == cached["cover_length"]:
+            analysis["cover"] = StoryCover(
+                data, cached["cover_format"], cached["cover_height"],
+                cached["cover_width"], cached["cover_description"])
+            analysis["cover_offset"] = cached["cover_offset"]
+    if analysis["hash"] is None:
+        analysis["hash"] = cached["hash"]
+        analysis["cached"] = True
+    return analysis
+
+
+def analyse_story_file(filename, cached=None):
+    """Gather everything that is needed to add a story file to the
+    library: its format, its IFIDs, its embedded IFiction record (if any)
+    and its cover art (if any), along with the file's fingerprint.
+
+    cached is the record of an earlier analysis of the file, as stored in
+    the file_analysis table.  It is reused without reading the file if the
+    file's size and modification time are the same, or without parsing it
+    if its content hash is.  "cached" is True in the result if the stored
+    record is still up to date.
+
+    If the file cannot be identified, the exception is stored under
+    "error" rather than raised, so that it can be passed back from a
+    worker process and raised again by whoever writes the result.
+
+    """
+    analysis = {"filename": filename,
+                "path": os.path.realpath(filename),
+                "size": None,
+                "mtime": None,
+                "hash": None,
+                "format": None,
+                "ifids": [],
+                "meta": None,
+                "cover": None,
+                "cover_offset": None,
+                "cached": False,
+                "error": None}
+    blorb = treatyofbabel.wrappers.blorb
+    try:
+        stat = os.stat(filename)
+    except OSError as e:
+        analysis["error"] = e
+        return analysis
+    analysis["size"] = stat.st_size
+    analysis["mtime"] = stat.st_mtime
+    if _is_unchanged(analysis, cached):
+        return _load_cached(analysis, cached)
+    try:
+        story_data = read_story_file(filename)
+    except ValueError as e:
+        warnings.warn("{0} does not contain any data".format(filename))
+        analysis["error"] = e
+        return analysis
+    except IOError as e:
+        analysis["error"] = e
+        return analysis
+    analysis["hash"] = hashlib.sha1(story_data).hexdigest()
+    if _is_unchanged(analysis, cached):
+        return _load_cached(analysis, cached)
+    try:
+        handler, analysis["format"] = deduce_handler(filename, story_data)
+        if handler is blorb:
+            analysis["ifids"] = blorb.get_story_file_ifid(story_data)
+        else:
+            analysis["ifids"] = [handler.get_story_file_ifid(story_data)]
+    except (BabelError, ValueError) as e:
+        analysis["error"] = e
+        return analysis
+    if handler is blorb or handler.HAS_META:
+        try:
+            analysis["meta"] = handler.get_story_file_meta(story_data)
+        except:
+            analysis["meta"] = None
+    if handler is blorb or handler.HAS_COVER:
+        try:
+            cover = handler.get_story_file_cover(story_data)
+        except BabelError:
+            cover = None
+        if cover is not None:
+            analysis["cover"] = StoryCover(
+                cover.data, cover.img_format, cover.height, cover.width,
+                getattr(cover, "description", None))
+            offset = story_data.find(cover.data)
+            if offset >= 0:
+                analysis["cover_offset"] = offset
+    return analysis
+
+
+def analyse_story_job(job):
+    """Analyse a (filename, cached) pair; Pool.imap only passes a single
+    argument to its function.
+
+    """
+    filename, cached = job
+    return analyse_story_file(filename, cached)
+
+
+_pool = None
+
+
+def open_pool(processes=None):
+    """Start the pool of worker processes shared by the whole program, with
+    one worker per core unless processes is given.
+
+    The workers are forked, so this must be called on the main thread
+    before any other thread is started: a process forked while other
+    threads are running inherits their locks in whatever state they
+    happen to be in.
+
+    """
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(processes)
+    return _pool
+
+
+def get_pool():
+    """Return the shared pool, or None if it has not been opened."""
+    return _pool
+
+
+def close_pool():
+    """Stop the workers of the shared pool."""
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
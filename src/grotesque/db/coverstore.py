@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+#       coverstore.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""An optional store for cover art outside of the library database.
+
+Each image is kept once, in a file named after the SHA-1 digest of its
+contents, however many covers share it; the covers table then only
+holds the digest in its hash column, along with the image's details.
+An image's file is deleted once no cover refers to it any longer.
+
+The store in use is held by each connection to the library, as
+conn.cover_store, which is None if there is no store.  Since a file
+cannot be rolled back along with the database, files are only ever
+deleted once the transaction which stopped referring to them, or which
+failed to, has ended.
+
+"""
+
+
+import hashlib
+import mmap
+import os
+import tempfile
+import warnings
+
+import query
+
+
+class CoverStore:
+    """Files are kept in subdirectories named after the first two
+    characters of their digests, so that no one directory grows too big.
+    Files are written under temporary names and then renamed, so that a
+    file with a digest's name is always complete.
+
+    New cover art is only written to the store if external is true;
+    covers already in the store are read from it either way.
+
+    """
+    def __init__(self, directory, external=False):
+        self.directory = directory
+        self.external = external
+
+    def path(self, cover_hash):
+        return os.path.join(self.directory, cover_hash[:2], cover_hash)
+
+    def put(self, data):
+        """Store an image, if it is not stored already, and return its
+        digest.
+
+        """
+        data = str(data)
+        cover_hash = hashlib.sha1(data).hexdigest()
+        path = self.path(cover_hash)
+        if os.path.exists(path):
+            return cover_hash
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        return cover_hash
+
+    def get(self, cover_hash):
+        """Return an image as a buffer over the memory-mapped file, or
+        None if it is missing.
+
+        """
+        try:
+            with open(self.path(cover_hash), "rb") as cover_file:
+                if os.fstat(cover_file.fileno()).st_size == 0:
+                    return buffer("")
+                return buffer(mmap.mmap(cover_file.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+        except (IOError, OSError) as e:
+            warnings.warn("cover art {0} is missing: {1}".format(cover_hash,
+                                                                 e))
+            return None
+
+    def remove(self, cover_hash):
+        try:
+            os.remove(self.path(cover_hash))
+        except OSError:
+            pass
+
+    def hashes(self):
+        """Yield the digest of every image in the store."""
+        if not os.path.isdir(self.directory):
+            return
+        for dirname in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, dirname)
+            if len(dirname) != 2 or not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.startswith(dirname) and len(name) == 40:
+                    yield name
+
+
+def read_cover(conn, cover_row):
+    """Return the image data of a row of the covers table, wherever it is
+    kept.
+
+    """
+    # Libraries are still being upgraded when the covers table has no hash
+    # column.
+    if "hash" in cover_row.keys() and cover_row["hash"]:
+        if conn.cover_store is None:
+            return None
+        return conn.cover_store.get(cover_row["hash"])
+    return cover_row["data"]
+
+
+def put_cover(conn, data):
+    """Put an image in the store and return its digest.  This is to be
+    done within the transaction which refers to the image, so that the
+    file is deleted again if the transaction is rolled back.
+
+    """
+    cover_hash = conn.cover_store.put(data)
+    release(conn, cover_hash)
+    return cover_hash
+
+
+def write_cover(conn, data):
+    """Return the (data, hash) to be stored in the covers table for an
+    image, putting it in the store if it is used.
+
+    """
+    store = conn.cover_store
+    if store is not None and store.external and data:
+        return ("", put_cover(conn, data))
+    return (data, None)
+
+
+def _remove_unused(conn, cover_hash):
+    if query.count_covers_by_hash(conn, cover_hash) == 0:
+        conn.cover_store.remove(cover_hash)
+
+
+def release(conn, cover_hash):
+    """Delete an image from the store if no cover refers to it once the
+    current transaction has ended.
+
+    """
+    if not cover_hash or conn.cover_store is None:
+        return
+    conn.after_transaction(lambda: _remove_unused(conn, cover_hash))
+
+
+def collect_garbage(conn):
+    """Delete every image in the store which no cover refers to, and
+    return how many there were.
+
+    """
+    store = conn.cover_store
+    if store is None:
+        return 0
+    removed = 0
+    # Images put in the store by a transaction which is still under way
+    # are not referred to yet, so wait for it.
+    with conn.transaction():
+        hashes = set(query.select_cover_hashes(conn))
+        for cover_hash in list(store.hashes()):
+            if cover_hash not in hashes:
+                store.remove(cover_hash)
+                removed += 1
+    return removed
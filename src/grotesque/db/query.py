@@ -18,17 +18,97 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
+import os.path
 import sqlite3
 
+from grotesque import util
+
+
+# SQLite's default limit on the number of host parameters in a statement
+# is 999, so long "IN (...)" lists are split into chunks of this size.
+MAX_QUERY_VARIABLES = 500
+
+
+LIBRARY_ROWS_QUERY = """
+SELECT stories.id, stories.title, stories.language, stories.headline,
+       stories.firstpublished, stories.seriesnumber,
+       annotation.id AS annotation_id, annotation.played,
+       annotation.rating, annotation.rating_txt, annotation.imported,
+       ifdb_annotation.id AS ifdb_annotation_id,
+       ifdb_annotation.star_rating AS ifdb_rating,
+       ifdb_annotation.star_rating_txt AS ifdb_rating_txt,
+       groups.name AS group_name,
+       series.name AS series_name,
+       forgiveness.description AS forgiveness,
+       (SELECT GROUP_CONCAT(name, ', ') FROM
+            (SELECT authors.name FROM story_author
+                 JOIN authors ON authors.id = story_author.author_id
+             WHERE story_author.story_id = stories.id
+             ORDER BY story_author.rowid)) AS authors,
+       (SELECT GROUP_CONCAT(name, '/') FROM
+            (SELECT genres.name FROM story_genre
+                 JOIN genres ON genres.id = story_genre.genre_id
+             WHERE story_genre.story_id = stories.id
+             ORDER BY story_genre.rowid)) AS genres,
+       (SELECT GROUP_CONCAT(name, '/') FROM
+            (SELECT tags.name FROM story_tag
+                 JOIN tags ON tags.id = story_tag.tag_id
+             WHERE story_tag.story_id = stories.id
+             ORDER BY story_tag.rowid)) AS tags
+FROM stories
+    LEFT JOIN annotation ON annotation.story_id = stories.id
+    LEFT JOIN ifdb_annotation ON ifdb_annotation.story_id = stories.id
+    LEFT JOIN groups ON groups.id = stories.group_id
+    LEFT JOIN series ON series.id = stories.series_id
+    LEFT JOIN forgiveness ON forgiveness.id = stories.forgiveness_id"""
+
+
+# For each facet by which the library may be filtered, a query selecting
+# one (story_id, item_id, item_name) row per value of the facet per story.
+FACET_QUERIES = {
+    "authors": """
+SELECT story_author.story_id AS story_id, authors.id AS item_id,
+       authors.name AS item_name
+FROM story_author JOIN authors ON authors.id = story_author.author_id""",
+    "genres": """
+SELECT story_genre.story_id AS story_id, genres.id AS item_id,
+       genres.name AS item_name
+FROM story_genre JOIN genres ON genres.id = story_genre.genre_id""",
+    "tags": """
+SELECT story_tag.story_id AS story_id, tags.id AS item_id,
+       tags.name AS item_name
+FROM story_tag JOIN tags ON tags.id = story_tag.tag_id""",
+    "groups": """
+SELECT stories.id AS story_id, groups.id AS item_id,
+       groups.name AS item_name
+FROM stories JOIN groups ON groups.id = stories.group_id""",
+    "series": """
+SELECT stories.id AS story_id, series.id AS item_id,
+       series.name AS item_name
+FROM stories JOIN series ON series.id = stories.series_id""",
+    "years": """
+SELECT stories.id AS story_id,
+       CAST(strftime('%Y', firstpublished) AS INTEGER) AS item_id,
+       strftime('%Y', firstpublished) AS item_name
+FROM stories WHERE firstpublished IS NOT NULL""",
+    "forgiveness": """
+SELECT stories.id AS story_id, forgiveness.id AS item_id,
+       forgiveness.description AS item_name
+FROM stories JOIN forgiveness ON forgiveness.id = stories.forgiveness_id""",
+    # Languages have no table of their own, so they stand as their own IDs.
+    "languages": """
+SELECT stories.id AS story_id, stories.language AS item_id,
+       stories.language AS item_name
+FROM stories WHERE language IS NOT NULL AND language != ''"""}
+
 
 def get_db_version(conn):
     c = conn.cursor()
     c.execute("SELECT version FROM grotesque")
-    versions = c.fetchall()
-    versions.sort()
+    versions = [row[0] for row in c.fetchall()]
     if not versions:
         return None
-    return versions[-1][0]
+    return max(versions, key=util.parse_version)
 
 
 def db_version_in_db(conn, version):
@@ -42,7 +122,18 @@ def set_db_version(conn, version):
     if db_version_in_db(conn, version):
         return
     c.execute("INSERT INTO grotesque (version) VALUES (?)", (version,))
-    conn.commit()
+
+
+def get_schema_version(conn):
+    c = conn.cursor()
+    c.execute("PRAGMA user_version")
+    return c.fetchone()[0]
+
+
+def set_schema_version(conn, version):
+    c = conn.cursor()
+    # PRAGMA statements take no parameters.
+    c.execute("PRAGMA user_version={0:d}".format(version))
 
 
 def select_group(conn, group_id):
@@ -70,14 +161,12 @@ def select_all_groups(conn):
 def insert_group(conn, group_name):
     c = conn.cursor()
     c.execute("INSERT INTO groups (name) VALUES (?)", (group_name,))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_group(conn, group_id):
     c = conn.cursor()
     c.execute("DELETE FROM groups WHERE id=?", (group_id,))
-    conn.commit()
 
 
 def select_series(conn, series_id):
@@ -105,14 +194,12 @@ def select_all_series(conn):
 def insert_series(conn, series_name):
     c = conn.cursor()
     c.execute("INSERT INTO series (name) VALUES (?)", (series_name,))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_series(conn, series_id):
     c = conn.cursor()
     c.execute("DELETE FROM series WHERE id=?", (series_id,))
-    conn.commit()
 
 
 def select_forgiveness(conn, forgiveness_id):
@@ -135,13 +222,10 @@ def select_all_forgiveness(conn):
 
 def fill_forgiveness(conn):
     c = conn.cursor()
-    c.execute("INSERT INTO forgiveness (description) VALUES (\"Unknown\")")
-    c.execute("INSERT INTO forgiveness (description) VALUES (\"Merciful\")")
-    c.execute("INSERT INTO forgiveness (description) VALUES (\"Polite\")")
-    c.execute("INSERT INTO forgiveness (description) VALUES (\"Tough\")")
-    c.execute("INSERT INTO forgiveness (description) VALUES (\"Nasty\")")
-    c.execute("INSERT INTO forgiveness (description) VALUES (\"Cruel\")")
-    conn.commit()
+    for description in ["Unknown", "Merciful", "Polite", "Tough",
+                        "Nasty", "Cruel"]:
+        c.execute("INSERT INTO forgiveness (description) VALUES (?)",
+                  (description,))
 
 
 def select_format(conn, format_id):
@@ -170,14 +254,12 @@ def insert_format(conn, name, command):
     c = conn.cursor()
     c.execute("INSERT INTO formats (name, command) VALUES (?, ?)",
               (name, command))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_format(conn, format_id):
     c = conn.cursor()
     c.execute("DELETE FROM formats WHERE id=?", (format_id,))
-    conn.commit()
 
 
 def update_format(conn, format_id, row):
@@ -187,7 +269,6 @@ def update_format(conn, format_id, row):
             continue
         c.execute("UPDATE formats SET {0}=? where id=?".format(key),
                   (row[key], format_id))
-    conn.commit()
 
 
 def select_story(conn, story_id):
@@ -238,6 +319,51 @@ def select_all_story_langs(conn):
     return c.fetchall()
 
 
+def select_library_rows(conn, story_ids=None):
+    """Select everything the library view displays for a set of stories.
+
+    Authors, genres and tags are aggregated into single strings and the
+    annotation, IFDB annotation, group, series and forgiveness values
+    are joined in, so that each story costs one result row rather than
+    a dozen separate queries.  If story_ids is None, every story in the
+    database is selected.
+
+    """
+    c = conn.cursor()
+    if story_ids is None:
+        c.execute(LIBRARY_ROWS_QUERY)
+        return c.fetchall()
+    story_ids = list(story_ids)
+    rows = []
+    for n in range(0, len(story_ids), MAX_QUERY_VARIABLES):
+        chunk = story_ids[n:n + MAX_QUERY_VARIABLES]
+        c.execute("{0} WHERE stories.id IN ({1})".format(
+            LIBRARY_ROWS_QUERY, ", ".join(["?"] * len(chunk))), chunk)
+        rows.extend(c.fetchall())
+    return rows
+
+
+def select_story_facets(conn, facet, story_ids=None):
+    """Select the values of one of the facets in FACET_QUERIES for a set
+    of stories, as (story_id, item_id, item_name) rows.  If story_ids is
+    None, the values of every story in the database are selected.
+
+    """
+    c = conn.cursor()
+    query = FACET_QUERIES[facet]
+    if story_ids is None:
+        c.execute(query)
+        return c.fetchall()
+    story_ids = list(story_ids)
+    rows = []
+    for n in range(0, len(story_ids), MAX_QUERY_VARIABLES):
+        chunk = story_ids[n:n + MAX_QUERY_VARIABLES]
+        c.execute("SELECT * FROM ({0}) WHERE story_id IN ({1})".format(
+            query, ", ".join(["?"] * len(chunk))), chunk)
+        rows.extend(c.fetchall())
+    return rows
+
+
 def insert_story(conn, title, language, headline, firstpublished,
                  group_id, description, series_id, series_number,
                  forgiveness_id, url, bafn, default_release):
@@ -251,14 +377,12 @@ def insert_story(conn, title, language, headline, firstpublished,
               (title, language, headline, firstpublished, group_id,
                description, series_id, series_number, forgiveness_id, url,
                bafn, default_release))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_story(conn, story_id):
     c = conn.cursor()
     c.execute("DELETE FROM stories WHERE id=?", (story_id,))
-    conn.commit()
 
 
 def update_story(conn, story_id, row):
@@ -268,7 +392,6 @@ def update_story(conn, story_id, row):
             continue
         c.execute("UPDATE stories SET {0}=? where id=?".format(key),
                   (row[key], story_id))
-    conn.commit()
 
 
 def select_author(conn, author_id):
@@ -317,14 +440,12 @@ def insert_author(conn, name, email=None, url=None):
     c = conn.cursor()
     c.execute("INSERT INTO authors (name, email, url) VALUES (?, ?, ?)",
               (name, email, url))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_author(conn, author_id):
     c = conn.cursor()
     c.execute("DELETE FROM authors WHERE id=?", (author_id,))
-    conn.commit()
 
 
 def update_author(conn, author_id, row):
@@ -334,14 +455,12 @@ def update_author(conn, author_id, row):
             continue
         c.execute("UPDATE authors SET {0}=? where id=?".format(key),
                   (row[key], author_id))
-    conn.commit()
 
 
 def add_author_to_story(conn, author_id, story_id):
     c = conn.cursor()
     c.execute("INSERT INTO story_author (author_id, story_id) VALUES (?, ?)",
               (author_id, story_id))
-    conn.commit()
 
 
 def remove_author_from_story(conn, author_id, story_id):
@@ -395,44 +514,40 @@ WHERE genres.id = ?""", (genre_id,))
 def insert_genre(conn, name):
     c = conn.cursor()
     c.execute("INSERT INTO genres (name) VALUES (?)", (name,))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_genre(conn, genre_id):
     c = conn.cursor()
     c.execute("DELETE FROM genres WHERE id=?", (genre_id,))
-    conn.commit()
 
 
 def add_genre_to_story(conn, genre_id, story_id):
     c = conn.cursor()
     c.execute("INSERT INTO story_genre (genre_id, story_id) VALUES (?, ?)",
               (genre_id, story_id))
-    conn.commit()
 
 
 def remove_genre_from_story(conn, genre_id, story_id):
     c = conn.cursor()
     c.execute("DELETE FROM story_genre WHERE genre_id=? AND story_id=?",
               (genre_id, story_id))
-    conn.commit()
 
 
-def insert_cover(conn, story_id, img_format, height, width, description, data):
+def insert_cover(conn, story_id, img_format, height, width, description, data,
+                 cover_hash=None):
     c = conn.cursor()
     c.execute("INSERT INTO covers (story_id, format, height, width, "
-              "description, data) VALUES (?, ?, ?, ?, ?, ?)",
+              "description, data, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
               (story_id, img_format, height, width, description,
-               sqlite3.Binary(data)))
-    conn.commit()
+               sqlite3.Binary(data), cover_hash))
     return c.lastrowid
 
 
 def delete_cover(conn, cover_id):
     c = conn.cursor()
     c.execute("DELETE FROM covers WHERE id=?", (cover_id,))
-    conn.commit()
+    c.execute("DELETE FROM cover_thumbnails WHERE cover_id=?", (cover_id,))
 
 
 def update_cover(conn, cover_id, row):
@@ -442,7 +557,6 @@ def update_cover(conn, cover_id, row):
             continue
         c.execute("UPDATE covers SET {0}=? where id=?".format(key),
                   (row[key], cover_id))
-    conn.commit()
 
 
 def select_cover(conn, cover_id):
@@ -457,20 +571,114 @@ def select_cover_by_story(conn, story_id):
     return c.fetchone()
 
 
+def select_cover_info_by_story(conn, story_id):
+    """Select everything about a story's cover but the image itself, plus
+    the size of the image in bytes.
+
+    """
+    c = conn.cursor()
+    c.execute("SELECT id, story_id, format, height, width, description, "
+              "hash, length(data) AS size FROM covers WHERE story_id=?",
+              (story_id,))
+    return c.fetchone()
+
+
+def count_covers_by_hash(conn, cover_hash):
+    c = conn.cursor()
+    c.execute("SELECT count(*) FROM covers WHERE hash=?", (cover_hash,))
+    return c.fetchone()[0]
+
+
+def select_cover_hashes(conn):
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT hash FROM covers WHERE hash IS NOT NULL")
+    return [row[0] for row in c.fetchall()]
+
+
+def select_covers_with_data(conn):
+    """Select the IDs of the covers whose images are kept in the library
+    itself.
+
+    """
+    c = conn.cursor()
+    c.execute("SELECT id FROM covers WHERE hash IS NULL AND length(data) > 0")
+    return [row[0] for row in c.fetchall()]
+
+
+def insert_cover_thumbnail(conn, cover_id, size, img_format, height, width,
+                           data):
+    c = conn.cursor()
+    c.execute("INSERT INTO cover_thumbnails (cover_id, size, format, height, "
+              "width, data) VALUES (?, ?, ?, ?, ?, ?)",
+              (cover_id, size, img_format, height, width,
+               sqlite3.Binary(data)))
+
+
+def delete_cover_thumbnails(conn, cover_id):
+    c = conn.cursor()
+    c.execute("DELETE FROM cover_thumbnails WHERE cover_id=?", (cover_id,))
+
+
+def select_cover_thumbnail(conn, cover_id, min_size):
+    """Select the smallest thumbnail of a cover which is at least min_size
+    pixels, if there is one.
+
+    """
+    c = conn.cursor()
+    c.execute("SELECT * FROM cover_thumbnails WHERE cover_id=? AND size>=? "
+              "ORDER BY size ASC LIMIT 1", (cover_id, min_size))
+    return c.fetchone()
+
+
+def select_story_thumbnails(conn, story_ids, size):
+    """Select the thumbnails of one size of the covers of several stories,
+    each with the ID of its story.  Stories whose covers have no such
+    thumbnail are left out.
+
+    """
+    c = conn.cursor()
+    story_ids = list(story_ids)
+    rows = []
+    for n in range(0, len(story_ids), MAX_QUERY_VARIABLES):
+        chunk = story_ids[n:n + MAX_QUERY_VARIABLES]
+        c.execute("SELECT covers.story_id, cover_thumbnails.* "
+                  "FROM cover_thumbnails JOIN covers "
+                  "ON cover_thumbnails.cover_id=covers.id "
+                  "WHERE cover_thumbnails.size=? AND covers.story_id "
+                  "IN ({0})".format(", ".join(["?"] * len(chunk))),
+                  [size] + chunk)
+        rows.extend(c.fetchall())
+    return rows
+
+
+def select_covers_without_thumbnails(conn, min_size):
+    """Select the IDs of the covers which have an image bigger than
+    min_size pixels but no thumbnails.  Covers which could not be decoded
+    have a thumbnail marking them so, and are not selected.
+
+    """
+    c = conn.cursor()
+    c.execute("SELECT id FROM covers "
+              "WHERE (length(data) > 0 OR hash IS NOT NULL) "
+              "AND format IN ('jpeg', 'png', 'gif') "
+              "AND max(width, height) > ? "
+              "AND id NOT IN (SELECT cover_id FROM cover_thumbnails)",
+              (min_size,))
+    return [row[0] for row in c.fetchall()]
+
+
 def insert_annotation(conn, story_id, rating, rating_txt, notes,
                       played, imported):
     c = conn.cursor()
     c.execute("INSERT INTO annotation (story_id, rating, rating_txt, notes, "
               "played, imported) VALUES (?, ?, ?, ?, ?, ?)",
               (story_id, rating, rating_txt, notes, played, imported))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_annotation(conn, annot_id):
     c = conn.cursor()
     c.execute("DELETE FROM annotation WHERE id=?", (annot_id,))
-    conn.commit()
 
 
 def update_annotation(conn, annot_id, row):
@@ -480,7 +688,6 @@ def update_annotation(conn, annot_id, row):
             continue
         c.execute("UPDATE annotation SET {0}=? where id=?".format(key),
                   (row[key], annot_id))
-    conn.commit()
 
 
 def select_annotation(conn, annot_id):
@@ -505,14 +712,12 @@ def insert_ifdb_annotation(conn, story_id, tuid, url, cover_url,
               "?)",
               (story_id, tuid, url, cover_url, avg_rating, star_rating,
                star_rating_txt, rating_count_avg, rating_count_tot, updated))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_ifdb_annotation(conn, annot_id):
     c = conn.cursor()
     c.execute("DELETE FROM ifdb_annotation WHERE id=?", (annot_id,))
-    conn.commit()
 
 
 def update_ifdb_annotation(conn, annot_id, row):
@@ -522,7 +727,6 @@ def update_ifdb_annotation(conn, annot_id, row):
             continue
         c.execute("UPDATE ifdb_annotation SET {0}=? where id=?".format(key),
                   (row[key], annot_id))
-    conn.commit()
 
 
 def select_ifdb_annotation(conn, annot_id):
@@ -545,14 +749,12 @@ def insert_release(conn, ifid, story_id, uri, version, release_date, compiler,
               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
               (ifid, story_id, uri, version, release_date, compiler,
                compiler_version, comment, format_id))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_release(conn, ifid):
     c = conn.cursor()
     c.execute("DELETE FROM releases WHERE ifid=?", (ifid,))
-    conn.commit()
 
 
 def update_release(conn, ifid, row):
@@ -562,7 +764,6 @@ def update_release(conn, ifid, row):
             continue
         c.execute("UPDATE releases SET {0}=? where ifid=?".format(key),
                   (row[key], ifid))
-    conn.commit()
 
 
 def select_release(conn, ifid):
@@ -583,6 +784,45 @@ def select_release_by_uri(conn, uri):
     return c.fetchone()
 
 
+def select_all_release_uris(conn):
+    c = conn.cursor()
+    c.execute("SELECT ifid, uri, missing FROM releases WHERE uri IS NOT NULL")
+    return c.fetchall()
+
+
+def move_release_uris(conn, old_path, new_path):
+    """Point the releases of a moved file, or of all the files below a
+    moved directory, to their new location.
+
+    """
+    old_path = util.decode_path(old_path)
+    new_path = util.decode_path(new_path)
+    prefix = os.path.join(old_path, "")
+    c = conn.cursor()
+    for table, column in [("releases", "uri"), ("file_analysis", "path")]:
+        c.execute("UPDATE {0} SET {1}=? WHERE {1}=?".format(table, column),
+                  (new_path, old_path))
+        c.execute("UPDATE {0} SET {1}=? || substr({1}, ?) "
+                  "WHERE substr({1}, 1, ?)=?".format(table, column),
+                  (os.path.join(new_path, ""), len(prefix) + 1, len(prefix),
+                   prefix))
+
+
+def flag_release_uris_missing(conn, path):
+    """Flag the releases of a deleted file, or of all the files below a
+    deleted directory, as missing.
+
+    """
+    path = util.decode_path(path)
+    prefix = os.path.join(path, "")
+    # The files below the directory are those which sort after "path/"
+    # and before "path0", which the index on uri can look up.
+    c = conn.cursor()
+    c.execute("UPDATE releases SET missing=1 "
+              "WHERE uri=? OR (uri>? AND uri<?)",
+              (path, prefix, path + unichr(ord(os.sep) + 1)))
+
+
 def select_tag(conn, tag_id):
     c = conn.cursor()
     c.execute("SELECT * FROM tags WHERE id=?", (tag_id,))
@@ -628,21 +868,18 @@ def select_all_tags(conn):
 def insert_tag(conn, name):
     c = conn.cursor()
     c.execute("INSERT INTO tags (name) VALUES (?)", (name,))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_tag(conn, tag_id):
     c = conn.cursor()
     c.execute("DELETE FROM tags WHERE id=?", (tag_id,))
-    conn.commit()
 
 
 def add_tag_to_story(conn, tag_id, story_id):
     c = conn.cursor()
     c.execute("INSERT INTO story_tag (tag_id, story_id) VALUES (?, ?)",
               (tag_id, story_id))
-    conn.commit()
 
 
 def remove_tag_from_story(conn, tag_id, story_id):
@@ -655,14 +892,12 @@ def insert_resource(conn, story_id, uri):
     c = conn.cursor()
     c.execute("INSERT INTO resources (story_id, uri) VALUES (?, ?)",
               (story_id, uri))
-    conn.commit()
     return c.lastrowid
 
 
 def delete_resource(conn, res_id):
     c = conn.cursor()
     c.execute("DELETE FROM resources WHERE id=?", (res_id,))
-    conn.commit()
 
 
 def update_resource(conn, res_id, row):
@@ -672,7 +907,6 @@ def update_resource(conn, res_id, row):
             continue
         c.execute("UPDATE resources SET {0}=? where id=?".format(key),
                   (row[key], res_id))
-    conn.commit()
 
 
 def select_resource(conn, res_id):
@@ -693,3 +927,28 @@ def select_resources_by_story(conn, story_id):
     return c.fetchall()
 
 
+def select_file_analysis(conn, path):
+    c = conn.cursor()
+    c.execute("SELECT * FROM file_analysis WHERE path=?", (path,))
+    return c.fetchone()
+
+
+def replace_file_analysis(conn, path, size, mtime, file_hash, file_format,
+                          ifids, meta, cover_offset, cover_length,
+                          cover_format, cover_height, cover_width,
+                          cover_description):
+    if meta is not None:
+        meta = sqlite3.Binary(meta)
+    c = conn.cursor()
+    c.execute("INSERT OR REPLACE INTO file_analysis (path, size, mtime, "
+              "hash, format, ifids, meta, cover_offset, cover_length, "
+              "cover_format, cover_height, cover_width, cover_description) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              (path, size, mtime, file_hash, file_format, ifids, meta,
+               cover_offset, cover_length, cover_format, cover_height,
+               cover_width, cover_description))
+
+
+def delete_file_analysis(conn, path):
+    c = conn.cursor()
+    c.execute("DELETE FROM file_analysis WHERE path=?", (path,))
@@ -123,6 +123,7 @@ CREATE TABLE IF NOT EXISTS covers (
     width INTEGER,
     description TEXT,
     data BLOB,
+    hash TEXT,
     PRIMARY KEY (id ASC)
     CONSTRAINT story_key
         FOREIGN KEY (story_id)
@@ -217,6 +218,7 @@ CREATE TABLE IF NOT EXISTS releases (
     compiler_version TEXT,
     comment TEXT,
     format_id INTEGER,
+    missing INTEGER DEFAULT 0,
     PRIMARY KEY (ifid),
     CONSTRAINT story_key
         FOREIGN KEY (story_id)
@@ -269,9 +271,107 @@ CREATE TABLE IF NOT EXISTS resources (
 )"""
 
 
+# What was found in each story file the last time it was analysed, so that
+# unchanged files need not be parsed again.  A row is only valid for as long
+# as the file's size and modification time, or failing those its SHA-1
+# hash, are unchanged.  The cover art is located within the file rather
+# than copied.
+FILE_ANALYSIS_TABLE = """
+CREATE TABLE IF NOT EXISTS file_analysis (
+    path TEXT,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT,
+    format TEXT,
+    ifids TEXT,
+    meta BLOB,
+    cover_offset INTEGER,
+    cover_length INTEGER,
+    cover_format TEXT,
+    cover_height INTEGER,
+    cover_width INTEGER,
+    cover_description TEXT,
+    PRIMARY KEY (path)
+)"""
+
+
+COVER_THUMBNAILS_TABLE = """
+CREATE TABLE IF NOT EXISTS cover_thumbnails (
+    cover_id INTEGER,
+    size INTEGER,
+    format TEXT,
+    height INTEGER,
+    width INTEGER,
+    data BLOB,
+    PRIMARY KEY (cover_id, size)
+)"""
+
+
 TABLES = [GROTESQUE_TABLE, STORIES_TABLE, AUTHORS_TABLE,
           STORY_AUTHOR_TABLE, GROUPS_TABLE, SERIES_TABLE,
           FORGIVENESS_TABLE, COVERS_TABLE, FORMATS_TABLE,
           GENRES_TABLE, STORY_GENRE_TABLE, ANNOTATION_TABLE,
           IFDB_ANNOTATION_TABLE, RELEASES_TABLE, TAGS_TABLE,
-          STORY_TAG_TABLE, RESOURCES_TABLE]
+          STORY_TAG_TABLE, RESOURCES_TABLE, FILE_ANALYSIS_TABLE,
+          COVER_THUMBNAILS_TABLE]
+
+
+# Indexes on every column that the queries in query.py look rows up by or
+# join on.  Primary keys are indexed by SQLite already.
+LOOKUP_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS stories_title_idx ON stories (title)",
+    "CREATE INDEX IF NOT EXISTS stories_title_nocase_idx "
+    "ON stories (title COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS stories_group_idx ON stories (group_id)",
+    "CREATE INDEX IF NOT EXISTS stories_series_idx ON stories (series_id)",
+    "CREATE INDEX IF NOT EXISTS authors_name_idx ON authors (name)",
+    "CREATE INDEX IF NOT EXISTS story_author_story_idx "
+    "ON story_author (story_id, author_id)",
+    "CREATE INDEX IF NOT EXISTS story_author_author_idx "
+    "ON story_author (author_id)",
+    "CREATE INDEX IF NOT EXISTS groups_name_idx ON groups (name)",
+    "CREATE INDEX IF NOT EXISTS series_name_idx ON series (name)",
+    "CREATE INDEX IF NOT EXISTS forgiveness_description_idx "
+    "ON forgiveness (description)",
+    "CREATE INDEX IF NOT EXISTS covers_story_idx ON covers (story_id)",
+    "CREATE INDEX IF NOT EXISTS formats_name_idx ON formats (name)",
+    "CREATE INDEX IF NOT EXISTS genres_name_idx ON genres (name)",
+    "CREATE INDEX IF NOT EXISTS story_genre_story_idx "
+    "ON story_genre (story_id, genre_id)",
+    "CREATE INDEX IF NOT EXISTS story_genre_genre_idx "
+    "ON story_genre (genre_id)",
+    "CREATE INDEX IF NOT EXISTS annotation_story_idx "
+    "ON annotation (story_id)",
+    "CREATE INDEX IF NOT EXISTS ifdb_annotation_story_idx "
+    "ON ifdb_annotation (story_id)",
+    "CREATE INDEX IF NOT EXISTS releases_story_idx ON releases (story_id)",
+    "CREATE INDEX IF NOT EXISTS releases_uri_idx ON releases (uri)",
+    "CREATE INDEX IF NOT EXISTS tags_name_idx ON tags (name)",
+    "CREATE INDEX IF NOT EXISTS story_tag_story_idx "
+    "ON story_tag (story_id, tag_id)",
+    "CREATE INDEX IF NOT EXISTS story_tag_tag_idx ON story_tag (tag_id)",
+    "CREATE INDEX IF NOT EXISTS resources_story_idx "
+    "ON resources (story_id)",
+    "CREATE INDEX IF NOT EXISTS resources_uri_idx ON resources (uri)"]
+
+
+COVERS_HASH_INDEX = ("CREATE INDEX IF NOT EXISTS covers_hash_idx "
+                     "ON covers (hash)")
+
+
+INDEXES = LOOKUP_INDEXES + [COVERS_HASH_INDEX]
+
+
+# Changes to the schema of existing databases, keyed on the schema version
+# (as recorded in the database's user_version) which they bring it up to
+# and applied in order.  The schema version is kept apart from the version
+# of Grotesque in the grotesque table.  Each step is either an SQL
+# statement or a function which takes the database connection.  New
+# databases are created with the complete schema above, so a migration's
+# statements must also be reflected in TABLES or INDEXES.
+MIGRATIONS = [
+    (1, LOOKUP_INDEXES),
+    (2, [FILE_ANALYSIS_TABLE]),
+    (3, ["ALTER TABLE releases ADD COLUMN missing INTEGER DEFAULT 0"]),
+    (4, [COVER_THUMBNAILS_TABLE]),
+    (5, ["ALTER TABLE covers ADD COLUMN hash TEXT", COVERS_HASH_INDEX])]
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+#       sync.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Synchronisation of the library with the story files kept in a set of
+library folders.
+
+A scan lists every file below the folders whose extension is that of a
+story format.  Files which are not yet in the library can then be
+imported, while releases whose files are no longer there are flagged as
+missing rather than removed, since the folder may only be unmounted.
+
+"""
+
+
+import functools
+import os
+from multiprocessing.pool import ThreadPool
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+from grotesque import util
+import query
+
+
+# The number of directories which are scanned at once.
+SCAN_THREADS = 4
+
+
+def get_story_exts(settings):
+    exts = set()
+    for if_format, format_exts in settings.get_all_exts():
+        for ext in format_exts.split(','):
+            ext = ext.strip().lower()
+            if ext:
+                exts.add(ext)
+    return exts
+
+
+def is_story_file(path, exts):
+    return os.path.splitext(path)[1].lower() in exts
+
+
+def _list_dir(path):
+    """List a directory as (path, is_dir) pairs.  Like os.walk, symbolic
+    links to directories are not followed.
+
+    """
+    if scandir is not None:
+        return [(entry.path, entry.is_dir(follow_symlinks=False))
+                for entry in scandir(path)]
+    entries = []
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        entries.append((entry_path, os.path.isdir(entry_path) and
+                        not os.path.islink(entry_path)))
+    return entries
+
+
+def _scan_dir(exts, top):
+    files = []
+    dirs = [top]
+    pending = [top]
+    while pending:
+        try:
+            entries = _list_dir(pending.pop())
+        except OSError:
+            continue
+        for path, is_dir in entries:
+            if is_dir:
+                dirs.append(path)
+                pending.append(path)
+            elif is_story_file(path, exts):
+                files.append(path)
+    return (files, dirs)
+
+
+def scan_dirs(library_dirs, exts, threads=SCAN_THREADS):
+    """Find the story files below the library folders, returning them
+    along with all the directories that were scanned.  The subdirectories
+    of the folders are scanned in parallel.
+
+    """
+    files = []
+    dirs = []
+    tops = []
+    for library_dir in library_dirs:
+        library_dir = os.path.realpath(library_dir)
+        if not os.path.isdir(library_dir):
+            continue
+        dirs.append(library_dir)
+        for path, is_dir in _list_dir(library_dir):
+            if is_dir:
+                tops.append(path)
+            elif is_story_file(path, exts):
+                files.append(path)
+    if not tops:
+        return (files, dirs)
+    pool = ThreadPool(min(threads, len(tops)))
+    try:
+        for top_files, top_dirs in pool.imap_unordered(
+                functools.partial(_scan_dir, exts), tops):
+            files.extend(top_files)
+            dirs.extend(top_dirs)
+    finally:
+        pool.close()
+        pool.join()
+    return (files, dirs)
+
+
+def find_new_files(conn, paths):
+    """Return those of the paths which no release of the library points
+    to.
+
+    """
+    known = set(row["uri"] for row in query.select_all_release_uris(conn))
+    return [path for path in paths if util.decode_path(path) not in known]
+
+
+def _is_below(path, dirs):
+    for library_dir in dirs:
+        if path == library_dir or path.startswith(os.path.join(library_dir,
+                                                               "")):
+            return True
+    return False
+
+
+def flag_missing_releases(conn, library_dirs, paths):
+    """Flag the releases whose files are below the library folders but are
+    not among the paths found there as missing, and clear the flag of
+    those which are.  Returns the IFIDs of the releases whose flag
+    changed.
+
+    """
+    library_dirs = [util.decode_path(os.path.realpath(library_dir))
+                    for library_dir in library_dirs]
+    found = set(util.decode_path(path) for path in paths)
+    changed = []
+    with conn.transaction():
+        for row in query.select_all_release_uris(conn):
+            if not _is_below(row["uri"], library_dirs):
+                continue
+            missing = row["uri"] not in found
+            if bool(row["missing"]) != missing:
+                query.update_release(conn, row["ifid"], {"missing": missing})
+                changed.append(row["ifid"])
+    return changed
+
+
+def flag_deleted_files(conn, paths):
+    """Flag the releases of files which have been deleted, or of all the
+    files below deleted directories, as missing.  Unlike
+    flag_missing_releases(), only the releases at those paths are looked
+    at.
+
+    """
+    with conn.transaction():
+        for path in paths:
+            query.flag_release_uris_missing(conn, path)
+
+
+def move_files(conn, old_path, new_path):
+    """Follow a file or a directory which has been moved or renamed."""
+    with conn.transaction():
+        query.move_release_uris(conn, old_path, new_path)
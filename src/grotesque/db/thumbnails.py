@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+#       thumbnails.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Thumbnails of cover art, in a few sizes, so that a cover can be shown
+without reading and decoding the original image, which may be several
+megabytes.
+
+Decoding and scaling a cover takes far too long to be done while a
+transaction is open, so a cover is stored without thumbnails.  They are
+made afterwards, in the background, by make_cover_thumbnails(), which
+only holds a transaction to write them.  Until then, covers are shown
+from the original image.  A cover whose image cannot be read or decoded
+is given a single empty thumbnail of size FAILED_SIZE instead, so that
+it is not tried again until its image is replaced.
+
+"""
+
+
+import warnings
+try:
+    from gi.repository import GdkPixbuf, GLib
+except ImportError:
+    GdkPixbuf = None
+
+import query
+import coverstore
+
+
+# The sizes of the thumbnails, in pixels, that neither their width nor
+# their height exceeds.  Covers no bigger than a size get no thumbnail of
+# that size, since the original will do.
+THUMBNAIL_SIZES = [128, 256, 512]
+JPEG_QUALITY = 90
+# The size of the thumbnail which marks a cover as unreadable.  No
+# thumbnail is ever looked up by so small a size.
+FAILED_SIZE = 0
+
+
+def _scaled_size(width, height, size):
+    if width >= height:
+        return (size, max(1, int(round(float(height) * size / width))))
+    return (max(1, int(round(float(width) * size / height))), size)
+
+
+def make_thumbnails(data, img_format):
+    """Return a (size, format, width, height, data) tuple for each of the
+    thumbnails of a cover.  JPEG covers get JPEG thumbnails; the others
+    get PNG thumbnails, so as to keep any transparency.
+
+    """
+    if GdkPixbuf is None or not data:
+        return []
+    try:
+        pixbuf_loader = GdkPixbuf.PixbufLoader.new_with_type(img_format)
+        pixbuf_loader.write(data)
+        pixbuf_loader.close()
+        pixbuf = pixbuf_loader.get_pixbuf()
+    except GLib.GError as e:
+        warnings.warn("could not decode the cover: {0}".format(e))
+        return []
+    if img_format == "jpeg":
+        thumb_format = "jpeg"
+        options = (["quality"], [str(JPEG_QUALITY)])
+    else:
+        thumb_format = "png"
+        options = ([], [])
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+    thumbnails = []
+    # Scale each thumbnail from the next bigger one, which is much quicker
+    # than scaling them all from the original.
+    for size in reversed(THUMBNAIL_SIZES):
+        if max(width, height) <= size:
+            continue
+        thumb_width, thumb_height = _scaled_size(width, height, size)
+        pixbuf = pixbuf.scale_simple(thumb_width, thumb_height,
+                                     GdkPixbuf.InterpType.TILES)
+        width, height = thumb_width, thumb_height
+        _, thumb_data = pixbuf.save_to_bufferv(thumb_format, *options)
+        thumbnails.append((size, thumb_format, width, height, thumb_data))
+    return thumbnails
+
+
+def can_make_thumbnails():
+    """Return whether thumbnails can be made, which takes GdkPixbuf."""
+    return GdkPixbuf is not None
+
+
+def select_covers_to_thumbnail(conn):
+    """Select the IDs of the covers which should have thumbnails but have
+    none, such as those stored since the thumbnails were last made or
+    those of libraries created before there were thumbnails.
+
+    """
+    return query.select_covers_without_thumbnails(conn, min(THUMBNAIL_SIZES))
+
+
+def _same_image(cover_row, other_row):
+    return (cover_row["hash"] == other_row["hash"] and
+            str(cover_row["data"] or "") == str(other_row["data"] or ""))
+
+
+def make_cover_thumbnails(reader, writer, cover_id):
+    """Make the thumbnails of a cover, reading it with one connection and
+    writing its thumbnails with another.  The cover is decoded and scaled
+    outside of any transaction, and the thumbnails are not written if the
+    cover has changed in the meantime.  If the cover cannot be decoded, it
+    is marked as such.  Returns whether any thumbnails were written.
+
+    """
+    if not can_make_thumbnails():
+        return False
+    cover_row = query.select_cover(reader, cover_id)
+    if cover_row is None:
+        return False
+    thumbnails = make_thumbnails(coverstore.read_cover(reader, cover_row),
+                                 cover_row["format"])
+    with writer.transaction():
+        current_row = query.select_cover(writer, cover_id)
+        if current_row is None or not _same_image(cover_row, current_row):
+            return False
+        query.delete_cover_thumbnails(writer, cover_id)
+        if not thumbnails:
+            query.insert_cover_thumbnail(writer, cover_id, FAILED_SIZE, None,
+                                         None, None, "")
+            return False
+        for size, thumb_format, width, height, thumb_data in thumbnails:
+            query.insert_cover_thumbnail(writer, cover_id, size,
+                                         thumb_format, height, width,
+                                         thumb_data)
+    return True
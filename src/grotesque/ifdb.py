@@ -20,9 +20,508 @@
 #       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import urllib2
+import httplib
+import random
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import urlparse
+import warnings
+import Queue
 from treatyofbabel import ifiction
 from treatyofbabel.babelerrors import IFictionError
+from ifdbmirror import Mirror
+
+
+# The default number of requests per minute which may be made to IFDB.
+DEFAULT_REQUEST_LIMIT = 30
+# The number of threads which run requests in the background.
+WORKERS = 4
+# How long, in seconds, to wait on IFDB before giving up on a request.
+REQUEST_TIMEOUT = 10
+# The number of redirects to follow for a single request.
+MAX_REDIRECTS = 5
+# A request which fails for a reason that may be temporary is tried again
+# up to RETRIES times, after a random delay of up to RETRY_DELAY seconds,
+# doubling with each attempt.
+RETRIES = 2
+RETRY_DELAY = 1.0
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+# Once FAILURE_THRESHOLD requests in a row have failed, IFDB is left alone
+# for COOLDOWN seconds.
+FAILURE_THRESHOLD = 5
+COOLDOWN = 300
+
+
+class TokenBucket:
+    """Spaces out requests so that no more than rate of them are made per
+    period seconds on average, allowing bursts of up to capacity requests
+    after a quiet spell.
+
+    """
+    def __init__(self, rate, period=60.0, capacity=1):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last = time.time()
+        self.set_rate(rate, period)
+
+    def set_rate(self, rate, period=60.0):
+        if rate <= 0:
+            raise ValueError("The request rate must be greater than 0")
+        with self.lock:
+            self.interval = float(period) / rate
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens +
+                                  (now - self.last) / self.interval)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+
+# Every request to IFDB, from whichever thread, is paced by this bucket.
+limiter = TokenBucket(DEFAULT_REQUEST_LIMIT)
+
+
+def set_request_limit(limit):
+    """Set the number of requests per minute which may be made to IFDB."""
+    limiter.set_rate(limit)
+
+
+# How long, in seconds, a cached response is used without asking IFDB
+# whether it has changed.
+IFICTION_TTL = 7 * 24 * 60 * 60
+COVER_TTL = 30 * 24 * 60 * 60
+# The default size, in bytes, above which the least recently used
+# responses are dropped from the cache.
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+RESPONSES_TABLE = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT,
+    data BLOB,
+    etag TEXT,
+    last_modified TEXT,
+    fetched REAL,
+    accessed REAL,
+    size INTEGER,
+    PRIMARY KEY (url)
+)"""
+
+
+class ResponseCache:
+    """Keeps the responses to IFDB requests on disk, keyed on their URL
+    (and so on the IFID, TUID or cover art URL asked for), along with
+    the validators needed to ask IFDB whether they have changed.
+
+    """
+    def __init__(self, filename, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute(RESPONSES_TABLE)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS "
+                              "responses_accessed_idx "
+                              "ON responses (accessed)")
+
+    def get(self, url):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT * FROM responses WHERE url=?",
+                                    (url,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE responses SET accessed=? "
+                                  "WHERE url=?", (time.time(), url))
+        return row
+
+    def put(self, url, data, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, data, etag, "
+                "last_modified, fetched, accessed, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, sqlite3.Binary(data), etag, last_modified, now, now,
+                 len(data)))
+            self._evict()
+
+    def revalidated(self, url):
+        """Record that IFDB has confirmed a cached response to be
+        current.
+
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE responses SET fetched=?, accessed=? "
+                              "WHERE url=?", (now, now, url))
+
+    def _evict(self):
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self.conn.execute(
+            "SELECT url, size FROM responses ORDER BY accessed ASC").fetchall()
+        for row in rows:
+            if total <= self.max_size:
+                break
+            self.conn.execute("DELETE FROM responses WHERE url=?",
+                              (row["url"],))
+            total -= row["size"]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ConnectionPool:
+    """Keeps persistent HTTP(S) connections to the hosts requests are made
+    to, so that consecutive requests do not each pay for a new TCP and
+    TLS handshake.  At most size idle connections are kept per host.
+
+    """
+    def __init__(self, size=WORKERS, timeout=REQUEST_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _get(self, key):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self._connect(key), False
+
+    def _put(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.size:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _request(self, key, path, headers):
+        conn, reused = self._get(key)
+        try:
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                if not reused:
+                    raise
+                # The server may have closed the connection while it sat
+                # idle, so try again once on a fresh one.
+                conn.close()
+                conn = self._connect(key)
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return response, data
+
+    def get(self, url, headers=None):
+        """Make a GET request, following any redirects, and return the
+        response and its body.
+
+        """
+        if headers is None:
+            headers = {}
+        for i in range(MAX_REDIRECTS + 1):
+            parts = urlparse.urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port)
+            path = parts.path or "/"
+            if parts.query:
+                path = "?".join([path, parts.query])
+            response, data = self._request(key, path, headers)
+            location = response.getheader("Location")
+            if response.status not in (301, 302, 303, 307, 308) or \
+                    not location:
+                return response, data
+            url = urlparse.urljoin(url, location)
+        raise httplib.HTTPException("Too many redirects")
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+
+# Requests from all of the worker threads share these connections.
+pool = ConnectionPool()
+
+
+class CircuitBreaker:
+    """Stops requests being made once threshold of them in a row have
+    failed, so that while IFDB is down every story does not have to wait
+    out its own timeouts.  After cooldown seconds, a single request is let
+    through to find out whether it is back.
+
+    """
+    def __init__(self, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    def allow(self):
+        """Return whether a request may be made."""
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.time() - self.opened < self.cooldown:
+                return False
+            self.trial = True
+            return True
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def end_trial(self):
+        """Stop waiting on the request let through by allow(), if it
+        ended without succeeding or failing, and start another cooldown.
+
+        """
+        with self.lock:
+            if self.trial:
+                self.trial = False
+                self.opened = time.time()
+
+    def failed(self):
+        """Record a failed request.  Returns True if this has made the
+        breaker stop requests.
+
+        """
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.opened is not None:
+                self.opened = time.time()
+                return False
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+                return True
+            return False
+
+
+breaker = CircuitBreaker()
+
+
+# The cache is only used once it has been opened with open_cache().  In
+# offline mode, only cached responses are used, however old.
+cache = None
+offline = False
+
+
+def open_cache(filename, max_size=DEFAULT_CACHE_SIZE):
+    global cache
+    if cache is not None:
+        cache.close()
+    cache = ResponseCache(filename, max_size)
+
+
+def set_offline(is_offline):
+    global offline
+    offline = is_offline
+
+
+# Stories are looked up in the local mirror of IFDB, if there is one,
+# before going to the network.
+mirror = None
+
+
+def open_mirror(filename):
+    global mirror
+    if mirror is not None:
+        mirror.close()
+    mirror = Mirror(filename)
+
+
+def _fetch_url(url, ttl):
+    """Fetch a URL, going through the response cache.  Returns None if
+    the URL could not be fetched and there is nothing cached for it.
+
+    """
+    if cache is not None:
+        cached = cache.get(url)
+    else:
+        cached = None
+    if cached is not None and (offline or
+                               time.time() - cached["fetched"] < ttl):
+        return str(cached["data"])
+    if offline:
+        return None
+    if not breaker.allow():
+        # IFDB is down, so make do with whatever was fetched before.
+        if cached is not None:
+            return str(cached["data"])
+        return None
+    headers = {}
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        try:
+            response, data = _get_with_retries(url, headers)
+        except (httplib.HTTPException, socket.error):
+            response = None
+        if response is None or response.status in TRANSIENT_STATUSES:
+            if breaker.failed():
+                warnings.warn("IFDB is not responding; not using it for "
+                              "{0} seconds".format(breaker.cooldown))
+            if cached is not None:
+                return str(cached["data"])
+            return None
+        breaker.succeeded()
+    finally:
+        # Any other error would otherwise leave the breaker waiting on
+        # its trial request for good.
+        breaker.end_trial()
+    if response.status == 304 and cached is not None:
+        cache.revalidated(url)
+        return str(cached["data"])
+    if response.status != 200:
+        return None
+    if cache is not None:
+        cache.put(url, data, response.getheader("ETag"),
+                  response.getheader("Last-Modified"))
+    return data
+
+
+def _get_with_retries(url, headers):
+    for attempt in range(RETRIES + 1):
+        if attempt > 0:
+            time.sleep(random.uniform(0, RETRY_DELAY * 2 ** (attempt - 1)))
+        limiter.acquire()
+        try:
+            response, data = pool.get(url, headers)
+        except (httplib.HTTPException, socket.error):
+            if attempt == RETRIES:
+                raise
+            continue
+        if response.status not in TRANSIENT_STATUSES:
+            break
+    return response, data
+
+
+class Request:
+    """A call to one of the fetch functions which is run in the
+    background.  Once it has finished, "result" holds what the function
+    returned, or "error" the exception that it raised.
+
+    """
+    def __init__(self, function, args, kwargs, callback):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error = e
+        self.finished.set()
+        if self.callback is not None:
+            # The callback runs on one of the client's workers, which must
+            # outlive it.
+            try:
+                self.callback(self)
+            except Exception:
+                warnings.warn("error in the callback of an IFDB "
+                              "request:\n{0}".format(traceback.format_exc()))
+
+    def wait(self, timeout=None):
+        self.finished.wait(timeout)
+        return self.finished.is_set()
+
+
+class Client:
+    """Runs IFDB requests on a few worker threads fed from a queue, so that
+    only the requests themselves wait on the network and on the request
+    limit.
+
+    The callback of a request is called from a worker thread; user
+    interface code should hand the result over to its main loop.
+
+    """
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.requests = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _start_workers(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            request = self.requests.get()
+            request.run()
+
+    def submit(self, function, args=(), kwargs=None, callback=None):
+        """Queue a call to function (one of the fetch functions of this
+        module), returning its Request.
+
+        """
+        if not self.threads:
+            self._start_workers()
+        request = Request(function, args, kwargs or {}, callback)
+        self.requests.put(request)
+        return request
+
+
+_client = None
+
+
+def get_client():
+    """Return the client shared by the whole program."""
+    global _client
+    if _client is None:
+        _client = Client()
+    return _client
 
 
 def fetch_ifiction(ifid=None, tuid=None):
@@ -43,11 +542,13 @@ def fetch_ifiction(ifid=None, tuid=None):
     else:
         url = ''.join(['https://ifdb.tads.org/viewgame?ifiction&ifid=',
                        ifid])
-    try:
-        ific = urllib2.urlopen(url)
-    except urllib2.HTTPError:
+    ificstring = None
+    if mirror is not None:
+        ificstring = mirror.get_ifiction(ifid=ifid, tuid=tuid)
+    if ificstring is None:
+        ificstring = _fetch_url(url, IFICTION_TTL)
+    if ificstring is None:
         return None
-    ificstring = ific.read()
     try:
         ificdom = ifiction.get_ifiction_dom(ificstring)
     except IFictionError:
@@ -71,12 +572,47 @@ def fetch_cover(url=None, tuid=None, ifid=None):
     else:
         cover_url = ''.join(["https://ifdb.tads.org/viewgame?ifiction&ifid=",
                              ifid, "&coverart"])
-    try:
-        cover_file = urllib2.urlopen(cover_url)
-    except urllib2.HTTPError:
-        return None
-    cover_data = cover_file.read()
+    cover_data = None
+    if mirror is not None and url is None:
+        cover_data = mirror.get_cover(ifid=ifid, tuid=tuid)
+    if cover_data is None:
+        cover_data = _fetch_url(cover_url, COVER_TTL)
     if cover_data in ["No game was found matching the requested IFID.",
                       "No image is available"]:
         cover_data = None
     return cover_data
+
+
+def fetch_story_cover(ific_story):
+    """Fetch the cover art of a story whose IFiction came from IFDB."""
+    annotation = ifiction.get_annotation(ific_story)
+    if annotation is None or "ifdb" not in annotation:
+        return None
+    if mirror is not None and "tuid" in annotation["ifdb"]:
+        cover_data = mirror.get_cover(tuid=annotation["ifdb"]["tuid"])
+        if cover_data is not None:
+            return cover_data
+    if "cover_url" in annotation["ifdb"]:
+        return fetch_cover(url=annotation["ifdb"]["cover_url"])
+    elif "tuid" in annotation["ifdb"]:
+        return fetch_cover(tuid=annotation["ifdb"]["tuid"])
+    return None
+
+
+def fetch_story(ifids, fetch_coverart=False):
+    """Fetch the IFiction of the first of the IFIDs that IFDB knows and,
+    optionally, its cover art.  Returns (ific_story, ifid, cover_data),
+    where all three are None if none of the IFIDs was found.
+
+    """
+    for ifid in ifids:
+        ific_story = fetch_ifiction(ifid=ifid)
+        if ific_story is not None:
+            break
+    else:
+        return (None, None, None)
+    if fetch_coverart:
+        cover_data = fetch_story_cover(ific_story)
+    else:
+        cover_data = None
+    return (ific_story, ifid, cover_data)
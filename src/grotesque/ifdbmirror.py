@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+#       ifdbmirror.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""A local copy of IFDB's metadata, built from a bulk iFiction dump, so
+that stories can be looked up without going to the network.
+
+To create or refresh the mirror from a newer dump, run:
+
+    python -m grotesque.ifdbmirror DUMP.xml [--covers DIRECTORY]
+
+where DIRECTORY optionally holds cover art named after each story's
+TUID (e.g. "abc123xyz.jpg").  Stories whose records have not changed
+since the last update are skipped, and stories which are no longer in
+the dump, or covers which are no longer in the directory, are removed.
+
+"""
+
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import xml.etree.cElementTree as ElementTree
+
+
+IFICTION_NS = "http://babel.ifarchive.org/protocol/iFiction/"
+# Write the changes to the mirror every so many stories.
+UPDATE_BATCH_SIZE = 500
+
+
+TABLES = [
+    """
+CREATE TABLE IF NOT EXISTS stories (
+    tuid TEXT,
+    ifiction TEXT,
+    digest TEXT,
+    PRIMARY KEY (tuid)
+)""",
+    """
+CREATE TABLE IF NOT EXISTS ifids (
+    ifid TEXT,
+    tuid TEXT,
+    PRIMARY KEY (ifid)
+)""",
+    "CREATE INDEX IF NOT EXISTS ifids_tuid_idx ON ifids (tuid)",
+    """
+CREATE TABLE IF NOT EXISTS covers (
+    tuid TEXT,
+    data BLOB,
+    digest TEXT,
+    PRIMARY KEY (tuid)
+)"""]
+
+
+ElementTree.register_namespace("", IFICTION_NS)
+
+
+def _tag(name):
+    return "{{{0}}}{1}".format(IFICTION_NS, name)
+
+
+def _story_ifiction(story):
+    """Wrap a single <story> element up as an iFiction document, as IFDB
+    itself would return it.
+
+    """
+    story_xml = ElementTree.tostring(story, encoding="utf-8")
+    # tostring() puts an XML declaration first, which must go.
+    if story_xml.startswith("<?xml"):
+        story_xml = story_xml[story_xml.index("?>") + 2:].lstrip()
+    return "".join(['<?xml version="1.0" encoding="UTF-8"?>',
+                    '<ifindex version="1.0" xmlns="', IFICTION_NS, '">',
+                    story_xml, '</ifindex>'])
+
+
+def _read_covers(cover_dir):
+    covers = {}
+    for name in os.listdir(cover_dir):
+        tuid, ext = os.path.splitext(name)
+        if ext.lower() in [".jpg", ".jpeg", ".png", ".gif"]:
+            covers[tuid] = os.path.join(cover_dir, name)
+    return covers
+
+
+class Mirror:
+    """The mirror lives in its own SQLite file, apart from the library.
+    Lookups may be made from any thread.
+
+    """
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.conn:
+            for table in TABLES:
+                self.conn.execute(table)
+
+    def get_ifiction(self, ifid=None, tuid=None):
+        """Return the iFiction of a story, as a string, or None if it is
+        not in the mirror.
+
+        """
+        with self.lock:
+            if tuid is not None:
+                row = self.conn.execute(
+                    "SELECT ifiction FROM stories WHERE tuid=?",
+                    (tuid,)).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT ifiction FROM stories JOIN ifids USING (tuid) "
+                    "WHERE ifid=?", (ifid.upper(),)).fetchone()
+        if row is None:
+            return None
+        return row[0].encode("utf-8")
+
+    def get_cover(self, ifid=None, tuid=None):
+        with self.lock:
+            if tuid is not None:
+                row = self.conn.execute(
+                    "SELECT data FROM covers WHERE tuid=?",
+                    (tuid,)).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT data FROM covers JOIN ifids USING (tuid) "
+                    "WHERE ifid=?", (ifid.upper(),)).fetchone()
+        if row is None:
+            return None
+        return str(row[0])
+
+    def _update_story(self, tuid, story):
+        ific_str = _story_ifiction(story)
+        digest = hashlib.sha1(ific_str).hexdigest()
+        row = self.conn.execute("SELECT digest FROM stories WHERE tuid=?",
+                                (tuid,)).fetchone()
+        if row is not None and row[0] == digest:
+            return False
+        ifids = [ifid.text.strip() for ifid in story.iter(_tag("ifid"))
+                 if ifid.text]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO stories (tuid, ifiction, digest) "
+            "VALUES (?, ?, ?)", (tuid, ific_str.decode("utf-8"), digest))
+        self.conn.execute("DELETE FROM ifids WHERE tuid=?", (tuid,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO ifids (ifid, tuid) VALUES (?, ?)",
+            [(ifid.upper(), tuid) for ifid in ifids])
+        return True
+
+    def _update_cover(self, tuid, filename):
+        with open(filename, "rb") as cover_file:
+            data = cover_file.read()
+        digest = hashlib.sha1(data).hexdigest()
+        row = self.conn.execute("SELECT digest FROM covers WHERE tuid=?",
+                                (tuid,)).fetchone()
+        if row is not None and row[0] == digest:
+            return False
+        self.conn.execute(
+            "INSERT OR REPLACE INTO covers (tuid, data, digest) "
+            "VALUES (?, ?, ?)", (tuid, sqlite3.Binary(data), digest))
+        return True
+
+    def _remove_unseen(self, cover_dir):
+        """Remove the stories whose TUIDs were not seen in the dump, along
+        with their IFIDs and covers, and return how many there were.  If
+        a directory of cover art was given, the covers which are not in
+        it are removed too.
+
+        """
+        removed = self.conn.execute(
+            "DELETE FROM stories WHERE tuid NOT IN "
+            "(SELECT tuid FROM seen_tuids)").rowcount
+        self.conn.execute("DELETE FROM ifids WHERE tuid NOT IN "
+                          "(SELECT tuid FROM seen_tuids)")
+        if cover_dir is not None:
+            self.conn.execute("DELETE FROM covers WHERE tuid NOT IN "
+                              "(SELECT tuid FROM seen_covers)")
+        self.conn.execute("DELETE FROM covers WHERE tuid NOT IN "
+                          "(SELECT tuid FROM seen_tuids)")
+        return removed
+
+    def update(self, dump_filename, cover_dir=None):
+        """Bring the mirror up to date with an iFiction dump of IFDB, and
+        optionally a directory of cover art.  Returns the number of
+        stories and covers which were added or changed and the number of
+        stories which were removed.
+
+        """
+        stories = 0
+        covers = 0
+        seen = 0
+        with self.lock:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_tuids "
+                              "(tuid TEXT PRIMARY KEY)")
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_covers "
+                              "(tuid TEXT PRIMARY KEY)")
+            try:
+                self.conn.execute("DELETE FROM seen_tuids")
+                self.conn.execute("DELETE FROM seen_covers")
+                root = None
+                for event, elem in ElementTree.iterparse(
+                        dump_filename, events=("start", "end")):
+                    if root is None:
+                        root = elem
+                    if event != "end" or elem.tag != _tag("story"):
+                        continue
+                    tuid = elem.findtext("/".join([_tag("ifdb"),
+                                                   _tag("tuid")]))
+                    # Without a TUID there is nothing to key the story on.
+                    if tuid:
+                        tuid = tuid.strip()
+                        self.conn.execute("INSERT OR IGNORE INTO seen_tuids "
+                                          "(tuid) VALUES (?)", (tuid,))
+                        if self._update_story(tuid, elem):
+                            stories += 1
+                    # Parsed stories would otherwise be kept hanging off
+                    # the root until the whole dump had been read.
+                    root.clear()
+                    seen += 1
+                    if seen % UPDATE_BATCH_SIZE == 0:
+                        self.conn.commit()
+                if cover_dir is not None:
+                    for tuid, filename in _read_covers(cover_dir).items():
+                        self.conn.execute("INSERT OR IGNORE INTO seen_covers "
+                                          "(tuid) VALUES (?)", (tuid,))
+                        if self._update_cover(tuid, filename):
+                            covers += 1
+                removed = self._remove_unseen(cover_dir)
+                self.conn.commit()
+            except:
+                self.conn.rollback()
+                raise
+        return (stories, covers, removed)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def main(argv=None):
+    from grotesque.settings import Settings
+    parser = argparse.ArgumentParser(
+        prog="python -m grotesque.ifdbmirror",
+        description="Update Grotesque's local mirror of IFDB from an "
+        "iFiction dump.")
+    parser.add_argument("dump", help="an iFiction file of IFDB's stories")
+    parser.add_argument("--covers", metavar="DIRECTORY",
+                        help="a directory of cover art named by TUID")
+    parser.add_argument("--mirror", metavar="FILE",
+                        help="the mirror to update (default: {0})".format(
+                            Settings().get_ifdb_mirror_filename()))
+    args = parser.parse_args(argv)
+    filename = args.mirror
+    if filename is None:
+        filename = Settings().get_ifdb_mirror_filename()
+    if not os.path.exists(os.path.dirname(os.path.abspath(filename))):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)))
+    mirror = Mirror(filename)
+    try:
+        stories, covers, removed = mirror.update(args.dump, args.covers)
+    finally:
+        mirror.close()
+    print "{0} stories and {1} covers added or updated and {2} stories " \
+        "removed in {3}".format(stories, covers, removed, filename)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+#       movecovers.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Move the cover art which is kept in the library database out to the
+cover store, so that the database only holds each cover's details and
+the digest of its image.  Identical images are only stored once.
+
+    python -m grotesque.movecovers [--library FILE] [--store DIRECTORY]
+
+Images in the store which no cover refers to any longer are deleted, and
+the database is then compacted to give back the space.  Whether covers
+added later are kept in the store is set in Grotesque's preferences.
+
+"""
+
+
+import argparse
+import os
+import sqlite3
+import sys
+
+from grotesque import db
+from grotesque.db import coverstore
+
+
+# Commit the moved covers every so many.
+MOVE_BATCH_SIZE = 100
+
+
+def move_covers(conn):
+    """Move every cover's image from the database to the connection's
+    cover store, and return how many were moved.
+
+    """
+    cover_ids = db.query.select_covers_with_data(conn)
+    for n in range(0, len(cover_ids), MOVE_BATCH_SIZE):
+        with conn.transaction():
+            for cover_id in cover_ids[n:n + MOVE_BATCH_SIZE]:
+                cover_row = db.query.select_cover(conn, cover_id)
+                cover_hash = coverstore.put_cover(conn, cover_row["data"])
+                db.query.update_cover(conn, cover_id,
+                                      {"data": "", "hash": cover_hash})
+    return len(cover_ids)
+
+
+def main(argv=None):
+    from grotesque.settings import Settings
+    settings = Settings()
+    settings.load()
+    parser = argparse.ArgumentParser(
+        prog="python -m grotesque.movecovers",
+        description="Move Grotesque's cover art out of the library "
+        "database into the cover store.")
+    parser.add_argument("--library", metavar="FILE",
+                        help="the library database (default: {0})".format(
+                            settings.get_library_filename()))
+    parser.add_argument("--store", metavar="DIRECTORY",
+                        help="the cover store (default: {0})".format(
+                            settings.get_cover_store_dir()))
+    parser.add_argument("--no-vacuum", action="store_true",
+                        help="do not compact the database afterwards")
+    args = parser.parse_args(argv)
+    library_filename = args.library or settings.get_library_filename()
+    store_dir = args.store or settings.get_cover_store_dir()
+    if not os.path.exists(library_filename):
+        print >> sys.stderr, "{0} does not exist".format(library_filename)
+        return 1
+    db_manager = db.ConnectionManager(
+        library_filename, cover_store=coverstore.CoverStore(store_dir))
+    conn = db_manager.writer
+    try:
+        try:
+            db.query.count_covers_by_hash(conn, "")
+        except sqlite3.OperationalError:
+            print >> sys.stderr, ("{0} is from an older version of "
+                                  "Grotesque; run Grotesque once to upgrade "
+                                  "it first".format(library_filename))
+            return 1
+        moved = move_covers(conn)
+        removed = coverstore.collect_garbage(conn)
+        if not args.no_vacuum:
+            conn.execute("VACUUM")
+    finally:
+        db_manager.close()
+    print "{0} covers moved to {1}; {2} unused images deleted".format(
+        moved, store_dir, removed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -32,6 +32,8 @@ class Settings:
 
     '''
     DEFAULT_DIMENSIONS = (1024, 768)
+    DB_SYNCHRONOUS_MODES = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+    DB_TEMP_STORES = ['DEFAULT', 'FILE', 'MEMORY']
 
     def __init__(self):
         self.config = SafeConfigParser()
@@ -40,6 +42,7 @@ class Settings:
         self.config.add_section('File_exts')
         self.config.add_section('Directories')
         self.config.add_section('Window')
+        self.config.add_section('Database')
         # Get the user's home directory.
         if platform.system() == 'Windows':
             homedir = os.path.expanduser('~')
@@ -92,6 +95,63 @@ class Settings:
             return 30
         return limit
 
+    def set_ifdb_offline(self, offline):
+        self.config.set('General', 'IFDBOffline', str(offline))
+
+    def get_ifdb_offline(self):
+        try:
+            offline = self.config.get('General', 'IFDBOffline')
+        except NoOptionError:
+            self.set_ifdb_offline(False)
+            return False
+        return offline == 'True'
+
+    def set_ifdb_cache_size(self, size):
+        '''This method sets the size, in MiB, to which the cache of IFDB
+        responses is kept.
+
+        '''
+        if size <= 0:
+            raise ValueError("IFDB cache size must be greater than 0")
+        self.config.set('General', 'IFDBCacheSize', str(size))
+
+    def get_ifdb_cache_size(self):
+        try:
+            size = int(self.config.get('General', 'IFDBCacheSize'))
+        except (NoOptionError, ValueError):
+            self.set_ifdb_cache_size(64)
+            return 64
+        if size <= 0:
+            self.set_ifdb_cache_size(64)
+            return 64
+        return size
+
+    def get_ifdb_cache_filename(self):
+        return os.path.join(os.path.dirname(self.library_filename),
+                            'ifdb_cache.db')
+
+    def get_ifdb_mirror_filename(self):
+        return os.path.join(os.path.dirname(self.library_filename),
+                            'ifdb_mirror.db')
+
+    def set_external_covers(self, external):
+        self.config.set('General', 'ExternalCovers', str(external))
+
+    def get_external_covers(self):
+        '''This method returns whether new cover art is kept in the cover
+        store rather than in the library database.
+
+        '''
+        try:
+            external = self.config.get('General', 'ExternalCovers')
+        except NoOptionError:
+            self.set_external_covers(False)
+            return False
+        return external == 'True'
+
+    def get_cover_store_dir(self):
+        return os.path.join(os.path.dirname(self.library_filename), 'covers')
+
     def set_fetch_metadata(self, fetch_metadata):
         self.config.set('General', 'FetchMetadata', str(fetch_metadata))
 
@@ -126,6 +186,17 @@ class Settings:
             return True
         return disp == 'True'
 
+    def set_gallery_shown(self, gallery_shown):
+        self.config.set('General', 'GalleryShown', str(gallery_shown))
+
+    def get_gallery_shown(self):
+        try:
+            shown = self.config.get('General', 'GalleryShown')
+        except NoOptionError:
+            self.set_gallery_shown(False)
+            return False
+        return shown == 'True'
+
     def get_launcher(self, if_format):
         try:
             return self.config.get('Launchers', if_format)
@@ -222,9 +293,114 @@ class Settings:
     def set_game_dir(self, dir):
         self.config.set('Directories', 'Games', dir)
 
+    def set_library_dirs(self, library_dirs):
+        '''This method sets the library folders, which are kept in sync with
+        the library.
+
+        '''
+        self.config.set('Directories', 'Library',
+                        os.pathsep.join(library_dirs))
+
+    def get_library_dirs(self):
+        try:
+            library_dirs = self.config.get('Directories', 'Library')
+        except NoOptionError:
+            self.set_library_dirs([])
+            return []
+        return [library_dir for library_dir in library_dirs.split(os.pathsep)
+                if library_dir]
+
+    def add_library_dir(self, library_dir):
+        library_dirs = self.get_library_dirs()
+        if library_dir not in library_dirs:
+            library_dirs.append(library_dir)
+            self.set_library_dirs(library_dirs)
+
     def get_library_filename(self):
         return self.library_filename
 
+    def set_db_synchronous(self, synchronous):
+        '''This method sets how often SQLite waits for the library database
+        to reach the disk (the "synchronous" pragma).
+
+        '''
+        if synchronous.upper() not in self.DB_SYNCHRONOUS_MODES:
+            raise ValueError("Unknown synchronous mode: {0}".format(
+                synchronous))
+        self.config.set('Database', 'Synchronous', synchronous.upper())
+
+    def get_db_synchronous(self):
+        try:
+            synchronous = self.config.get('Database', 'Synchronous')
+        except NoOptionError:
+            self.set_db_synchronous('NORMAL')
+            return 'NORMAL'
+        if synchronous.upper() not in self.DB_SYNCHRONOUS_MODES:
+            self.set_db_synchronous('NORMAL')
+            return 'NORMAL'
+        return synchronous.upper()
+
+    def set_db_cache_size(self, cache_size):
+        '''This method sets the size of each connection's page cache.  A
+        positive value is a number of pages, a negative one a number of
+        KiB.
+
+        '''
+        if cache_size == 0:
+            raise ValueError("Cache size must not be 0")
+        self.config.set('Database', 'CacheSize', str(cache_size))
+
+    def get_db_cache_size(self):
+        try:
+            cache_size = int(self.config.get('Database', 'CacheSize'))
+        except (NoOptionError, ValueError):
+            self.set_db_cache_size(-16384)
+            return -16384
+        if cache_size == 0:
+            self.set_db_cache_size(-16384)
+            return -16384
+        return cache_size
+
+    def set_db_mmap_size(self, mmap_size):
+        '''This method sets how many bytes of the library database are
+        memory-mapped.  0 turns memory-mapping off.
+
+        '''
+        if mmap_size < 0:
+            raise ValueError("Memory-map size must be >= 0")
+        self.config.set('Database', 'MmapSize', str(mmap_size))
+
+    def get_db_mmap_size(self):
+        try:
+            mmap_size = int(self.config.get('Database', 'MmapSize'))
+        except (NoOptionError, ValueError):
+            self.set_db_mmap_size(67108864)
+            return 67108864
+        if mmap_size < 0:
+            self.set_db_mmap_size(67108864)
+            return 67108864
+        return mmap_size
+
+    def set_db_temp_store(self, temp_store):
+        '''This method sets where SQLite keeps its temporary tables and
+        indices.
+
+        '''
+        if temp_store.upper() not in self.DB_TEMP_STORES:
+            raise ValueError("Unknown temp store: {0}".format(temp_store))
+        self.config.set('Database', 'TempStore', temp_store.upper())
+
+    def get_db_temp_store(self):
+        try:
+            temp_store = self.config.get('Database', 'TempStore')
+        except NoOptionError:
+            self.set_db_temp_store('MEMORY')
+            return 'MEMORY'
+        if temp_store.upper() not in self.DB_TEMP_STORES:
+            self.set_db_temp_store('MEMORY')
+            return 'MEMORY'
+        return temp_store.upper()
+
     def set_window_size(self, size):
         width, height = size
         if width <= 0 or height <= 0:
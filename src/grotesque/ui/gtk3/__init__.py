@@ -34,6 +34,6 @@ class Gui:
         SettingsAssistant(settings, None, Gtk.main_quit)
         Gtk.main()
 
-    def main_window(self, library_filename, settings):
-        MainWindow(library_filename, settings)
+    def main_window(self, db_manager, settings):
+        MainWindow(db_manager, settings)
         Gtk.main()
@@ -491,7 +491,8 @@ class EditDialog(Gtk.Dialog):
         return vbox
 
     def _refresh_coverart(self):
-        cover_row = db.query.select_cover_by_story(self.conn, self.story_id)
+        cover_row = db.query.select_cover_info_by_story(self.conn,
+                                                        self.story_id)
         if not cover_row or cover_row["format"] not in ["jpeg", "png", "gif"]:
             self._cover_widgets["image"].clear()
             return
@@ -504,9 +505,19 @@ class EditDialog(Gtk.Dialog):
         else:
             self._cover_widgets["description"].set_text("")
         self._cover_widgets["image"].clear()
+        # A thumbnail will do, if there is one big enough.
+        image_row = db.query.select_cover_thumbnail(self.conn, cover_row["id"],
+                                                    MAX_IMG_SIZE)
+        if image_row is not None:
+            data = image_row["data"]
+        else:
+            image_row = db.query.select_cover(self.conn, cover_row["id"])
+            data = db.coverstore.read_cover(self.conn, image_row)
+        if not data:
+            return
         pixbuf_loader = GdkPixbuf.PixbufLoader.new_with_type(
-            cover_row["format"])
-        pixbuf_loader.write(cover_row["data"])
+            image_row["format"])
+        pixbuf_loader.write(data)
         pixbuf_loader.close()
         pixbuf = pixbuf_loader.get_pixbuf()
         pixbuf_w = pixbuf.get_width()
@@ -593,13 +604,15 @@ class EditDialog(Gtk.Dialog):
                     "rating_count_avg": ifdb_annot.get("ratingcountavg"),
                     "rating_count_tot": ifdb_annot.get("ratingcounttot"),
                     "updated": last_updated}
-        annot_row = db.query.select_ifdb_annotation_by_story(
-            self.conn, self.story_id)
-        if annot_row:
-            annot_id = annot_row["id"]
-            db.query.update_ifdb_annotation(self.conn, annot_id, ifdb_row)
-        else:
-            db.query.insert_ifdb_annotation(self.conn, self.story_id, **ifdb_row)
+        with self.conn.transaction():
+            annot_row = db.query.select_ifdb_annotation_by_story(
+                self.conn, self.story_id)
+            if annot_row:
+                annot_id = annot_row["id"]
+                db.query.update_ifdb_annotation(self.conn, annot_id, ifdb_row)
+            else:
+                db.query.insert_ifdb_annotation(self.conn, self.story_id,
+                                                **ifdb_row)
 
 
     def _fill_metadata_from_ifdb(self, tuid=None, ifid=None):
@@ -634,51 +647,52 @@ class EditDialog(Gtk.Dialog):
                         self.conn, new_title + " [{0}]".format(n)):
                     n += 1
                 new_title = new_title + " [{0}]".format(n)
-        self._maybe_set("title", new_title)
-        self._edit_generic(new_title, "title")
-        self._maybe_set("author", biblio.get("author"))
-        self._edit_author(biblio.get("author"))
-        self._maybe_set("group", biblio.get("group"))
-        self._edit_group(biblio.get("group"))
-        self._maybe_set("headline", biblio.get("headline"))
-        self._edit_generic(biblio.get("headline"), "headline")
-        self._maybe_set("firstpublished", biblio.get("firstpublished"))
-        try:
-            pub_date = util.normalize_date(biblio.get("firstpublished"))
-        except:
-            pass
-        else:
-            self._edit_generic(pub_date, "firstpublished")
-        self._maybe_set("language", biblio.get("language"))
-        self._edit_generic(biblio.get("language"), "language")
-        self._maybe_set("genre", biblio.get("genre"))
-        self._edit_genre(biblio.get("genre"))
-        self._maybe_set("series", biblio.get("series"))
-        self._edit_series(biblio.get("series"))
-        self._maybe_set("seriesnumber", biblio.get("seriesnumber"))
-        self._edit_seriesnumber(biblio.get("seriesnumber"))
-        if "forgiveness" in biblio and biblio["forgiveness"] is not None:
+        with self.conn.transaction():
+            self._maybe_set("title", new_title)
+            self._edit_generic(new_title, "title")
+            self._maybe_set("author", biblio.get("author"))
+            self._edit_author(biblio.get("author"))
+            self._maybe_set("group", biblio.get("group"))
+            self._edit_group(biblio.get("group"))
+            self._maybe_set("headline", biblio.get("headline"))
+            self._edit_generic(biblio.get("headline"), "headline")
+            self._maybe_set("firstpublished", biblio.get("firstpublished"))
             try:
-                self._meta_fields["forgiveness"].set_active(
-                    self.forgiveness.index(biblio["forgiveness"]))
+                pub_date = util.normalize_date(biblio.get("firstpublished"))
             except:
+                pass
+            else:
+                self._edit_generic(pub_date, "firstpublished")
+            self._maybe_set("language", biblio.get("language"))
+            self._edit_generic(biblio.get("language"), "language")
+            self._maybe_set("genre", biblio.get("genre"))
+            self._edit_genre(biblio.get("genre"))
+            self._maybe_set("series", biblio.get("series"))
+            self._edit_series(biblio.get("series"))
+            self._maybe_set("seriesnumber", biblio.get("seriesnumber"))
+            self._edit_seriesnumber(biblio.get("seriesnumber"))
+            if "forgiveness" in biblio and biblio["forgiveness"] is not None:
+                try:
+                    self._meta_fields["forgiveness"].set_active(
+                        self.forgiveness.index(biblio["forgiveness"]))
+                except:
+                    self._meta_fields["forgiveness"].set_active(
+                        self.forgiveness.index("Unknown"))
+            else:
                 self._meta_fields["forgiveness"].set_active(
                     self.forgiveness.index("Unknown"))
-        else:
-            self._meta_fields["forgiveness"].set_active(
-                self.forgiveness.index("Unknown"))
-        self._edit_forgiveness(biblio.get("forgiveness"))
-        self._maybe_set("description", biblio.get("description"))
-        self._edit_generic(biblio.get("description"), "description")
-        # IFDB stores story URLs in the contact section
-        contact = ifiction.get_contact(ific_story)
-        if contact is not None:
-            self._maybe_set("url", contact.get("url"))
-            self._edit_generic(contact.get("url"), "url")
-        else:
-            self._meta_fields["url"].set_text("")
-            self._edit_generic("", "url")
-        self._fill_ifdb_annotation(ific_story)
+            self._edit_forgiveness(biblio.get("forgiveness"))
+            self._maybe_set("description", biblio.get("description"))
+            self._edit_generic(biblio.get("description"), "description")
+            # IFDB stores story URLs in the contact section
+            contact = ifiction.get_contact(ific_story)
+            if contact is not None:
+                self._maybe_set("url", contact.get("url"))
+                self._edit_generic(contact.get("url"), "url")
+            else:
+                self._meta_fields["url"].set_text("")
+                self._edit_generic("", "url")
+            self._fill_ifdb_annotation(ific_story)
         self.edited = True
 
     def _fill_metadata_from_db(self):
@@ -839,117 +853,131 @@ class EditDialog(Gtk.Dialog):
         forgive_row = db.query.select_forgiveness_by_description(
             self.conn, forgive_txt)
         if forgive_row:
-            db.query.update_story(self.conn, self.story_id,
-                            {"forgiveness_id": forgive_row["id"]})
+            with self.conn.transaction():
+                db.query.update_story(self.conn, self.story_id,
+                                      {"forgiveness_id": forgive_row["id"]})
 
     def _edit_author(self, author_txt):
-        authors = util.parse_list_str(author_txt)
-        old_authors = set([row["id"] for row in db.query.select_story_authors(
-            self.conn, self.story_id)])
-        new_authors = set()
-        for author in authors:
-            # Only add the author's real name to the filter (no pen names).
-            author_real_name = author.split('(')[0]
-            if author_real_name == '':
-                continue
-            author_row = db.query.select_author_by_name(
-                self.conn, author_real_name)
-            if not author_row:
-                author_id = db.query.insert_author(self.conn, author_real_name)
-            else:
-                author_id = author_row["id"]
-                if author_id in old_authors:
-                    new_authors.add(author_id)
+        with self.conn.transaction():
+            authors = util.parse_list_str(author_txt)
+            old_authors = set([row["id"] for row in
+                               db.query.select_story_authors(
+                                   self.conn, self.story_id)])
+            new_authors = set()
+            for author in authors:
+                # Only add the author's real name to the filter (no pen names).
+                author_real_name = author.split('(')[0]
+                if author_real_name == '':
                     continue
-            db.query.add_author_to_story(self.conn, author_id, self.story_id)
-            new_authors.add(author_id)
-        for old_author in old_authors.difference(new_authors):
-            db.query.remove_author_from_story(
-                self.conn, old_author, self.story_id)
-            if not db.query.select_author_stories(self.conn, old_author):
-                db.query.delete_author(self.conn, old_author)
+                author_row = db.query.select_author_by_name(
+                    self.conn, author_real_name)
+                if not author_row:
+                    author_id = db.query.insert_author(self.conn,
+                                                       author_real_name)
+                else:
+                    author_id = author_row["id"]
+                    if author_id in old_authors:
+                        new_authors.add(author_id)
+                        continue
+                db.query.add_author_to_story(self.conn, author_id,
+                                             self.story_id)
+                new_authors.add(author_id)
+            for old_author in old_authors.difference(new_authors):
+                db.query.remove_author_from_story(
+                    self.conn, old_author, self.story_id)
+                if not db.query.select_author_stories(self.conn, old_author):
+                    db.query.delete_author(self.conn, old_author)
 
     def _edit_group(self, group_txt):
-        if not group_txt:
-            group_id = None
-        else:
-            group_row = db.query.select_group_by_name(self.conn, group_txt)
-            if not group_row:
-                group_id = db.query.insert_group(self.conn, group_txt)
+        with self.conn.transaction():
+            if not group_txt:
+                group_id = None
             else:
-                group_id = group_row["id"]
-        db.query.update_story(self.conn, self.story_id,
-                        {"group_id": group_id})
+                group_row = db.query.select_group_by_name(self.conn, group_txt)
+                if not group_row:
+                    group_id = db.query.insert_group(self.conn, group_txt)
+                else:
+                    group_id = group_row["id"]
+            db.query.update_story(self.conn, self.story_id,
+                            {"group_id": group_id})
 
     def _edit_genre(self, genre_txt):
-        genres = util.parse_list_str(genre_txt)
-        old_genres = set([row["id"] for row in db.query.select_story_genres(
-            self.conn, self.story_id)])
-        new_genres = set()
-        for genre in genres:
-            if not genre:
-                continue
-            genre_row = db.query.select_genre_by_name(self.conn, genre.lower())
-            if not genre_row:
-                genre_id = db.query.insert_genre(self.conn, genre.lower())
-            else:
-                genre_id = genre_row["id"]
-                if genre_id in old_genres:
-                    new_genres.add(genre_id)
+        with self.conn.transaction():
+            genres = util.parse_list_str(genre_txt)
+            old_genres = set([row["id"] for row in
+                              db.query.select_story_genres(
+                                  self.conn, self.story_id)])
+            new_genres = set()
+            for genre in genres:
+                if not genre:
                     continue
-            db.query.add_genre_to_story(self.conn, genre_id, self.story_id)
-            new_genres.add(genre_id)
-        for old_genre in old_genres.difference(new_genres):
-            db.query.remove_genre_from_story(
-                self.conn, old_genre, self.story_id)
-            if not db.query.select_genre_stories(self.conn, old_genre):
-                db.query.delete_genre(self.conn, old_genre)
+                genre_row = db.query.select_genre_by_name(self.conn,
+                                                          genre.lower())
+                if not genre_row:
+                    genre_id = db.query.insert_genre(self.conn, genre.lower())
+                else:
+                    genre_id = genre_row["id"]
+                    if genre_id in old_genres:
+                        new_genres.add(genre_id)
+                        continue
+                db.query.add_genre_to_story(self.conn, genre_id, self.story_id)
+                new_genres.add(genre_id)
+            for old_genre in old_genres.difference(new_genres):
+                db.query.remove_genre_from_story(
+                    self.conn, old_genre, self.story_id)
+                if not db.query.select_genre_stories(self.conn, old_genre):
+                    db.query.delete_genre(self.conn, old_genre)
 
     def _edit_tags(self, tag_txt):
-        tags = util.parse_list_str(tag_txt)
-        old_tags = set([row["id"] for row in db.query.select_story_tags(
-            self.conn, self.story_id)])
-        new_tags = set()
-        for tag in tags:
-            if not tag:
-                continue
-            tag_row = db.query.select_tag_by_name(self.conn, tag.lower())
-            if not tag_row:
-                tag_id = db.query.insert_tag(self.conn, tag.lower())
-            else:
-                tag_id = tag_row["id"]
-                if tag_id in old_tags:
-                    new_tags.add(tag_id)
+        with self.conn.transaction():
+            tags = util.parse_list_str(tag_txt)
+            old_tags = set([row["id"] for row in db.query.select_story_tags(
+                self.conn, self.story_id)])
+            new_tags = set()
+            for tag in tags:
+                if not tag:
                     continue
-            db.query.add_tag_to_story(self.conn, tag_id, self.story_id)
-            new_tags.add(tag_id)
-        for old_tag in old_tags.difference(new_tags):
-            db.query.remove_tag_from_story(
-                self.conn, old_tag, self.story_id)
-            if not db.query.select_tag_stories(self.conn, old_tag):
-                db.query.delete_tag(self.conn, old_tag)
+                tag_row = db.query.select_tag_by_name(self.conn, tag.lower())
+                if not tag_row:
+                    tag_id = db.query.insert_tag(self.conn, tag.lower())
+                else:
+                    tag_id = tag_row["id"]
+                    if tag_id in old_tags:
+                        new_tags.add(tag_id)
+                        continue
+                db.query.add_tag_to_story(self.conn, tag_id, self.story_id)
+                new_tags.add(tag_id)
+            for old_tag in old_tags.difference(new_tags):
+                db.query.remove_tag_from_story(
+                    self.conn, old_tag, self.story_id)
+                if not db.query.select_tag_stories(self.conn, old_tag):
+                    db.query.delete_tag(self.conn, old_tag)
 
     def _edit_series(self, series_txt):
-        if not series_txt:
-            series_id = None
-        else:
-            series_row = db.query.select_series_by_name(self.conn, series_txt)
-            if not series_row:
-                series_id = db.query.insert_series(self.conn, series_txt)
+        with self.conn.transaction():
+            if not series_txt:
+                series_id = None
             else:
-                series_id = series_row["id"]
-        db.query.update_story(self.conn, self.story_id,
-                        {"series_id": series_id})
+                series_row = db.query.select_series_by_name(self.conn,
+                                                            series_txt)
+                if not series_row:
+                    series_id = db.query.insert_series(self.conn, series_txt)
+                else:
+                    series_id = series_row["id"]
+            db.query.update_story(self.conn, self.story_id,
+                            {"series_id": series_id})
 
     def _edit_seriesnumber(self, seriesnumber):
         if not seriesnumber:
             seriesnumber = None
-        db.query.update_story(self.conn, self.story_id,
-                        {"seriesnumber": seriesnumber})
+        with self.conn.transaction():
+            db.query.update_story(self.conn, self.story_id,
+                                  {"seriesnumber": seriesnumber})
 
     def _edit_generic(self, new_txt, field):
-        db.query.update_story(self.conn, self.story_id,
-                        {field: new_txt})
+        with self.conn.transaction():
+            db.query.update_story(self.conn, self.story_id,
+                                  {field: new_txt})
 
     def _edit_rating(self, rating_txt):
         if not rating_txt:
@@ -958,16 +986,18 @@ class EditDialog(Gtk.Dialog):
         annot_row = db.query.select_annotation_by_story(
             self.conn, self.story_id)
         if annot_row:
-            db.query.update_annotation(self.conn, self.story_id,
-                                 {"rating": rating,
-                                  "rating_txt": rating_txt})
+            with self.conn.transaction():
+                db.query.update_annotation(self.conn, self.story_id,
+                                           {"rating": rating,
+                                            "rating_txt": rating_txt})
 
     def _edit_played(self, played):
         annot_row = db.query.select_annotation_by_story(
             self.conn, self.story_id)
         if annot_row:
-            db.query.update_annotation(self.conn, self.story_id,
-                                 {"played": played})
+            with self.conn.transaction():
+                db.query.update_annotation(self.conn, self.story_id,
+                                           {"played": played})
 
     def _on_edit_biblio(self, widget, field):
         self.widget_update = True
@@ -1148,17 +1178,12 @@ class EditDialog(Gtk.Dialog):
             d.destroy()
             return
         description = None
-        orig_cover = db.query.select_cover_by_story(self.conn, self.story_id)
-        if orig_cover is not None:
-            db.query.update_cover(self.conn, orig_cover["id"],
-                                  {"height": height,
-                                   "width": width,
-                                   "format": img_format,
-                                   "description": description,
-                                   "data": cover_data})
-        else:
-            db.query.insert_cover(self.conn, self.story_id, img_format, height,
-                                  width, description, cover_data)
+        with self.conn.transaction():
+            orig_cover = db.query.select_cover_by_story(self.conn,
+                                                        self.story_id)
+            db.addremove.store_cover(self.conn, self.story_id, orig_cover,
+                                     img_format, height, width, description,
+                                     cover_data)
         self._refresh_coverart()
 
     def _import_cover_from_file(self, filename):
@@ -1193,10 +1218,8 @@ class EditDialog(Gtk.Dialog):
         file_chooser.destroy()
 
     def _on_remove_cover(self, button):
-        cover_id = db.query.select_cover_by_story(self.conn, self.story_id)
-        if not cover_id:
-            return
-        db.query.delete_cover(self.conn, cover_id["id"])
+        with self.conn.transaction():
+            db.addremove.clean_story_cover(self.conn, self.story_id)
         self._refresh_coverart()
 
     def _on_add_release(self, button):
@@ -1246,8 +1269,10 @@ class EditDialog(Gtk.Dialog):
                 d.set_markup("Unrecognized story format")
                 d.run()
                 d.destroy()
-            return False
-            format_id = db.query.insert_format(self.conn, raw_format, launcher)
+                return False
+            with self.conn.transaction():
+                format_id = db.query.insert_format(self.conn, raw_format,
+                                                   launcher)
         else:
             format_id = format_row["id"]
         try:
@@ -1268,8 +1293,10 @@ class EditDialog(Gtk.Dialog):
             d.run()
             d.destroy()
             return False
-        db.query.insert_release(self.conn, ifids[0], self.story_id, filepath,
-                                None, None, None, None, None, format_id)
+        with self.conn.transaction():
+            db.query.insert_release(self.conn, ifids[0], self.story_id,
+                                    filepath, None, None, None, None, None,
+                                    format_id)
         self.release_store.append([False, ifids[0], raw_format, filepath,
                                    None, None, None, None, None])
 
@@ -1293,7 +1320,8 @@ class EditDialog(Gtk.Dialog):
             d.destroy()
             return
         ifid = self.release_store.get_value(row, 1)
-        db.query.delete_release(self.conn, ifid)
+        with self.conn.transaction():
+            db.query.delete_release(self.conn, ifid)
         self.release_store.remove(row)
 
     def _on_release_info_edited(self, renderer, path, new_text, col_name):
@@ -1310,7 +1338,8 @@ class EditDialog(Gtk.Dialog):
                 return
         else:
             field = field.replace(" ", "")
-        db.query.update_release(self.conn, ifid, {field: new_text})
+        with self.conn.transaction():
+            db.query.update_release(self.conn, ifid, {field: new_text})
         self.release_store.set_value(row_iter, col_num, new_text)
         self.edited = True
 
@@ -1336,8 +1365,10 @@ class EditDialog(Gtk.Dialog):
         else:
             return
         file_chooser.destroy()
+        with self.conn.transaction():
+            for uri in filepaths:
+                db.query.insert_resource(self.conn, self.story_id, uri)
         for uri in filepaths:
-            db.query.insert_resource(self.conn, self.story_id, uri)
             self.resource_store.append([uri, ""])
 
     def _on_remove_resource(self, button):
@@ -1362,7 +1393,8 @@ class EditDialog(Gtk.Dialog):
         uri = self.resource_store.get_value(row, 0)
         resource_row = db.query.select_resource_by_uri(self.conn, uri)
         resource_id = resource_row["id"]
-        db.query.delete_resource(self.conn, resource_id)
+        with self.conn.transaction():
+            db.query.delete_resource(self.conn, resource_id)
         self.resource_store.remove(row)
 
     def _on_resource_info_edited(self, renderer, path, new_text, col_name):
@@ -1372,7 +1404,9 @@ class EditDialog(Gtk.Dialog):
         resource_row = db.query.select_resource_by_uri(self.conn, uri)
         resource_id = resource_row["id"]
         field = col_name.lower()
-        db.query.update_resource(self.conn, resource_id, {field: new_text})
+        with self.conn.transaction():
+            db.query.update_resource(self.conn, resource_id,
+                                     {field: new_text})
         self.resource_store.set_value(row_iter, col_num, new_text)
         self.edited = True
 
@@ -1486,8 +1520,9 @@ class EditDialog(Gtk.Dialog):
             row_iter = self.release_store.iter_next(row_iter)
         if new_ifid is None:
             return
-        db.query.update_story(self.conn, self.story_id,
-                              {"default_release": new_ifid})
+        with self.conn.transaction():
+            db.query.update_story(self.conn, self.story_id,
+                                  {"default_release": new_ifid})
 
     def _merge_releases_with_story(self, merge_id):
         release_rows = db.query.select_releases_by_story(self.conn,
@@ -1513,9 +1548,10 @@ class EditDialog(Gtk.Dialog):
         response = d.run()
         d.destroy()
         if response == Gtk.ResponseType.YES:
-            self._merge_releases_with_story(merge_id)
-            self._merge_resources_with_story(merge_id)
-            db.query.delete_story(self.conn, self.story_id)
+            with self.conn.transaction():
+                self._merge_releases_with_story(merge_id)
+                self._merge_resources_with_story(merge_id)
+                db.query.delete_story(self.conn, self.story_id)
             self.load_story(merge_id)
             return True
         else:
@@ -23,6 +23,7 @@
 import re
 
 from gi.repository import Gtk, Gdk
+from grotesque import ifdb
 
 
 class SettingsDialog(Gtk.Dialog):
@@ -52,6 +53,33 @@ class SettingsDialog(Gtk.Dialog):
         fetch_coverart_check.set_active(self.settings.get_fetch_coverart())
         fetch_coverart_check.connect('toggled', self.on_fetch_coverart_toggled)
         general_vbox.add(fetch_coverart_check)
+        # Create a check button for whether or not to only use IFDB data
+        # which has already been downloaded.
+        ifdb_offline_check = Gtk.CheckButton(
+            'Work offline (only use IFDB data that has been fetched before)')
+        ifdb_offline_check.set_active(self.settings.get_ifdb_offline())
+        ifdb_offline_check.connect('toggled', self.on_ifdb_offline_toggled)
+        general_vbox.add(ifdb_offline_check)
+        # Create a spin button for the number of requests per minute which
+        # may be made to IFDB.
+        ifdb_limit_hbox = Gtk.Grid()
+        ifdb_limit_hbox.set_orientation(Gtk.Orientation.HORIZONTAL)
+        ifdb_limit_hbox.set_column_spacing(8)
+        ifdb_limit_label = Gtk.Label(label='IFDB requests per minute')
+        ifdb_limit_spin = Gtk.SpinButton.new_with_range(1, 600, 1)
+        ifdb_limit_spin.set_value(self.settings.get_ifdb_limit())
+        ifdb_limit_spin.connect('value-changed', self.on_ifdb_limit_changed)
+        ifdb_limit_hbox.add(ifdb_limit_label)
+        ifdb_limit_hbox.add(ifdb_limit_spin)
+        general_vbox.add(ifdb_limit_hbox)
+        # Create a check button for whether or not to keep cover art in
+        # files of its own rather than in the library database.
+        external_covers_check = Gtk.CheckButton(
+            'Keep new cover art outside of the library database')
+        external_covers_check.set_active(self.settings.get_external_covers())
+        external_covers_check.connect('toggled',
+                                      self.on_external_covers_toggled, parent)
+        general_vbox.add(external_covers_check)
         # Create a check button for whether or not to display coverart.
         disp_coverart_check = Gtk.CheckButton('Display cover art')
         disp_coverart_check.set_active(self.settings.get_disp_coverart())
@@ -131,6 +159,36 @@ class SettingsDialog(Gtk.Dialog):
         self.settings.set_fetch_coverart(fetch_coverart)
         self.settings.save()
 
+    def on_ifdb_offline_toggled(self, ifdb_offline_check):
+        '''This method handles when the user toggles the "Work offline" check
+        button.
+
+        '''
+        offline = ifdb_offline_check.get_active()
+        self.settings.set_ifdb_offline(offline)
+        self.settings.save()
+        ifdb.set_offline(offline)
+
+    def on_ifdb_limit_changed(self, ifdb_limit_spin):
+        '''This method handles when the user changes the number of IFDB
+        requests per minute.  The new limit applies straight away.
+
+        '''
+        limit = ifdb_limit_spin.get_value_as_int()
+        self.settings.set_ifdb_limit(limit)
+        self.settings.save()
+        ifdb.set_request_limit(limit)
+
+    def on_external_covers_toggled(self, external_covers_check, parent):
+        '''This method handles when the user toggles the "Keep new cover art
+        outside of the library database" check button.
+
+        '''
+        external = external_covers_check.get_active()
+        self.settings.set_external_covers(external)
+        self.settings.save()
+        parent.db_manager.cover_store.external = external
+
     def on_disp_coverart_toggled(self, disp_coverart_check, parent):
         '''This method handles when the user toggles the "Display coverart"
         check button.
@@ -21,13 +21,18 @@
 
 
 import os.path
+import warnings
 
-from gi.repository import Gtk, GdkPixbuf
+from gi.repository import Gtk, GdkPixbuf, GLib, GObject
 
 from infoview import InfoView
+from pixbufcache import PixbufCache
 from grotesque import db
 
 COVERART_PADDING = 20
+# While the cover art is being resized, it is scaled quickly, and then
+# scaled properly once it has not been resized for this many milliseconds.
+RESCALE_DELAY = 200
 
 
 class InfoPaned(Gtk.Paned):
@@ -42,6 +47,11 @@ class InfoPaned(Gtk.Paned):
         self.conn = conn
         self.coverart_file = None
         self.coverart = Gtk.Image()
+        # Decoded cover art, both at full size and scaled to fit, so that
+        # it need not be decoded again each time it is shown or resized.
+        self.cover_cache = PixbufCache()
+        self.coverart_story_id = None
+        self.rescale_source = None
         # Create a label that will be displayed when no coverart exists for a
         # file
         self.no_coverart_label = Gtk.Label('cover art unavailable')
@@ -53,35 +63,107 @@ class InfoPaned(Gtk.Paned):
         self.pack1(self.coverart, True, True)
         self.pack2(self.text_view, True, True)
 
-    def refresh_coverart(self, story_id):
+    def refresh_coverart(self, story_id, resizing=False):
         '''This method refreshes the coverart, resizing it in the event that
-        its container has changed size.
+        its container has changed size.  While resizing, the coverart is
+        scaled roughly until the resizing stops.
 
         '''
+        if self.rescale_source is not None:
+            GObject.source_remove(self.rescale_source)
+            self.rescale_source = None
+        self.coverart_story_id = story_id
         if story_id is not None:
-            cover_row = db.query.select_cover_by_story(self.conn, story_id)
+            cover_row = db.query.select_cover_info_by_story(self.conn,
+                                                            story_id)
         # If the file doesn't have coverart, display the label...
         # if not self.coverart_file or not os.path.exists(self.coverart_file):
         if (story_id is None or not cover_row or
                 cover_row["format"] not in ["jpeg", "png", "gif"]):
-            if self.coverart in self.get_children():
-                self.remove(self.coverart)
-                self.add1(self.no_coverart_label)
+            self._show_no_coverart()
             return
         # ...otherwise display the coverart.
         if self.no_coverart_label in self.get_children():
             self.remove(self.no_coverart_label)
             self.add1(self.coverart)
+        # Should the cover be changed, some of its details will be too.
+        revision = tuple(cover_row)
+        max_size = self.get_position() - COVERART_PADDING
+        pixbuf = self.cover_cache.get(("scaled", revision, max_size))
+        if pixbuf is None:
+            source_pixbuf = self._get_coverart_source(cover_row, revision,
+                                                      max_size)
+            if source_pixbuf is None:
+                # The cover is only a stub or its image cannot be read.
+                self._show_no_coverart()
+                return
+            if resizing:
+                pixbuf = self._scale_coverart(source_pixbuf, max_size,
+                                              GdkPixbuf.InterpType.NEAREST)
+                if pixbuf is not source_pixbuf:
+                    self.rescale_source = GObject.timeout_add(
+                        RESCALE_DELAY, self._on_rescale_timeout)
+            else:
+                pixbuf = self._scale_coverart(source_pixbuf, max_size,
+                                              GdkPixbuf.InterpType.TILES)
+                if pixbuf is not source_pixbuf:
+                    self.cover_cache.put(("scaled", revision, max_size),
+                                         pixbuf)
+        self.coverart.set_from_pixbuf(pixbuf)
+
+    def _show_no_coverart(self):
         self.coverart.clear()
+        if self.coverart in self.get_children():
+            self.remove(self.coverart)
+            self.add1(self.no_coverart_label)
+
+    def _get_coverart_source(self, cover_row, revision, max_size):
+        '''This method returns the image from which the coverart is scaled:
+        the smallest thumbnail which is at least as big as the frame, or
+        else the original.
+
+        '''
+        cover_size = max(cover_row["width"] or 0, cover_row["height"] or 0)
+        thumb_size = None
+        for size in db.thumbnails.THUMBNAIL_SIZES:
+            if max_size <= size < cover_size:
+                thumb_size = size
+                break
+        pixbuf = self.cover_cache.get(("source", revision, thumb_size))
+        if pixbuf is not None:
+            return pixbuf
+        image_row = None
+        if thumb_size is not None:
+            image_row = db.query.select_cover_thumbnail(
+                self.conn, cover_row["id"], thumb_size)
+        if image_row is None:
+            # There is no thumbnail to be had, so the original must do.
+            thumb_size = None
+            image_row = db.query.select_cover(self.conn, cover_row["id"])
+            if image_row is None:
+                return None
+        if thumb_size is None:
+            data = db.coverstore.read_cover(self.conn, image_row)
+        else:
+            data = image_row["data"]
+        if not data:
+            return None
         pixbuf_loader = GdkPixbuf.PixbufLoader.new_with_type(
-            cover_row["format"])
-        pixbuf_loader.write(cover_row["data"])
-        pixbuf_loader.close()
+            image_row["format"])
+        try:
+            pixbuf_loader.write(data)
+            pixbuf_loader.close()
+        except GLib.GError as e:
+            warnings.warn("could not decode the cover: {0}".format(e))
+            return None
         pixbuf = pixbuf_loader.get_pixbuf()
+        self.cover_cache.put(("source", revision, thumb_size), pixbuf)
+        return pixbuf
+
+    def _scale_coverart(self, pixbuf, max_size, interp_type):
         pixbuf_w = pixbuf.get_width()
         pixbuf_h = pixbuf.get_height()
         ratio = float(pixbuf_h) / float(pixbuf_w)
-        max_size = self.get_position() - COVERART_PADDING
         # If the image is bigger than the frame in either dimension, it
         # should be scaled to fit.
         if pixbuf_w > max_size or pixbuf_h > max_size:
@@ -94,11 +176,13 @@ class InfoPaned(Gtk.Paned):
             else:
                 new_height = max_size
                 new_width = int(1 / ratio * new_height)
-            scaled_buf = pixbuf.scale_simple(new_width, new_height,
-                                             GdkPixbuf.InterpType.TILES)
-            self.coverart.set_from_pixbuf(scaled_buf)
-        else:
-            self.coverart.set_from_pixbuf(pixbuf)
+            return pixbuf.scale_simple(new_width, new_height, interp_type)
+        return pixbuf
+
+    def _on_rescale_timeout(self):
+        self.rescale_source = None
+        self.refresh_coverart(self.coverart_story_id)
+        return False
 
     def show_story(self, story_id):
         '''This method renders the textual description and the coverart for a
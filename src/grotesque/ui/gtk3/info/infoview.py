@@ -301,6 +301,8 @@ class InfoView(Gtk.Paned):
                 rel_note = ", ".join([rel_format, rel_comment])
             else:
                 rel_note = rel_format
+            if release["missing"]:
+                rel_note = ", ".join([rel_note, "missing"])
             rel_filename = os.path.basename(rel_uri)
             rel_anchor = text_buffer.create_child_anchor(text_iter)
             rel_label = Gtk.Label()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+#       pixbufcache.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+
+
+# The default number of bytes of pixel data to keep.
+DEFAULT_SIZE = 32 * 1024 * 1024
+
+
+class PixbufCache():
+    '''This class keeps decoded pixbufs in memory, up to a total number of
+    bytes of pixel data, dropping the least recently used ones first.
+    Keys may be anything hashable; they should include whatever changes
+    when the image does, so that stale pixbufs are never found and simply
+    age out.
+
+    '''
+    def __init__(self, max_size=DEFAULT_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.pixbufs = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.pixbufs)
+
+    def __contains__(self, key):
+        return key in self.pixbufs
+
+    def get(self, key):
+        pixbuf = self.pixbufs.pop(key, None)
+        if pixbuf is not None:
+            self.pixbufs[key] = pixbuf
+        return pixbuf
+
+    def peek(self, key):
+        '''Return a pixbuf without counting it as having been used.'''
+        return self.pixbufs.get(key)
+
+    def put(self, key, pixbuf):
+        old_pixbuf = self.pixbufs.pop(key, None)
+        if old_pixbuf is not None:
+            self.size -= old_pixbuf.get_byte_length()
+        pixbuf_size = pixbuf.get_byte_length()
+        # A pixbuf bigger than the whole cache would only push everything
+        # else out.
+        if pixbuf_size > self.max_size:
+            return
+        self.pixbufs[key] = pixbuf
+        self.size += pixbuf_size
+        while self.size > self.max_size:
+            _, old_pixbuf = self.pixbufs.popitem(last=False)
+            self.size -= old_pixbuf.get_byte_length()
+
+    def discard(self, key):
+        pixbuf = self.pixbufs.pop(key, None)
+        if pixbuf is not None:
+            self.size -= pixbuf.get_byte_length()
+
+    def clear(self):
+        self.pixbufs.clear()
+        self.size = 0
@@ -22,6 +22,8 @@
 
 from gi.repository import Gtk, GdkPixbuf
 
+from grotesque import db
+
 
 class FilterStore(Gtk.ListStore):
     '''This class implements a widget which holds information on a library
@@ -29,28 +31,107 @@ class FilterStore(Gtk.ListStore):
     library. When, for example, there are no more stories by Author X in the
     library, Author X should be removed from the filter.
 
+    If facet is given, it names one of the facets of db.query.FACET_QUERIES
+    and the counts are kept up to date story by story with add_stories()
+    and remove_stories().  The store then also keeps an index of the
+    stories which have each item, by the ID in the item's row, so that
+    the library can be filtered by looking the stories up rather than by
+    searching every row.  Otherwise, query_func returns the (id, string)
+    of every item, and the items are only reloaded by update().
+
     '''
-    def __init__(self, conn, query_func):
+    def __init__(self, conn, query_func=None, facet=None):
         super(FilterStore, self).__init__(str, int)
         self.conn = conn
         self.query_func = query_func
+        self.facet = facet
+        # Each item ID maps to [row iter, count].  List store iters stay
+        # valid until their row is removed.
+        self.items = {}
+        # The row IDs given to items without an integer ID of their own.
+        self.row_ids = {}
+        # The item IDs and row IDs of the items of each story, so that they
+        # can be counted off again once the story has gone from the
+        # database.
+        self.story_items = {}
+        # The set of story IDs having each item, by row ID.
+        self.item_stories = {}
         self.update()
 
-    def add_item(self, item_id, item_str):
-        self.append([item_str, item_id])
+    def _row_id(self, item_id):
+        # Items without an integer ID of their own (i.e. languages) are
+        # numbered as they turn up, and keep their number from then on.
+        if isinstance(item_id, (int, long)):
+            return item_id
+        row_id = self.row_ids.get(item_id)
+        if row_id is None:
+            row_id = len(self.row_ids)
+            self.row_ids[item_id] = row_id
+        return row_id
+
+    def add_item(self, item_id, item_str, count=1):
+        entry = self.items.get(item_id)
+        if entry is None:
+            self.items[item_id] = [
+                self.append([item_str, self._row_id(item_id)]), count]
+        else:
+            entry[1] += count
+
+    def remove_item(self, item_id, count=1):
+        entry = self.items.get(item_id)
+        if entry is None:
+            return False
+        entry[1] -= count
+        if entry[1] <= 0:
+            self.remove(entry[0])
+            del self.items[item_id]
+        return True
+
+    def add_stories(self, story_ids):
+        if self.facet is None:
+            return
+        rows = db.query.select_story_facets(self.conn, self.facet, story_ids)
+        self._add_story_rows(rows)
 
-    def remove_item(self, item_id):
-        row_iter = self.get_iter_first()
-        while row_iter:
-            if self.get_value(row_iter, 1) == item_id:
-                self.remove(row_iter)
-                return True
-            row_iter = self.iter_next(row_iter)
-        return False
+    def remove_stories(self, story_ids):
+        if self.facet is None:
+            return
+        for story_id in story_ids:
+            for item_id, row_id in self.story_items.pop(story_id, ()):
+                self.remove_item(item_id)
+                stories = self.item_stories.get(row_id)
+                if stories is not None:
+                    stories.discard(story_id)
+                    if not stories:
+                        del self.item_stories[row_id]
+
+    def get_item_stories(self, row_id):
+        '''Return the set of IDs of the stories which have an item, given
+        the ID in its row.
+
+        '''
+        return self.item_stories.get(row_id, frozenset())
+
+    def _add_story_rows(self, rows):
+        for story_id, item_id, item_str in rows:
+            if item_id is None or item_str is None:
+                continue
+            row_id = self._row_id(item_id)
+            self.story_items.setdefault(story_id, []).append(
+                (item_id, row_id))
+            self.item_stories.setdefault(row_id, set()).add(story_id)
+            self.add_item(item_id, item_str)
 
     def update(self):
         self.clear()
+        self.items = {}
+        self.story_items = {}
+        self.item_stories = {}
         self.add_item(-1, "(All)")
+        if self.facet is not None:
+            self._add_story_rows(
+                db.query.select_story_facets(self.conn, self.facet))
+            return
         rows = self.query_func(self.conn)
         for row in rows:
             if not row or len(row) != 2 or None in row:
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+#       galleryview.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from gi.repository import Gtk, GObject, Pango
+
+from grotesque.ui.gtk3.info.pixbufcache import PixbufCache
+from grotesque.ui.gtk3.threads.coverloader import CoverLoader
+
+
+# The size, in pixels, of the square which each cover is fitted into.
+COVER_SIZE = 128
+# The number of bytes of decoded covers to keep in memory.
+CACHE_SIZE = 24 * 1024 * 1024
+# How long to wait, in milliseconds, for the view to stop changing before
+# asking for the covers which have come into sight.
+LOAD_DELAY = 30
+
+
+class GalleryView(Gtk.IconView):
+    '''This class implements a widget which displays the library as a grid
+    of cover art.  It shows the same filtered and sorted model as the
+    library view.
+
+    Only the covers which are in sight, or a page ahead of them in the
+    direction of scrolling, are loaded, on a worker thread and nearest
+    first.  The cells are all the same size whether or not their covers
+    have arrived, so that laying out the grid never depends on the
+    images.  Covers which have not been in sight for a while are dropped
+    once the decoded covers take up more than CACHE_SIZE bytes.
+
+    '''
+    title_col = 1
+
+    def __init__(self, library, model, db_manager):
+        self.library = library
+        super(GalleryView, self).__init__(model=model)
+        self.library.views.append(self)
+        self.cover_cache = PixbufCache(CACHE_SIZE)
+        # The stories which are known to have no cover to show.
+        self.no_cover = set()
+        # The stories whose covers have last been asked for.
+        self.loading = set()
+        self.loader = CoverLoader(db_manager, COVER_SIZE,
+                                  self.on_covers_loaded)
+        self.load_source = None
+        self.scroll_value = 0.0
+        self.scrolling_up = False
+        self.set_selection_mode(Gtk.SelectionMode.MULTIPLE)
+        self.set_item_width(COVER_SIZE)
+        cover_renderer = Gtk.CellRendererPixbuf()
+        cover_renderer.set_fixed_size(COVER_SIZE, COVER_SIZE)
+        cover_renderer.set_property('stock-size', Gtk.IconSize.DIALOG)
+        self.pack_start(cover_renderer, False)
+        self.set_cell_data_func(cover_renderer, self._render_cover)
+        title_renderer = Gtk.CellRendererText()
+        title_renderer.set_property('ellipsize', Pango.EllipsizeMode.END)
+        title_renderer.set_property('xalign', 0.5)
+        title_renderer.set_fixed_size(COVER_SIZE, -1)
+        # Measuring every title would make laying out a large library slow.
+        title_renderer.set_fixed_height_from_font(1)
+        self.pack_start(title_renderer, False)
+        self.add_attribute(title_renderer, 'text', self.title_col)
+        self.add_attribute(title_renderer, 'weight', self.library.weight_col)
+        self.connect('map', self.on_view_changed)
+        self.connect('size-allocate', self.on_view_changed)
+        self.connect('notify::vadjustment', self.on_vadjustment_set)
+        for signal in ['row-inserted', 'row-deleted', 'rows-reordered']:
+            model.connect(signal, self.on_view_changed)
+        # A story's cover may have changed whenever its row does.
+        self.library.list_store.connect('row-changed',
+                                        self.on_library_row_changed)
+
+    def _render_cover(self, cell_layout, cell, model, row_iter, data):
+        # This is called for every cell whenever the grid is laid out, so
+        # it must do no more than look the cover up.
+        story_id = model.get_value(row_iter, self.library.story_id_col)
+        pixbuf = self.cover_cache.peek(story_id)
+        if pixbuf is not None:
+            cell.set_property('pixbuf', pixbuf)
+        elif story_id in self.no_cover:
+            cell.set_property('icon-name', 'image-missing')
+        else:
+            cell.set_property('icon-name', 'image-loading')
+
+    def get_story_ids(self, start, end):
+        '''This method returns the IDs of the stories shown from position
+        start up to, but not including, end, in that order.  end may be
+        less than start.
+
+        '''
+        model = self.get_model()
+        step = 1 if end >= start else -1
+        story_ids = []
+        for n in range(start, end, step):
+            row_iter = model.iter_nth_child(None, n)
+            story_ids.append(model.get_value(row_iter,
+                                             self.library.story_id_col))
+        return story_ids
+
+    def load_visible_covers(self):
+        '''This method asks for the covers in sight which have not been
+        loaded, in the order in which they are being scrolled into view,
+        followed by those of the next page in that direction.
+
+        '''
+        model = self.get_model()
+        if model is None or not self.get_mapped():
+            return
+        visible_range = self.get_visible_range()
+        if visible_range is None:
+            return
+        n_stories = model.iter_n_children(None)
+        # The grid may not have been laid out again since the model last
+        # changed.
+        start = min(visible_range[0].get_indices()[0], n_stories)
+        end = min(visible_range[1].get_indices()[0] + 1, n_stories)
+        page = end - start
+        if self.scrolling_up:
+            visible = self.get_story_ids(end - 1, start - 1)
+            ahead = self.get_story_ids(start - 1, max(start - 1 - page, -1))
+        else:
+            visible = self.get_story_ids(start, end)
+            ahead = self.get_story_ids(end, min(end + page, n_stories))
+        for story_id in visible:
+            # Keep the covers in sight from being the next to be dropped.
+            self.cover_cache.get(story_id)
+        wanted = [story_id for story_id in visible + ahead
+                  if story_id not in self.cover_cache and
+                  story_id not in self.no_cover]
+        self.loading = set(wanted)
+        self.loader.request(wanted)
+
+    def queue_load(self):
+        if self.load_source is None:
+            self.load_source = GObject.timeout_add(LOAD_DELAY,
+                                                   self._on_load_timeout)
+
+    def _on_load_timeout(self):
+        self.load_source = None
+        self.load_visible_covers()
+        return False
+
+    def stop(self):
+        if self.load_source is not None:
+            GObject.source_remove(self.load_source)
+            self.load_source = None
+        self.loader.stop()
+
+    def join(self, timeout=None):
+        return self.loader.join(timeout)
+
+    def on_covers_loaded(self, covers):
+        '''This method handles covers arriving from the loader.
+
+        '''
+        for story_id, pixbuf in covers:
+            if story_id not in self.loading:
+                # The cover is no longer wanted, or the story has changed
+                # since it was asked for.
+                continue
+            self.loading.discard(story_id)
+            if pixbuf is None:
+                self.no_cover.add(story_id)
+            else:
+                self.cover_cache.put(story_id, pixbuf)
+        self.queue_draw()
+
+    def on_library_row_changed(self, list_store, path, row_iter):
+        story_id = list_store.get_value(row_iter, self.library.story_id_col)
+        self.cover_cache.discard(story_id)
+        self.no_cover.discard(story_id)
+        self.loading.discard(story_id)
+        self.queue_load()
+
+    def on_vadjustment_set(self, view, pspec):
+        vadjustment = self.get_vadjustment()
+        if vadjustment is not None:
+            vadjustment.connect('value-changed', self.on_scrolled)
+            vadjustment.connect('changed', self.on_view_changed)
+
+    def on_scrolled(self, vadjustment):
+        value = vadjustment.get_value()
+        if value != self.scroll_value:
+            self.scrolling_up = value < self.scroll_value
+            self.scroll_value = value
+        self.queue_load()
+
+    def on_view_changed(self, *args):
+        self.queue_load()
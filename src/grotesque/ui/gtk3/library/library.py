@@ -21,16 +21,34 @@
 #       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import locale
 import datetime
+import time
+from contextlib import contextmanager
 
-from gi.repository import Gtk, Pango
+from gi.repository import Gtk, Pango, GObject
 
 from filterstore import FilterStore
+from librarycolumns import LibraryColumns
+from sortkeys import SortKeys
 from grotesque import db, util, ifdb
 from treatyofbabel import ifiction
 
 
+# Changes to the library are applied to the filter stores once they have
+# stopped coming for FILTER_UPDATE_DELAY milliseconds, or at the latest
+# FILTER_UPDATE_MAX_WAIT seconds after the first of them.
+FILTER_UPDATE_DELAY = 250
+FILTER_UPDATE_MAX_WAIT = 2.0
+# When at least this many stories are added at once, they are loaded with
+# the views detached and sorting turned off.
+BULK_LOAD_THRESHOLD = 100
+# The text columns which are sorted by the locale's collation.  Each has a
+# hidden column of integer sort keys, from SORT_KEY_COL on in this order,
+# which is what the list store and the views are really sorted by.
+SORTED_COLS = [1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12]
+SORT_KEY_COL = 19
+
+
 class Library:
     '''A class to store the user's library of interactive fiction.
 
@@ -42,40 +60,103 @@ class Library:
         # 5: publishing date, 6: genre, 7: group, 8: series, 9: series
         # number, 10: forgiveness, 11: tags, 12: date imported 13: star rating
         # text, 14: IFDB rating text, 15: star rating float, 16: IFDB
-        # rating float, 17: story id, 18: text weight
-        self.list_store = Gtk.ListStore(bool, str, str, str, str, str, str,
-                                        str, str, int, str, str, str, str, str,
-                                        float, float, int, Pango.Weight)
-        self.list_store.set_sort_column_id(1, Gtk.SortType.ASCENDING)
-        for col in range(1, 13):
-            self.list_store.set_sort_func(col, self._sort, None)
+        # rating float, 17: story id, 18: text weight, 19 onwards: the sort
+        # keys of the columns in SORTED_COLS
+        self.list_store = Gtk.ListStore(
+            bool, str, str, str, str, str, str, str, str, int, str, str, str,
+            str, str, float, float, int, Pango.Weight,
+            *([GObject.TYPE_INT64] * len(SORTED_COLS)))
+        self.sort_keys = dict((col, SortKeys()) for col in SORTED_COLS)
+        self.list_store.set_sort_column_id(self.sort_column(1),
+                                           Gtk.SortType.ASCENDING)
         self.story_id_col = 17
         self.weight_col = 18
+        # A copy of the numeric columns, by which the library may be
+        # filtered by ranges of ratings and the like.
+        self.columns = LibraryColumns()
+        # The views which display the list store, so that they can be
+        # detached from it while it is being bulk loaded.
+        self.views = []
         # The following Filterstores keep track of which authors, years, etc
         # are currently represented in the library so the user may filter it by
         # them.
-        self.author_store = FilterStore(self.conn, db.query.select_all_authors)
-        self.year_store = FilterStore(self.conn, self._all_pub_years)
-        self.genre_store = FilterStore(self.conn, db.query.select_all_genres)
-        self.group_store = FilterStore(self.conn, db.query.select_all_groups)
-        self.series_store = FilterStore(self.conn, db.query.select_all_series)
-        self.forgiveness_store = FilterStore(self.conn,
-                                             db.query.select_all_forgiveness)
+        self.author_store = FilterStore(self.conn, facet="authors")
+        self.year_store = FilterStore(self.conn, facet="years")
+        self.genre_store = FilterStore(self.conn, facet="genres")
+        self.group_store = FilterStore(self.conn, facet="groups")
+        self.series_store = FilterStore(self.conn, facet="series")
+        self.forgiveness_store = FilterStore(self.conn, facet="forgiveness")
         self.rating_store = FilterStore(self.conn, self._all_star_ratings)
         self.ifdb_rating_store = FilterStore(self.conn, self._all_star_ratings)
-        self.lang_store = FilterStore(self.conn, self._all_langs)
-        self.tag_store = FilterStore(self.conn, db.query.select_all_tags)
-        stories = db.query.select_all_stories(self.conn)
-        for story_row in stories:
-            self.add_story_from_db_rec(story_row)
+        self.lang_store = FilterStore(self.conn, facet="languages")
+        self.tag_store = FilterStore(self.conn, facet="tags")
+        # Stories which have been added or removed since the filter stores
+        # were last updated.
+        self.added_stories = set()
+        self.removed_stories = set()
+        self.filter_update_source = None
+        self.filter_update_queued = None
+        # Functions to call once the filter stores, and so their indexes of
+        # stories, have been brought up to date.
+        self.filter_update_callbacks = []
+        self.add_stories()
+
+    def _counted_filter_stores(self):
+        return [self.author_store, self.year_store, self.genre_store,
+                self.group_store, self.series_store, self.forgiveness_store,
+                self.lang_store, self.tag_store]
 
     def update_filter_stores(self):
-        self.author_store.update()
-        self.year_store.update()
-        self.genre_store.update()
-        self.group_store.update()
-        self.series_store.update()
-        self.tag_store.update()
+        """Reload the filter stores from scratch."""
+        for store in self._counted_filter_stores():
+            store.update()
+        for callback in self.filter_update_callbacks:
+            callback()
+
+    def queue_filter_update(self, added=(), removed=(), changed=()):
+        """Note that stories have been added to, removed from or changed
+        in the library, so that the filter stores are brought up to date
+        for all of them at once when the changes die down.
+
+        """
+        self.added_stories.update(added)
+        self.removed_stories.update(removed)
+        # A changed story has its old items counted off and its new ones
+        # counted on.
+        self.removed_stories.update(changed)
+        self.added_stories.update(changed)
+        now = time.time()
+        if self.filter_update_source is None:
+            self.filter_update_queued = now
+        elif now - self.filter_update_queued < FILTER_UPDATE_MAX_WAIT:
+            GObject.source_remove(self.filter_update_source)
+        else:
+            return
+        self.filter_update_source = GObject.timeout_add(
+            FILTER_UPDATE_DELAY, self._on_filter_update_timeout)
+
+    def flush_filter_updates(self):
+        """Apply any queued changes to the filter stores now."""
+        if self.filter_update_source is not None:
+            GObject.source_remove(self.filter_update_source)
+        self._on_filter_update_timeout()
+
+    def _on_filter_update_timeout(self):
+        self.filter_update_source = None
+        if not self.added_stories and not self.removed_stories:
+            return False
+        for store in self._counted_filter_stores():
+            store.remove_stories(self.removed_stories)
+            store.add_stories(self.added_stories)
+        # Changed stories were already brought up to date when their rows
+        # were.
+        self.columns.remove_stories(self.removed_stories -
+                                    self.added_stories)
+        self.added_stories.clear()
+        self.removed_stories.clear()
+        for callback in self.filter_update_callbacks:
+            callback()
+        return False
 
     def add_story_from_db_rec(self, story_row, row_iter=None):
         """Add a story to the liststore from a database row.
@@ -83,13 +164,112 @@ class Library:
         """
         if not story_row:
             return
-        annotation = db.query.select_annotation_by_story(self.conn,
-                                                         story_row["id"])
-        if annotation:
-            played = bool(annotation["played"])
-            rating = annotation["rating"]
-            rating_txt = annotation["rating_txt"]
-            imported = str(annotation["imported"])
+        self.add_stories([story_row["id"]], row_iter)
+
+    def add_stories(self, story_ids=None, row_iter=None):
+        """Add stories (by default, all of them) to the liststore, or
+        refresh the row pointed to by row_iter, from a single library
+        projection query.
+
+        """
+        self.add_library_rows(
+            db.query.select_library_rows(self.conn, story_ids), row_iter)
+
+    def add_library_rows(self, library_rows, row_iter=None):
+        """Add stories to the liststore, or refresh the row pointed to by
+        row_iter, from rows of the library projection query.  The rows may
+        have been read on another thread, with another connection.
+
+        """
+        rows = [self._library_row_values(library_row)
+                for library_row in library_rows]
+        self._set_story_columns(library_rows, rows)
+        bulk = len(rows) >= BULK_LOAD_THRESHOLD
+        for col in SORTED_COLS:
+            if bulk:
+                self.sort_keys[col].add_values(row[col] for row in rows)
+            else:
+                for row in rows:
+                    self.sort_keys[col].key(row[col])
+        # Every value now has its key, so the keys of the new rows are
+        # final, although those already in the list store may not be.
+        for row in rows:
+            row.extend(self.sort_keys[col].key(row[col])
+                       for col in SORTED_COLS)
+        renumbered = [col for col in SORTED_COLS
+                      if self.sort_keys[col].renumbered]
+        if bulk or renumbered:
+            with self.bulk_load():
+                self._update_renumbered_keys(renumbered)
+                self._put_rows(rows, row_iter)
+        else:
+            self._put_rows(rows, row_iter)
+
+    def _put_rows(self, rows, row_iter):
+        if row_iter is not None:
+            for row in rows:
+                self.list_store.set_row(row_iter, row)
+        else:
+            for row in rows:
+                self.list_store.append(row)
+
+    def sort_column(self, col):
+        """Return the column by which a column of the list store is really
+        sorted.
+
+        """
+        if col in self.sort_keys:
+            return SORT_KEY_COL + SORTED_COLS.index(col)
+        return col
+
+    def _update_renumbered_keys(self, cols):
+        # Look the sort keys up again for the columns whose keys have all
+        # changed.  This must be done while the list store is unsorted:
+        # otherwise each row would move as soon as its key was rewritten,
+        # and the iteration would skip rows.
+        if not cols:
+            return
+        key_cols = [self.sort_column(col) for col in cols]
+        row_iters = []
+        row_iter = self.list_store.get_iter_first()
+        while row_iter is not None:
+            row_iters.append(row_iter)
+            row_iter = self.list_store.iter_next(row_iter)
+        for row_iter in row_iters:
+            keys = [self.sort_keys[col].key(
+                        self.list_store.get_value(row_iter, col))
+                    for col in cols]
+            self.list_store.set(row_iter, key_cols, keys)
+        for col in cols:
+            self.sort_keys[col].renumbered = False
+
+    @contextmanager
+    def bulk_load(self):
+        """Detach the views from the list store and turn off its sorting
+        while many rows are added to it, so that it is sorted once at the
+        end rather than with Python comparisons on every insert.
+
+        """
+        models = [(view, view.get_model()) for view in self.views]
+        for view, model in models:
+            view.set_model(None)
+        sort_col, sort_order = self.list_store.get_sort_column_id()
+        self.list_store.set_sort_column_id(
+            Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+        try:
+            yield
+        finally:
+            if sort_col is not None:
+                self.list_store.set_sort_column_id(sort_col, sort_order)
+            for view, model in models:
+                view.set_model(model)
+
+    def _library_row_values(self, library_row):
+        if library_row["annotation_id"] is not None:
+            played = bool(library_row["played"])
+            rating = library_row["rating"]
+            rating_txt = library_row["rating_txt"]
+            imported = str(library_row["imported"])
         else:
             played = False
             rating = 0.0
@@ -99,63 +279,47 @@ class Library:
             text_weight = Pango.Weight.NORMAL
         else:
             text_weight = Pango.Weight.BOLD
-        ifdb_annotation = db.query.select_ifdb_annotation_by_story(
-            self.conn, story_row["id"])
-        if ifdb_annotation:
-            ifdb_rating = ifdb_annotation["star_rating"]
-            ifdb_rating_txt = ifdb_annotation["star_rating_txt"]
+        if library_row["ifdb_annotation_id"] is not None:
+            ifdb_rating = library_row["ifdb_rating"]
+            ifdb_rating_txt = library_row["ifdb_rating_txt"]
         else:
             ifdb_rating = 0.0
             ifdb_rating_txt = util.render_star_rating(0.0)
-        author_ids = db.query.select_story_authors(self.conn, story_row["id"])
-        authors_list = [db.query.select_author(self.conn, author_id[0])["name"] for
-                        author_id in author_ids]
-        authors = ", ".join(authors_list)
-        if story_row["firstpublished"] is not None:
-            yearpublished = str(story_row["firstpublished"].year)
+        if library_row["firstpublished"] is not None:
+            yearpublished = str(library_row["firstpublished"].year)
         else:
             yearpublished = ""
-        genre_ids = db.query.select_story_genres(self.conn, story_row["id"])
-        if genre_ids:
-            genres_list = [db.query.select_genre(self.conn, genre_id[0])["name"] for
-                           genre_id in genre_ids]
-            genres = "/".join(genres_list)
-        else:
-            genres = ""
-        if story_row["group_id"] is not None:
-            group_row = db.query.select_group(self.conn, story_row["group_id"])
-            group = group_row["name"]
-        else:
-            group = ""
-        if story_row["series_id"] is not None:
-            series_row = db.query.select_series(self.conn, story_row["series_id"])
-            series = series_row["name"]
-        else:
-            series = ""
-        if story_row["forgiveness_id"] is not None:
-            forgive_row = db.query.select_forgiveness(
-                self.conn, story_row["forgiveness_id"])
-            forgiveness = forgive_row["description"]
-        else:
-            forgiveness = ""
-        tag_ids = db.query.select_story_tags(self.conn, story_row["id"])
-        if tag_ids:
-            tags_list = [db.query.select_tag(self.conn, tag_id[0])["name"] for
-                           tag_id in tag_ids]
-            tags = "/".join(tags_list)
-        else:
-            tags = ""
-        if row_iter is None:
-            row_iter = self.list_store.insert(-1)
-        self.list_store.set_row(row_iter,
-                                [played, story_row["title"], authors,
-                                 story_row["language"],
-                                 story_row["headline"], yearpublished,
-                                 genres, group, series,
-                                 story_row["seriesnumber"],
-                                 forgiveness, tags, imported, rating_txt,
-                                 ifdb_rating_txt, rating, ifdb_rating,
-                                 story_row["id"], text_weight])
+        return [played, library_row["title"],
+                library_row["authors"] or "",
+                library_row["language"],
+                library_row["headline"], yearpublished,
+                library_row["genres"] or "",
+                library_row["group_name"] or "",
+                library_row["series_name"] or "",
+                library_row["seriesnumber"],
+                library_row["forgiveness"] or "",
+                library_row["tags"] or "", imported,
+                rating_txt, ifdb_rating_txt, rating,
+                ifdb_rating, library_row["id"],
+                text_weight]
+
+    def _set_story_columns(self, library_rows, rows):
+        years = []
+        imported = []
+        for library_row in library_rows:
+            if library_row["firstpublished"] is not None:
+                years.append(library_row["firstpublished"].year)
+            else:
+                years.append(0)
+            if isinstance(library_row["imported"], datetime.date):
+                imported.append(library_row["imported"].toordinal())
+            else:
+                imported.append(0)
+        self.columns.set_stories(
+            [row[17] for row in rows], rating=[row[15] for row in rows],
+            ifdb_rating=[row[16] for row in rows], year=years,
+            played=[row[0] for row in rows], imported=imported,
+            series_number=[row[9] for row in rows])
 
     def story_iter(self, story_id):
         row_iter = self.list_store.get_iter_first()
@@ -170,51 +334,59 @@ class Library:
         return [(n, rating) for (n, rating) in
                 enumerate(util.STAR_RATINGS[1:])]
 
-    def _all_pub_years(self, conn):
-        pub_rows = db.query.select_all_story_years(conn)
-        years = set()
-        for row in pub_rows:
-            if row is not None and row[0] is not None:
-                years.add(row[0].year)
-        return [(n, str(year)) for (n, year) in enumerate(years)]
-
-    def _all_langs(self, conn):
-        lang_rows = db.query.select_all_story_langs(conn)
-        langs = set()
-        for row in lang_rows:
-            if row is not None and row[0] is not None:
-                langs.add(row[0])
-        return [(n, str(lang)) for (n, lang) in enumerate(langs)]
-
     def toggle_story_played(self, row_iter):
         """Toggle a story's played state."""
         story_id = self.get_story_id(row_iter)
         annot_row = db.query.select_annotation_by_story(self.conn, story_id)
         cur_played = annot_row["played"]
+        self.columns.set_story(story_id, played=not cur_played)
         if cur_played:
             self.list_store.set_value(row_iter, 0, False)
-            db.query.update_annotation(self.conn, annot_row["id"],
-                                 {"played": False})
+            with self.conn.transaction():
+                db.query.update_annotation(self.conn, annot_row["id"],
+                                           {"played": False})
             self.list_store.set_value(row_iter, self.weight_col,
                                       Pango.Weight.BOLD)
         else:
             self.list_store.set_value(row_iter, 0, True)
-            db.query.update_annotation(self.conn, annot_row["id"],
-                                 {"played": True})
+            with self.conn.transaction():
+                db.query.update_annotation(self.conn, annot_row["id"],
+                                           {"played": True})
             self.list_store.set_value(row_iter, self.weight_col,
                                       Pango.Weight.NORMAL)
 
     def refresh_ifdb(self, row_iter):
         """Refresh a story's IFDB annotation (rating, etc.)."""
         story_id = self.get_story_id(row_iter)
+        tuid = self.get_ifdb_tuid(story_id)
+        if not tuid:
+            return
+        ific_story = ifdb.fetch_ifiction(tuid=tuid)
+        self.update_ifdb_annotation(story_id, ific_story, row_iter)
+
+    def get_ifdb_tuid(self, story_id):
+        """Get the TUID by which IFDB knows a story, if any."""
         ifdb_annot_row = db.query.select_ifdb_annotation_by_story(
             self.conn, story_id)
         if not ifdb_annot_row:
+            return None
+        return ifdb_annot_row["tuid"]
+
+    def update_ifdb_annotation(self, story_id, ific_story, row_iter=None):
+        """Update a story's IFDB annotation from freshly fetched
+        IFiction.
+
+        """
+        if ific_story is None:
             return
-        tuid = ifdb_annot_row["tuid"]
-        if not tuid:
+        ifdb_annot_row = db.query.select_ifdb_annotation_by_story(
+            self.conn, story_id)
+        if not ifdb_annot_row:
             return
-        ific_story = ifdb.fetch_ifiction(tuid=tuid)
+        if row_iter is None:
+            row_iter = self.story_iter(story_id)
+            if row_iter is None:
+                return
         annotation = ifiction.get_annotation(ific_story)
         ifdb_annot = annotation["ifdb"]
         if "coverart" in ifdb_annot and "url" in ifdb_annot["coverart"]:
@@ -237,8 +409,9 @@ class Library:
                         "rating_count_avg": ifdb_annot.get("ratingcountavg"),
                         "rating_count_tot": ifdb_annot.get("ratingcounttot"),
                         "updated": last_updated}
-        db.query.update_ifdb_annotation(self.conn, ifdb_annot_row["id"],
-                                        new_ifdb_row)
+        with self.conn.transaction():
+            db.query.update_ifdb_annotation(self.conn, ifdb_annot_row["id"],
+                                            new_ifdb_row)
         self.add_story_from_db_rec(
             db.query.select_story(self.conn, story_id), row_iter)
 
@@ -246,7 +419,10 @@ class Library:
         """Mark a story as having been played."""
         story_id = self.get_story_id(row_iter)
         annot_row = db.query.select_annotation_by_story(self.conn, story_id)
-        db.query.update_annotation(self.conn, annot_row["id"], {"played": True})
+        with self.conn.transaction():
+            db.query.update_annotation(self.conn, annot_row["id"],
+                                       {"played": True})
+        self.columns.set_story(story_id, played=True)
         self.list_store.set_value(row_iter, 0, True)
         self.list_store.set_value(row_iter, self.weight_col,
                                   Pango.Weight.NORMAL)
@@ -256,13 +432,3 @@ class Library:
         if row_iter is None:
             return None
         return self.list_store.get_value(row_iter, self.story_id_col)
-
-    def _sort(self, model, iter1, iter2, data):
-        col, _ = model.get_sort_column_id()
-        value1 = model.get_value(iter1, col)
-        value2 = model.get_value(iter2, col)
-        if value1 is None:
-            return 1
-        elif value2 is None:
-            return -1
-        return locale.strcoll(value1, value2)
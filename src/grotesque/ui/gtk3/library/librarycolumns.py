@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+#       librarycolumns.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import array
+import itertools
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The columns and their array type codes.  Unknown years, import dates and
+# series numbers are 0; import dates are day ordinals.
+COLUMNS = [("story_id", "l"), ("rating", "d"), ("ifdb_rating", "d"),
+           ("year", "l"), ("played", "b"), ("imported", "l"),
+           ("series_number", "l")]
+INITIAL_CAPACITY = 1024
+
+
+def _new_column(typecode, capacity):
+    if numpy is not None:
+        return numpy.zeros(capacity, dtype=typecode)
+    return array.array(typecode, [0] * capacity)
+
+
+def _grow_column(column, capacity):
+    if numpy is not None:
+        grown = numpy.zeros(capacity, dtype=column.dtype)
+        grown[:len(column)] = column
+        return grown
+    column.extend([0] * (capacity - len(column)))
+    return column
+
+
+class LibraryColumns():
+    '''This class keeps a copy of the library's numeric columns, one array
+    per column, so that the stories whose ratings, years and so on lie in
+    a range can be picked out in one pass over an array rather than by
+    asking every row of the list store in turn.  NumPy is used if it is
+    available; otherwise the arrays are plain Python arrays.
+
+    '''
+    def __init__(self):
+        self.size = 0
+        # The position of each story in the arrays.
+        self.positions = {}
+        self.columns = dict((name, _new_column(typecode, INITIAL_CAPACITY))
+                            for name, typecode in COLUMNS)
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size):
+        capacity = len(self.columns["story_id"])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in self.columns:
+            self.columns[name] = _grow_column(self.columns[name], capacity)
+
+    def set_stories(self, story_ids, **values):
+        '''Add or change many stories at once.  Each keyword argument gives
+        the values of a column in the order of story_ids.
+
+        '''
+        if any(story_id in self.positions for story_id in story_ids):
+            for n, story_id in enumerate(story_ids):
+                self.set_story(story_id, **dict(
+                    (name, column_values[n])
+                    for name, column_values in values.items()))
+            return
+        # New stories are simply added to the ends of the arrays.
+        start = self.size
+        end = start + len(story_ids)
+        self._reserve(end)
+        values["story_id"] = story_ids
+        for name, typecode in COLUMNS:
+            column_values = [value or 0 for value in
+                             values.get(name, [0] * len(story_ids))]
+            if numpy is None:
+                column_values = array.array(typecode, column_values)
+            self.columns[name][start:end] = column_values
+        for n, story_id in enumerate(story_ids):
+            self.positions[story_id] = start + n
+        self.size = end
+
+    def set_story(self, story_id, **values):
+        '''Add a story, or change some of its values.'''
+        pos = self.positions.get(story_id)
+        if pos is None:
+            pos = self.size
+            self._reserve(pos + 1)
+            for name, column in self.columns.items():
+                column[pos] = 0
+            self.columns["story_id"][pos] = story_id
+            self.positions[story_id] = pos
+            self.size += 1
+        for name, value in values.items():
+            self.columns[name][pos] = value or 0
+
+    def remove_stories(self, story_ids):
+        for story_id in story_ids:
+            pos = self.positions.pop(story_id, None)
+            if pos is None:
+                continue
+            # Move the last story into the gap.
+            last = self.size - 1
+            if pos != last:
+                for column in self.columns.values():
+                    column[pos] = column[last]
+                self.positions[int(self.columns["story_id"][pos])] = pos
+            self.size = last
+
+    def select(self, name, low=None, high=None):
+        '''Return the set of IDs of the stories whose value in a column lies
+        between low and high, inclusive.  Either bound may be left out.
+
+        '''
+        story_ids = self.columns["story_id"]
+        column = self.columns[name]
+        if numpy is not None:
+            values = column[:self.size]
+            mask = numpy.ones(self.size, dtype=bool)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+            return set(story_ids[:self.size][mask].tolist())
+        values = itertools.islice(column, self.size)
+        if low is not None and high is not None:
+            return set(story_id for story_id, value
+                       in itertools.izip(story_ids, values)
+                       if low <= value <= high)
+        elif low is not None:
+            return set(story_id for story_id, value
+                       in itertools.izip(story_ids, values) if low <= value)
+        elif high is not None:
+            return set(story_id for story_id, value
+                       in itertools.izip(story_ids, values) if value <= high)
+        return set(itertools.islice(story_ids, self.size))
@@ -34,6 +34,22 @@ class LibraryFilterView(Gtk.TreeView):
         self.set_rules_hint(True)
         self.library = library
         self.filter_model = None
+        # The library view always shows the same filtered and sorted
+        # models, so that choosing a different filter only has to refilter
+        # the library rather than sort it all over again.
+        self.library_filter = (None, '(All)', None, None)
+        # The IDs of the stories having the chosen item, from the filter
+        # store's index, or having at least the chosen rating, from the
+        # library's columns, or None if the library is not filtered.
+        self.visible_stories = None
+        self.library.filter_update_callbacks.append(
+            self.on_library_filters_updated)
+        self.library_filter_model = self.library.list_store.filter_new(None)
+        self.library_filter_model.set_visible_func(self._filter_visible)
+        self.library_model = Gtk.TreeModelSort.new_with_model(
+            self.library_filter_model)
+        sort_col, sort_order = self.library.list_store.get_sort_column_id()
+        self.library_model.set_sort_column_id(sort_col, sort_order)
 
     def select_all(self):
         select = self.get_selection()
@@ -44,18 +60,7 @@ class LibraryFilterView(Gtk.TreeView):
 
         '''
         # Get the model based on the filter type
-        self.filter_model = {
-            'Author': self.library.author_store,
-            'Year': self.library.year_store,
-            'Genre': self.library.genre_store,
-            'Group': self.library.group_store,
-            'Series': self.library.series_store,
-            'Forgiveness': self.library.forgiveness_store,
-            'Minimum Rating': self.library.rating_store,
-            'Minimum IFDB Rating': self.library.ifdb_rating_store,
-            'Language': self.library.lang_store,
-            'Tag': self.library.tag_store}.get(
-                type_text)
+        self.filter_model = self._get_filter_store(type_text)
         # Sort the contents of the model
         self.sorted_model = Gtk.TreeModelSort.new_with_model(
             self.filter_model)
@@ -82,6 +87,20 @@ class LibraryFilterView(Gtk.TreeView):
             self.sorted_model.set_sort_column_id(0, Gtk.SortType.ASCENDING)
         self.select_all()
 
+    def _get_filter_store(self, type_text):
+        return {
+            'Author': self.library.author_store,
+            'Year': self.library.year_store,
+            'Genre': self.library.genre_store,
+            'Group': self.library.group_store,
+            'Series': self.library.series_store,
+            'Forgiveness': self.library.forgiveness_store,
+            'Minimum Rating': self.library.rating_store,
+            'Minimum IFDB Rating': self.library.ifdb_rating_store,
+            'Language': self.library.lang_store,
+            'Tag': self.library.tag_store}.get(
+                type_text)
+
     def _sort(self, model, iter1, iter2, filter_type):
         '''This method defines how to sort the contents of the filter store,
         accounting for the "(All)" entries, which should remain at the top.
@@ -108,34 +127,44 @@ class LibraryFilterView(Gtk.TreeView):
         given the current filter.
 
         '''
-        (filter_type, filter_text, filter_id, filter_col) = data
-        if filter_text == '(All)':
+        if self.visible_stories is None:
             return True
-        else:
-            value = model.get_value(row_iter, filter_col)
-            if filter_type in ['rating_num', 'ifdb_rating_num']:
-                return float(filter_id)/2.0 + 0.5 <= value
-            else:
-                return value and filter_text in value
+        story_id = model.get_value(row_iter, self.library.story_id_col)
+        return story_id in self.visible_stories
 
     def filter_library(self, filter_type, filter_text, filter_id, filter_col):
-        '''This method filters the library.
+        '''This method filters the library.  The rows which stay visible
+        keep their order and remain selected.
 
         '''
-        self.filter_model = self.library.list_store.filter_new(None)
-        self.filter_model.set_visible_func(
-            self._filter_visible, (filter_type, filter_text, filter_id,
-                                   filter_col))
-        self.filter_model.refilter()
-        sortable_filter_model = Gtk.TreeModelSort.new_with_model(
-            self.filter_model)
-        sortable_filter_model.connect("sort-column-changed",
-                                      self.on_library_sort_column_changed)
-        sort_col, sort_order = self.library.list_store.get_sort_column_id()
-        sortable_filter_model.set_sort_column_id(
-            sort_col, sort_order)
-        return sortable_filter_model
+        library_filter = (filter_type, filter_text, filter_id, filter_col)
+        if library_filter == self.library_filter:
+            return
+        self.library_filter = library_filter
+        self._update_visible_stories()
+        self.library_filter_model.refilter()
+
+    def _update_visible_stories(self):
+        filter_type, filter_text, filter_id = self.library_filter[:3]
+        if filter_text == '(All)':
+            self.visible_stories = None
+        elif filter_type == 'rating_num':
+            self.visible_stories = self.library.columns.select(
+                'rating', low=float(filter_id)/2.0 + 0.5)
+        elif filter_type == 'ifdb_rating_num':
+            self.visible_stories = self.library.columns.select(
+                'ifdb_rating', low=float(filter_id)/2.0 + 0.5)
+        else:
+            filter_store = self._get_filter_store(filter_type)
+            self.visible_stories = filter_store.get_item_stories(filter_id)
 
-    def on_library_sort_column_changed(self, sortable_model):
-        sort_col, sort_order = sortable_model.get_sort_column_id()
-        self.library.list_store.set_sort_column_id(sort_col, sort_order)
+    def on_library_filters_updated(self):
+        '''This method handles the library's filter stores having been
+        brought up to date after stories were added, removed or changed,
+        which only matters when the library is filtered.
+
+        '''
+        if self.visible_stories is None:
+            return
+        self._update_visible_stories()
+        self.library_filter_model.refilter()
@@ -20,12 +20,14 @@
 #       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import time
+import functools
 
 from gi.repository import Gtk, Gdk, GObject
 
+from grotesque import ifdb
 from libraryview import LibraryView
 from libraryfilterview import LibraryFilterView
+from galleryview import GalleryView
 
 
 class LibraryPaned(Gtk.Paned):
@@ -41,13 +43,21 @@ class LibraryPaned(Gtk.Paned):
                     'double-clicked': (GObject.SignalFlags.RUN_LAST, None,
                                        ())}
 
-    def __init__(self, library, settings):
+    def __init__(self, library, settings, db_manager):
         super(LibraryPaned, self).__init__()
         self.set_orientation(Gtk.Orientation.HORIZONTAL)
         self.library = library
         self.settings = settings
+        # The number of IFDB refreshes which are still under way.
+        self.ifdb_refreshes = 0
         self.library_view = LibraryView(self.library)
         self.filter_view = LibraryFilterView(self.library)
+        self.library_view.set_model(self.filter_view.library_model)
+        # The gallery shows the same model, so the two views always agree
+        # on what is in the library and in what order.
+        self.gallery_view = GalleryView(self.library,
+                                        self.filter_view.library_model,
+                                        db_manager)
         self.col_menu = Gtk.Menu()
         # Get all the columns from the library view.
         view_columns = self.library_view.get_columns()
@@ -83,6 +93,21 @@ class LibraryPaned(Gtk.Paned):
         library_scroll.set_vexpand(True)
         library_scroll.set_hexpand(True)
 
+        self.gallery_view.connect('selection-changed',
+                                  self.on_gallery_selection_changed)
+        self.gallery_view.connect('button_press_event',
+                                  self.on_list_button_pressed)
+        gallery_scroll = Gtk.ScrolledWindow()
+        gallery_scroll.set_policy(Gtk.PolicyType.NEVER,
+                                  Gtk.PolicyType.AUTOMATIC)
+        gallery_scroll.add(self.gallery_view)
+        gallery_scroll.set_vexpand(True)
+        gallery_scroll.set_hexpand(True)
+
+        self.view_stack = Gtk.Stack()
+        self.view_stack.add_named(library_scroll, 'list')
+        self.view_stack.add_named(gallery_scroll, 'gallery')
+
         filter_scroll = Gtk.ScrolledWindow()
         filter_scroll.set_policy(Gtk.PolicyType.AUTOMATIC,
                                  Gtk.PolicyType.AUTOMATIC)
@@ -113,15 +138,48 @@ class LibraryPaned(Gtk.Paned):
         filter_vbox.add(filter_scroll)
 
         self.pack1(filter_vbox, True, False)
-        self.pack2(library_scroll, True, False)
+        self.pack2(self.view_stack, True, False)
+
+    def get_gallery_shown(self):
+        return self.view_stack.get_visible_child_name() == 'gallery'
+
+    def show_gallery(self, show):
+        '''This method switches between the library view and the gallery,
+        carrying the selection over from one to the other.
+
+        '''
+        if show == self.get_gallery_shown():
+            return
+        if show:
+            selection = self.library_view.get_selection()
+            (model, paths) = selection.get_selected_rows()
+            self.gallery_view.unselect_all()
+            for path in paths:
+                self.gallery_view.select_path(path)
+            self.view_stack.set_visible_child_name('gallery')
+            if paths:
+                self.gallery_view.scroll_to_path(paths[0], False, 0, 0)
+        else:
+            paths = self.gallery_view.get_selected_items()
+            selection = self.library_view.get_selection()
+            selection.unselect_all()
+            for path in paths:
+                selection.select_path(path)
+            self.view_stack.set_visible_child_name('list')
+            if paths:
+                self.library_view.scroll_to_cell(paths[0], None, False, 0, 0)
 
     def get_selected_rows(self):
         '''This method returns a list of iters pointing to the currently
         selected rows of the potentially filtered library view.
 
         '''
-        selection = self.library_view.get_selection()
-        (model, rows) = selection.get_selected_rows()
+        if self.get_gallery_shown():
+            model = self.gallery_view.get_model()
+            rows = self.gallery_view.get_selected_items()
+        else:
+            selection = self.library_view.get_selection()
+            (model, rows) = selection.get_selected_rows()
         row_iters = []
         for row in rows:
             row_iters.append(self.get_filter_iter(row, model))
@@ -150,12 +208,7 @@ class LibraryPaned(Gtk.Paned):
         sortable_filter_iter = sorted_model.get_iter(path)
         filter_iter = sorted_model.convert_iter_to_child_iter(
             sortable_filter_iter)
-        filter_model = self.filter_view.filter_model
-        if filter_model is None:
-            return filter_iter
-        filter_selection = self.filter_view.get_selection()
-        if filter_selection.count_selected_rows() == 0:
-            return filter_iter
+        filter_model = self.filter_view.library_filter_model
         return filter_model.convert_iter_to_child_iter(filter_iter)
 
     def on_col_menu_toggled(self, col_menu_item):
@@ -204,7 +257,7 @@ class LibraryPaned(Gtk.Paned):
                                         self.on_list_context_refresh, row_iters)
             list_context_menu.append(context_menu_refresh)
             context_menu_refresh.show()
-            list_context_menu.attach_to_widget(self.library_view, None)
+            list_context_menu.attach_to_widget(widget, None)
             list_context_menu.popup(None, None, None, None, event.button,
                                     event.time)
 
@@ -217,20 +270,38 @@ class LibraryPaned(Gtk.Paned):
             self.library.toggle_story_played(row_iter)
 
     def on_list_context_refresh(self, menuitem, row_iters):
-        '''This method handles clicks on the "Toggle played" context menu
-        entry, which marks stories as played or not.
+        '''This method handles clicks on the "Refresh IFDB annotation" context
+        menu entry.  The data is fetched in the background, at the pace
+        allowed by the IFDB request limit, and each story is updated as its
+        data arrives.
 
         '''
-        limit = self.settings.get_ifdb_limit()
-        delay = 60/limit
+        client = ifdb.get_client()
         for row_iter in row_iters:
-            self.library.refresh_ifdb(row_iter)
-            time.sleep(delay)
-        if len(row_iters) > 0:
+            story_id = self.library.get_story_id(row_iter)
+            tuid = self.library.get_ifdb_tuid(story_id)
+            if not tuid:
+                continue
+            self.ifdb_refreshes += 1
+            client.submit(ifdb.fetch_ifiction, kwargs={"tuid": tuid},
+                          callback=functools.partial(self._on_ifdb_fetched,
+                                                     story_id))
+
+    def _on_ifdb_fetched(self, story_id, request):
+        # This is called from one of the IFDB client's threads.
+        GObject.idle_add(self._on_ifdb_refreshed, story_id, request)
+
+    def _on_ifdb_refreshed(self, story_id, request):
+        self.ifdb_refreshes -= 1
+        if request.error is None:
+            self.library.update_ifdb_annotation(story_id, request.result)
+            self.library.queue_filter_update(changed=[story_id])
+        if self.ifdb_refreshes == 0:
             filter_select = self.filter_view.get_selection()
             (model, sel) = filter_select.get_selected_rows()
-            self.library.update_filter_stores()
+            self.library.flush_filter_updates()
             filter_select.select_path(sel)
+        return False
 
     def on_selection_changed(self, selection):
         '''This method handles the library view's selection changing by passing
@@ -239,6 +310,13 @@ class LibraryPaned(Gtk.Paned):
         '''
         self.emit('selection-changed')
 
+    def on_gallery_selection_changed(self, gallery_view):
+        '''This method handles the gallery's selection changing by passing it
+        up to the main window.
+
+        '''
+        self.emit('selection-changed')
+
     def on_filter_selection_changed(self, selection):
         '''This method handles the filter selection changing (ie the text by
         which to filter the library).
@@ -255,9 +333,8 @@ class LibraryPaned(Gtk.Paned):
         filter_text = model.get_value(row, 0)
         filter_id = model.get_value(row, 1)
         filter_col = self.library_view.get_col_number(filter_type)
-        filter_model = self.filter_view.filter_library(
-            filter_type, filter_text, filter_id, filter_col)
-        self.library_view.set_model(filter_model)
+        self.filter_view.filter_library(filter_type, filter_text, filter_id,
+                                        filter_col)
 
     def on_filter_combo_changed(self, combo):
         '''This method handles the combo box containing the filter types
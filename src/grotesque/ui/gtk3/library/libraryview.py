@@ -37,6 +37,7 @@ class LibraryView(Gtk.TreeView):
         self.library = library
         filter_model = self.library.list_store.filter_new(None)
         super(LibraryView, self).__init__(model=filter_model)
+        self.library.views.append(self)
         self.set_rules_hint(True)
         self.set_headers_clickable(True)
         # When the user types on the view, it searches by column 1, which will
@@ -80,7 +81,7 @@ class LibraryView(Gtk.TreeView):
             col_renderer = Gtk.CellRendererText()
             col = Gtk.TreeViewColumn(name, col_renderer, text=index,
                                      weight=self.weight_col)
-            col.set_sort_column_id(index)
+            col.set_sort_column_id(self.library.sort_column(index))
             col.set_resizable(True)
             col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         col.set_reorderable(True)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+#       sortkeys.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import bisect
+import itertools
+import locale
+
+
+# Keys are handed out this far apart, so that values which turn up later
+# can be fitted in between without renumbering the others.
+SPACING = 1 << 32
+LIMIT = 1 << 62
+
+
+def collation_key(value):
+    if value is None:
+        value = ""
+    elif isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return locale.strxfrm(value)
+
+
+class SortKeys():
+    '''This class hands out an integer sort key for each value of a column,
+    such that the keys compare like the values do under the locale's
+    collation.  The values' locale.strxfrm() keys are only computed once,
+    so the column can then be sorted natively by its integer keys rather
+    than with a Python comparison function.
+
+    Now and then there is no room left between two keys for a new value,
+    and every value is numbered afresh.  When that happens, renumbered is
+    set, and the keys which have already been handed out must be looked
+    up again.
+
+    '''
+    def __init__(self):
+        self.xfrm_of = {}
+        self.key_of = {}
+        # The distinct strxfrm() keys, in order.
+        self.xfrms = []
+        self.renumbered = False
+
+    def _xfrm(self, value):
+        xfrm = self.xfrm_of.get(value)
+        if xfrm is None:
+            xfrm = collation_key(value)
+            self.xfrm_of[value] = xfrm
+        return xfrm
+
+    def key(self, value):
+        xfrm = self._xfrm(value)
+        key = self.key_of.get(xfrm)
+        if key is None:
+            key = self._insert(xfrm)
+        return key
+
+    def add_values(self, values):
+        '''Number many new values at once, rather than fitting them in one
+        at a time.  The new values which fall between the same two known
+        ones are spread out evenly between them, and the values are only
+        numbered afresh if there is not room enough.
+
+        '''
+        new_xfrms = set()
+        for value in values:
+            xfrm = self._xfrm(value)
+            if xfrm not in self.key_of:
+                new_xfrms.add(xfrm)
+        if not new_xfrms:
+            return
+        if not self.xfrms:
+            self._renumber(new_xfrms)
+            return
+        new_keys = []
+        for n, gap_xfrms in itertools.groupby(
+                sorted(new_xfrms),
+                lambda xfrm: bisect.bisect_left(self.xfrms, xfrm)):
+            gap_xfrms = list(gap_xfrms)
+            count = len(gap_xfrms)
+            if n > 0:
+                low = self.key_of[self.xfrms[n - 1]]
+            else:
+                low = 0
+            if n < len(self.xfrms):
+                high = self.key_of[self.xfrms[n]]
+            else:
+                high = LIMIT
+            step = (high - low) // (count + 1)
+            if n == 0 or n == len(self.xfrms):
+                step = min(step, SPACING)
+            if step < 1:
+                self._renumber(new_xfrms)
+                return
+            if n == 0:
+                # Keep the room at the start, as _insert() does.
+                first = high - step * count
+            else:
+                first = low + step
+            new_keys.extend((xfrm, first + step * m)
+                            for m, xfrm in enumerate(gap_xfrms))
+        for xfrm, key in new_keys:
+            self.key_of[xfrm] = key
+        self.xfrms = sorted(self.xfrms + [xfrm for xfrm, key in new_keys])
+
+    def _insert(self, xfrm):
+        n = bisect.bisect_left(self.xfrms, xfrm)
+        if n > 0:
+            low = self.key_of[self.xfrms[n - 1]]
+        else:
+            low = 0
+        if n < len(self.xfrms):
+            high = self.key_of[self.xfrms[n]]
+        else:
+            high = LIMIT
+        if high - low < 2:
+            self._renumber([xfrm])
+            return self.key_of[xfrm]
+        # Values tend to be added at either end, so keep as much room as
+        # possible there.
+        if n == len(self.xfrms):
+            key = min(low + SPACING, (low + high) // 2)
+        elif n == 0:
+            key = max(high - SPACING, (low + high) // 2)
+        else:
+            key = (low + high) // 2
+        self.xfrms.insert(n, xfrm)
+        self.key_of[xfrm] = key
+        return key
+
+    def _renumber(self, new_xfrms):
+        # Only keys which have been handed out need looking up again.
+        if self.key_of:
+            self.renumbered = True
+        self.xfrms = sorted(set(self.xfrms).union(new_xfrms))
+        self.key_of = dict((xfrm, (n + 1) * SPACING)
+                           for n, xfrm in enumerate(self.xfrms))
@@ -22,6 +22,7 @@
 
 
 import os.path
+import warnings
 
 import gi
 from gi.repository import Gtk, Gdk, GObject
@@ -34,10 +35,15 @@ from info.infopaned import InfoPaned
 from threads.storyimportthread import StoryImportThread
 from threads.ifictionimportthread import IfictionImportThread
 from threads.storyremovethread import StoryRemoveThread
-from grotesque import db, util
+from threads.folderwatcher import FolderWatcher
+from threads.thumbnailthread import ThumbnailThread
+from grotesque import db, util, ifdb
 
 
 GROTESQUE_VERSION = "0.10"
+# How long, in seconds, to wait for each background job to finish once the
+# window has been closed.
+JOB_JOIN_TIMEOUT = 5
 
 
 class MainWindow(Gtk.Window):
@@ -48,9 +54,17 @@ class MainWindow(Gtk.Window):
     info_width = 280
 
 
-    def __init__(self, conn, settings):
+    def __init__(self, db_manager, settings):
         super(MainWindow, self).__init__(type=Gtk.WindowType.TOPLEVEL)
-        self.conn = conn
+        self.db_manager = db_manager
+        self.conn = db_manager.writer
+        # The background jobs which have been started, so that they can be
+        # waited on before the library is closed.
+        self.jobs = []
+        # The job making the covers' missing thumbnails, and whether it
+        # must be run again once it has finished.
+        self.thumbnail_thread = None
+        self.thumbnails_outdated = False
         # init_complete is used to block certain callbacks from happening while
         # the window is still being constructed.
         self.init_complete = False
@@ -60,13 +74,20 @@ class MainWindow(Gtk.Window):
                          'grotesque_icon.png'))
         self.connect('delete_event', self.on_close)
         self.settings = settings
+        ifdb.set_request_limit(settings.get_ifdb_limit())
+        ifdb.open_cache(settings.get_ifdb_cache_filename(),
+                        settings.get_ifdb_cache_size() * 1024 * 1024)
+        ifdb.set_offline(settings.get_ifdb_offline())
+        if os.path.exists(settings.get_ifdb_mirror_filename()):
+            ifdb.open_mirror(settings.get_ifdb_mirror_filename())
         dimensions = settings.get_window_size()
         self.set_default_size(dimensions[0], dimensions[1])
         self.connect('key_press_event', self.on_key_pressed)
 
         # Create the library and its display widgets.
         self.library = Library(self.conn)
-        self.library_paned = LibraryPaned(self.library, self.settings)
+        self.library_paned = LibraryPaned(self.library, self.settings,
+                                          self.db_manager)
         self.library_paned.connect('selection-changed',
                                    self.on_library_selection_changed)
         self.library_paned.connect('double-clicked',
@@ -116,8 +137,17 @@ class MainWindow(Gtk.Window):
         self.add(self.vpaned)
 
         self.show_all()
+        self.library_paned.show_gallery(self.settings.get_gallery_shown())
         self.init_complete = True
 
+        # Bring the library up to date with the library folders and keep
+        # watching them.
+        self.folder_watcher = FolderWatcher(self.settings, self.library,
+                                            self.db_manager,
+                                            self.update_thumbnails)
+        self.folder_watcher.start(self.settings.get_library_dirs())
+        self.update_thumbnails()
+
     def create_toolbar(self):
         '''This method creates the main toolbar.
 
@@ -152,6 +182,10 @@ class MainWindow(Gtk.Window):
             "Configure Grotesque")
         button_about = Gtk.ToolButton(icon_name="help-about")
         button_about.set_tooltip_text("About Grotesque")
+        self.button_gallery = Gtk.ToggleToolButton(icon_name="view-grid")
+        self.button_gallery.set_tooltip_text(
+            "Show the library as a gallery of cover art")
+        self.button_gallery.set_active(self.settings.get_gallery_shown())
 
         toolbar.add(self.button_play)
         toolbar.add(separator1)
@@ -162,6 +196,7 @@ class MainWindow(Gtk.Window):
         toolbar.add(button_add)
         toolbar.add(self.button_remove)
         toolbar.add(self.button_edit)
+        toolbar.add(self.button_gallery)
         toolbar.add(separator3)
         toolbar.add(button_preferences)
         toolbar.add(button_about)
@@ -174,6 +209,7 @@ class MainWindow(Gtk.Window):
         self.button_edit.connect_object('clicked', self.on_edit, self)
         button_about.connect_object('clicked', self.on_about, self)
         button_preferences.connect_object('clicked', self.on_preferences, self)
+        self.button_gallery.connect('toggled', self.on_gallery_toggled)
 
         self.button_play.set_sensitive(False)
         self.button_remove.set_sensitive(False)
@@ -201,6 +237,35 @@ class MainWindow(Gtk.Window):
             return
         self.library.mark_story_played(selected_story[1])
 
+    def start_job(self, job):
+        '''This method starts a background job, keeping track of it until
+        the window is closed.
+
+        '''
+        self.jobs = [old_job for old_job in self.jobs if old_job.running]
+        self.jobs.append(job)
+        job.start()
+
+    def update_thumbnails(self):
+        '''This method starts making the thumbnails which covers are
+        missing, such as those of covers which have just been stored.  If
+        that is already under way, it is done again afterwards.
+
+        '''
+        if not db.thumbnails.can_make_thumbnails():
+            return
+        if self.thumbnail_thread is not None and self.thumbnail_thread.running:
+            self.thumbnails_outdated = True
+            return
+        self.thumbnails_outdated = False
+        self.thumbnail_thread = ThumbnailThread(self.db_manager,
+                                                self.on_thumbnails_updated)
+        self.start_job(self.thumbnail_thread)
+
+    def on_thumbnails_updated(self):
+        if self.thumbnails_outdated and not self.thumbnail_thread.stopped:
+            self.update_thumbnails()
+
     def remove_selection(self):
         '''This method grabs the currently selected stories and creates a
         thread to handle removing them from the library.
@@ -210,26 +275,56 @@ class MainWindow(Gtk.Window):
         if len(row_iters) > 0:
             remove_dialog = ProgressDialog("Removing...", self, False)
             remove_thread = StoryRemoveThread(self.library, row_iters,
-                                              self.conn, remove_dialog)
-            removing = remove_thread.remove_stories()
-            GObject.idle_add(removing.next)
+                                              self.db_manager, remove_dialog)
+            self.start_job(remove_thread)
             remove_dialog.run()
             remove_dialog.destroy()
         self.library_paned.filter_view.select_all()
         self.info_paned.clear()
 
+    def do_scan_dir_dialog(self, directory):
+        '''This method looks for story files below a directory on a worker
+        thread while showing a progress dialog.  It returns the files and
+        directories found, or None if the user cancelled the scan.
+
+        '''
+        scan_dialog = ProgressDialog("Scanning...", self)
+        scan_dialog.info_label.set_text(directory)
+        scan = {'results': None, 'cancelled': False}
+
+        def on_scanned(files, scanned_dirs):
+            if scan['cancelled']:
+                return
+            scan['results'] = (files, scanned_dirs)
+            scan_dialog.response(Gtk.ResponseType.ACCEPT)
+
+        def pulse():
+            scan_dialog.progressbar.pulse()
+            return True
+
+        pulse_id = GObject.timeout_add(100, pulse)
+        self.folder_watcher.scan([directory], on_scanned)
+        scan_response = scan_dialog.run()
+        GObject.source_remove(pulse_id)
+        scan_dialog.destroy()
+        if scan_response != Gtk.ResponseType.ACCEPT:
+            scan['cancelled'] = True
+            return None
+        return scan['results']
+
     def do_import_story_dialog(self, filepaths):
         '''This method launches a thread which handles the actual importing of
         story files. If any files failed to be imported properly, the user has
-        the option of manually editing their metadata.
+        the option of manually editing their metadata.  It returns False if
+        the user cancelled the import.
 
         '''
         import_dialog = ProgressDialog("Importing...", self)
         import_thread = StoryImportThread(filepaths, self.settings,
                                           self.library, import_dialog,
-                                          self.conn)
-        importing = import_thread.import_stories()
-        GObject.idle_add(importing.next)
+                                          self.db_manager,
+                                          self.update_thumbnails)
+        self.start_job(import_thread)
         import_response = import_dialog.run()
         import_dialog.destroy()
         if (import_response == Gtk.ResponseType.REJECT or
@@ -264,22 +359,30 @@ class MainWindow(Gtk.Window):
                             if row_iter:
                                 self.library.list_store.remove(row_iter)
                             if edit_dialog.merged:
+                                self.library.queue_filter_update(
+                                    removed=[story_id],
+                                    changed=[edit_dialog.story_id])
                                 story_id = edit_dialog.story_id
                             else:
                                 self.library.add_story_from_db_rec(
                                     db.query.select_story(self.conn, story_id))
                                 filter_select = self.library_paned.filter_view.get_selection()
                                 (model, sel) = filter_select.get_selected_rows()
-                                self.library.update_filter_stores()
+                                self.library.queue_filter_update(
+                                    changed=[story_id])
+                                self.library.flush_filter_updates()
                                 if sel:
                                     filter_select.select_path(sel)
                                 else:
                                     self.library_paned.filter_view.select_all()
                         elif response == Gtk.ResponseType.REJECT:
                             db.remove_story(self.conn, story_id)
+                            self.library.queue_filter_update(
+                                removed=[story_id])
                             if row_iter is not None:
                                 self.library.list_store.remove(row_iter)
                     edit_dialog.destroy()
+                    self.update_thumbnails()
             # If any errors were encountered during import, display them here.
             if len(import_thread.msg) > 0:
                 d = Gtk.MessageDialog(self, Gtk.DialogFlags.MODAL,
@@ -295,6 +398,8 @@ class MainWindow(Gtk.Window):
                     db.query.select_story(self.conn, selected_stories[0][0])):
                 self.info_paned.show_story(selected_stories[0][0])
         self.library_paned.filter_view.select_all()
+        return (import_response != Gtk.ResponseType.REJECT and
+                import_response != Gtk.ResponseType.DELETE_EVENT)
 
     def do_import_ifiction_dialog(self, ifiction_file):
         '''This method launches a thread which handles the actual importing of
@@ -302,11 +407,10 @@ class MainWindow(Gtk.Window):
 
         '''
         import_dialog = ProgressDialog("Importing...", self)
-        import_thread = IfictionImportThread(
-            ifiction_file, self.settings, self.library, import_dialog,
-            self.conn)
         try:
-            importing = import_thread.import_ifiction()
+            import_thread = IfictionImportThread(
+                ifiction_file, self.settings, self.library, import_dialog,
+                self.db_manager)
         except IOError:
             d = Gtk.MessageDialog(self, Gtk.DialogFlags.MODAL,
                                   Gtk.MessageType.ERROR,
@@ -317,7 +421,7 @@ class MainWindow(Gtk.Window):
             d.destroy()
             import_dialog.destroy()
             return
-        GObject.idle_add(importing.next)
+        self.start_job(import_thread)
         import_response = import_dialog.run()
         import_dialog.destroy()
         if (import_response == Gtk.ResponseType.REJECT or
@@ -329,6 +433,7 @@ class MainWindow(Gtk.Window):
                     db.query.select_story(self.conn, selected_stories[0][0])):
                 self.info_paned.show_story(selected_stories[0][0])
         self.library_paned.filter_view.select_all()
+        self.update_thumbnails()
 
     def on_vpaned_notify(self, vpaned, gparamspec):
         '''This method catches notify signals from the vpaned widget which
@@ -355,7 +460,8 @@ class MainWindow(Gtk.Window):
                     self.info_paned.text_view.biblio_view.set_right_margin(20)
                 selected_story = self.library_paned.get_selected_stories()
                 if len(selected_story) > 0:
-                    self.info_paned.refresh_coverart(selected_story[0][0])
+                    self.info_paned.refresh_coverart(selected_story[0][0],
+                                                     resizing=True)
                 self.info_paned_block = False
 
     def on_infopaned_notify(self, hpaned, gparamspec):
@@ -383,7 +489,8 @@ class MainWindow(Gtk.Window):
                     self.info_paned.text_view.biblio_view.set_right_margin(20)
                 selected_story = self.library_paned.get_selected_stories()
                 if len(selected_story) > 0:
-                    self.info_paned.refresh_coverart(selected_story[0][0])
+                    self.info_paned.refresh_coverart(selected_story[0][0],
+                                                     resizing=True)
                 self.vpaned_block = False
 
     def on_key_pressed(self, widget, event):
@@ -492,12 +599,6 @@ class MainWindow(Gtk.Window):
         recursive import) being clicked.
 
         '''
-        # Create a list of extensions to handle.
-        exts = []
-        all_exts = self.settings.get_all_exts()
-        for if_format, format_exts in all_exts:
-            exts.extend(format_exts.split(','))
-        exts_set = set(exts)
         # Create and lanch the file chooser.
         file_chooser = Gtk.FileChooserDialog(
             "Select a directory to add", self,
@@ -509,23 +610,27 @@ class MainWindow(Gtk.Window):
         response = file_chooser.run()
         file_chooser.hide()
         if response == Gtk.ResponseType.ACCEPT:
-            filepaths = []
             self.settings.set_game_dir(file_chooser.get_current_folder())
-            self.settings.save()
             directory = file_chooser.get_filename()
-            for dirpath, dirnames, filenames in os.walk(directory):
-                # For all the files found, if they have the correct extension,
-                # add them for import.
-                if len(filenames) > 0:
-                    for filename in filenames:
-                        extension = os.path.splitext(filename)[1]
-                        if extension.lower() in exts_set:
-                            filepath = os.path.join(dirpath, filename)
-                            filepaths.append(filepath)
-            if len(filepaths) > 0:
-                # Assuming files were found, run the import dialog.
-                self.do_import_story_dialog(filepaths)
-        file_chooser.destroy()
+            file_chooser.destroy()
+            scan_results = self.do_scan_dir_dialog(directory)
+            if scan_results is None:
+                return
+            files, scanned_dirs = scan_results
+            filepaths = db.sync.find_new_files(self.conn, files)
+            # Assuming files were found, run the import dialog.  Nothing is
+            # kept if the user cancels either the scan or the import.
+            if (len(filepaths) > 0 and
+                    not self.do_import_story_dialog(filepaths)):
+                return
+            # The directory becomes a library folder, which is kept in sync
+            # from now on.
+            self.settings.add_library_dir(directory)
+            self.settings.save()
+            self.folder_watcher.add_scanned_dir(directory, files,
+                                                scanned_dirs)
+        else:
+            file_chooser.destroy()
 
     def on_edit(self, widget):
         '''This method handles the edit button being clicked.
@@ -547,19 +652,30 @@ class MainWindow(Gtk.Window):
             if response == Gtk.ResponseType.ACCEPT:
                 if edit_dialog.merged:
                     self.library.list_store.remove(row_iter)
+                    self.library.queue_filter_update(
+                        removed=[story_id], changed=[edit_dialog.story_id])
                     story_id = edit_dialog.story_id
                 if edit_dialog.edited:
                     self.library.add_story_from_db_rec(
                         db.query.select_story(self.conn, story_id), row_iter)
                     filter_select = self.library_paned.filter_view.get_selection()
                     (model, sel) = filter_select.get_selected_rows()
-                    self.library.update_filter_stores()
+                    self.library.queue_filter_update(changed=[story_id])
+                    self.library.flush_filter_updates()
                     filter_select.select_path(sel)
         edit_dialog.destroy()
+        self.update_thumbnails()
         if (selected_stories and
                 db.query.select_story(self.conn, selected_stories[0][0])):
             self.info_paned.show_story(selected_stories[0][0])
 
+    def on_gallery_toggled(self, widget):
+        '''This method handles the gallery toolbar button being toggled,
+        switching between the library list and the gallery of cover art.
+
+        '''
+        self.library_paned.show_gallery(widget.get_active())
+
     def on_preferences(self, widget):
         '''This method handles clicks on the preferences button.
 
@@ -628,6 +744,7 @@ class MainWindow(Gtk.Window):
         self.settings.set_vpaned_percentage(vpaned_percentage)
         self.settings.set_filter_percentage(library_percentage)
         self.settings.set_filter_type(filter_type)
+        self.settings.set_gallery_shown(self.library_paned.get_gallery_shown())
         for col in self.library_paned.library_view.get_columns():
             width = col.get_width()
             title = col.get_title()
@@ -635,5 +752,15 @@ class MainWindow(Gtk.Window):
             visible = col.get_visible()
             self.settings.set_column_visible(title, visible)
         self.settings.save()
+        self.folder_watcher.stop()
+        self.library_paned.gallery_view.stop()
+        for job in self.jobs:
+            job.stop()
+        # Whatever the jobs are writing is finished before the library is
+        # closed.
+        for job in self.jobs + [self.folder_watcher,
+                                self.library_paned.gallery_view]:
+            if not job.join(JOB_JOIN_TIMEOUT):
+                warnings.warn("a background job did not finish in time")
         Gtk.main_quit()
         return False
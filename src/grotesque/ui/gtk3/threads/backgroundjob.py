@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+#       backgroundjob.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+import traceback
+import warnings
+import Queue
+
+from gi.repository import GObject
+
+
+# How often, in milliseconds, the main loop picks up what the worker has
+# sent it, and for how long, in seconds, it may spend doing so each time.
+DRAIN_INTERVAL = 50
+DRAIN_TIME = 0.02
+
+
+class BackgroundJob():
+    '''This class runs a long job, such as an import, on a worker thread so
+    that the main loop is free to redraw the window.  Subclasses implement
+    work(), which is run on the worker thread.  Widgets may only be
+    touched from the main loop, so work() hands anything which concerns
+    them to post(), and the callbacks are then run on the main loop in
+    the order they were posted.  Once work() has returned and everything
+    it posted has been run, finished() is called on the main loop.
+
+    work() should check self.stopped regularly so that the job can be
+    cancelled promptly with stop().
+
+    '''
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = None
+        self.drain_source = None
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    @property
+    def running(self):
+        '''Whether the job has been started and has not yet finished.'''
+        return self.drain_source is not None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.drain_source = GObject.timeout_add(DRAIN_INTERVAL, self._drain)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        '''Wait for the worker thread to end, for at most timeout seconds.
+        Returns whether it has ended.
+
+        '''
+        if self.thread is not None:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
+
+    def post(self, callback, *args):
+        '''Have callback(*args) run on the main loop.  This may be called
+        from any thread.
+
+        '''
+        self.queue.put((callback, args))
+
+    def work(self):
+        raise NotImplementedError
+
+    def finished(self):
+        pass
+
+    def _run(self):
+        try:
+            self.work()
+        except Exception:
+            self.error = traceback.format_exc()
+            warnings.warn(self.error)
+        finally:
+            self.queue.put(None)
+
+    def _drain(self):
+        deadline = time.time() + DRAIN_TIME
+        while time.time() < deadline:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                return True
+            if item is None:
+                self.drain_source = None
+                self.finished()
+                return False
+            callback, args = item
+            callback(*args)
+        return True
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+#       coverloader.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import traceback
+import warnings
+
+from gi.repository import GdkPixbuf, GLib, GObject
+
+from grotesque import db
+
+
+# The number of covers which are read from the library at once.
+LOAD_BATCH_SIZE = 16
+
+
+class CoverLoader():
+    '''This class decodes stories' cover art on a worker thread, scaled
+    down to fit a square of a given size.  The stories whose covers are
+    wanted are given to request() in the order in which they should be
+    loaded.  Each request replaces whatever is still waiting from the
+    last one, so the worker never falls behind on covers which have
+    since been scrolled out of sight.  The loaded covers are handed to
+    callback(covers) on the main loop as a list of (story_id, pixbuf)
+    pairs; the pixbuf is None for stories with no cover to show.
+
+    '''
+    def __init__(self, db_manager, size, callback):
+        self.db_manager = db_manager
+        self.size = size
+        self.callback = callback
+        # The smallest thumbnail which is at least the size will do.
+        self.thumb_size = None
+        for thumb_size in db.thumbnails.THUMBNAIL_SIZES:
+            if thumb_size >= size:
+                self.thumb_size = thumb_size
+                break
+        self.condition = threading.Condition()
+        self.wanted = []
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, story_ids):
+        with self.condition:
+            self.wanted = list(story_ids)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.wanted = []
+            self.condition.notify()
+
+    def join(self, timeout=None):
+        '''Wait for the worker to end once stopped, for at most timeout
+        seconds.  Returns whether it has ended.
+
+        '''
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.wanted and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return None
+            batch = self.wanted[:LOAD_BATCH_SIZE]
+            del self.wanted[:LOAD_BATCH_SIZE]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            covers = []
+            try:
+                with self.db_manager.reader() as conn:
+                    images = self._read_images(conn, batch)
+                for story_id in batch:
+                    pixbuf = None
+                    if story_id in images:
+                        pixbuf = self._decode(*images[story_id])
+                    covers.append((story_id, pixbuf))
+            except Exception:
+                # The covers will be asked for again when they are next
+                # scrolled into sight.
+                warnings.warn(traceback.format_exc())
+                continue
+            GObject.idle_add(self._deliver, covers)
+
+    def _read_images(self, conn, story_ids):
+        '''Return the data and format of the image from which each story's
+        cover is to be loaded, by story ID.
+
+        '''
+        images = {}
+        if self.thumb_size is not None:
+            for row in db.query.select_story_thumbnails(conn, story_ids,
+                                                        self.thumb_size):
+                images[row["story_id"]] = (row["data"], row["format"])
+        for story_id in story_ids:
+            if story_id in images:
+                continue
+            # Covers which are too small to have a thumbnail of the size
+            # are loaded from the original.
+            cover_row = db.query.select_cover_by_story(conn, story_id)
+            if (cover_row is None or
+                    cover_row["format"] not in ["jpeg", "png", "gif"]):
+                continue
+            data = db.coverstore.read_cover(conn, cover_row)
+            if data:
+                images[story_id] = (data, cover_row["format"])
+        return images
+
+    def _decode(self, data, img_format):
+        pixbuf_loader = GdkPixbuf.PixbufLoader.new_with_type(img_format)
+        # Big images are scaled down as they are decoded, which for JPEG
+        # is much quicker than decoding them whole.
+        pixbuf_loader.connect("size-prepared", self._on_size_prepared)
+        try:
+            pixbuf_loader.write(data)
+            pixbuf_loader.close()
+        except GLib.GError as e:
+            warnings.warn("could not decode the cover: {0}".format(e))
+            return None
+        return pixbuf_loader.get_pixbuf()
+
+    def _on_size_prepared(self, pixbuf_loader, width, height):
+        if width <= self.size and height <= self.size:
+            return
+        scale = float(self.size) / max(width, height)
+        pixbuf_loader.set_size(max(1, int(round(width * scale))),
+                               max(1, int(round(height * scale))))
+
+    def _deliver(self, covers):
+        if not self.stopped:
+            self.callback(covers)
+        return False
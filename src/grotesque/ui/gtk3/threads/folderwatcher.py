@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+#       folderwatcher.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import functools
+import os
+import threading
+
+from gi.repository import Gio, GLib, GObject
+
+from grotesque import db
+from storyimportthread import StoryImportThread
+
+
+# How long to wait, in milliseconds, for a burst of file system events to
+# die down before importing the files that they concern.
+IMPORT_DELAY = 2000
+# Deleted files are flagged as missing together once the events about
+# them have stopped coming for this many milliseconds.
+DELETE_DELAY = 250
+
+
+class FolderWatcher():
+    '''This class keeps the library in sync with the library folders. The
+    folders are first scanned in a background thread, after which any new
+    story files are imported and the releases whose files have gone are
+    flagged as missing.  From then on the folders are watched so that
+    files which are added, moved or deleted are dealt with as it happens.
+
+    '''
+    def __init__(self, settings, library, db_manager, imported_callback=None):
+        self.settings = settings
+        self.library = library
+        self.db_manager = db_manager
+        self.conn = db_manager.writer
+        # Called on the main loop once new files have been imported.
+        self.imported_callback = imported_callback
+        self.exts = set()
+        self.monitors = {}
+        self.pending = set()
+        self.import_source = None
+        self.import_job = None
+        self.deleted = set()
+        self.delete_source = None
+
+    def start(self, library_dirs):
+        self.exts = db.sync.get_story_exts(self.settings)
+        self._scan(library_dirs, True)
+
+    def add_scanned_dir(self, library_dir, files, scanned_dirs):
+        '''Start keeping a new library folder in sync, given what scan() found
+        in it.  Its new story files are not imported; that is left to the
+        caller.
+
+        '''
+        for scanned_dir in scanned_dirs:
+            self._watch_dir(scanned_dir)
+        db.sync.flag_missing_releases(self.conn, [library_dir], files)
+
+    def stop(self):
+        for monitor in self.monitors.values():
+            monitor.cancel()
+        self.monitors = {}
+        if self.import_source is not None:
+            GObject.source_remove(self.import_source)
+            self.import_source = None
+        if self.delete_source is not None:
+            GObject.source_remove(self.delete_source)
+            self._on_delete_timeout()
+        if self.import_job is not None:
+            self.import_job.stop()
+
+    def join(self, timeout=None):
+        '''Wait for the import in progress, if any, to end, for at most
+        timeout seconds.  Returns whether it has ended.
+
+        '''
+        if self.import_job is not None:
+            return self.import_job.join(timeout)
+        return True
+
+    def scan(self, dirs, callback):
+        '''Look for story files below the directories on a worker thread.
+        Then callback(files, scanned_dirs) is run on the main loop.
+
+        '''
+        thread = threading.Thread(target=self._scan_thread,
+                                  args=(dirs, callback))
+        thread.daemon = True
+        thread.start()
+
+    def _scan(self, dirs, flag_missing):
+        self.scan(dirs, functools.partial(self._on_scanned, dirs,
+                                          flag_missing))
+
+    def _scan_thread(self, dirs, callback):
+        files, scanned_dirs = db.sync.scan_dirs(dirs, self.exts)
+        GObject.idle_add(self._run_callback, callback, files, scanned_dirs)
+
+    def _run_callback(self, callback, *args):
+        callback(*args)
+        return False
+
+    def _on_scanned(self, dirs, flag_missing, files, scanned_dirs):
+        for scanned_dir in scanned_dirs:
+            self._watch_dir(scanned_dir)
+        if flag_missing:
+            db.sync.flag_missing_releases(self.conn, dirs, files)
+        new_files = db.sync.find_new_files(self.conn, files)
+        if new_files:
+            self.pending.update(new_files)
+            self._schedule_import()
+
+    def _watch_dir(self, path):
+        if path in self.monitors:
+            return
+        try:
+            monitor = Gio.File.new_for_path(path).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.GError:
+            return
+        monitor.connect('changed', self.on_changed)
+        self.monitors[path] = monitor
+
+    def _unwatch_dir(self, path):
+        prefix = os.path.join(path, '')
+        for watched in self.monitors.keys():
+            if watched == path or watched.startswith(prefix):
+                self.monitors.pop(watched).cancel()
+
+    def on_changed(self, monitor, changed_file, other_file, event_type):
+        path = changed_file.get_path()
+        if path is None:
+            return
+        if event_type != Gio.FileMonitorEvent.DELETED:
+            # The file may have come straight back.
+            self.deleted.discard(path)
+        if event_type == Gio.FileMonitorEvent.CREATED:
+            # Files are only imported once they have been written.
+            if os.path.isdir(path):
+                self._scan([path], False)
+        elif event_type in [Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                            Gio.FileMonitorEvent.MOVED_IN]:
+            if os.path.isdir(path):
+                self._scan([path], False)
+            elif db.sync.is_story_file(path, self.exts):
+                self.pending.add(path)
+                self._schedule_import()
+        elif event_type in [Gio.FileMonitorEvent.DELETED,
+                            Gio.FileMonitorEvent.MOVED_OUT]:
+            self.pending.discard(path)
+            self._unwatch_dir(path)
+            self.deleted.add(path)
+            self._schedule_delete()
+        elif event_type == Gio.FileMonitorEvent.RENAMED:
+            new_path = other_file.get_path()
+            self.pending.discard(path)
+            self.deleted.discard(new_path)
+            db.sync.move_files(self.conn, path, new_path)
+            if path in self.monitors:
+                self._unwatch_dir(path)
+                self._scan([new_path], False)
+            elif db.sync.is_story_file(new_path, self.exts):
+                if db.sync.find_new_files(self.conn, [new_path]):
+                    self.pending.add(new_path)
+                    self._schedule_import()
+
+    def _schedule_import(self):
+        # Wait until the events have stopped coming for a moment.
+        if self.import_source is not None:
+            GObject.source_remove(self.import_source)
+        self.import_source = GObject.timeout_add(IMPORT_DELAY,
+                                                 self._on_import_timeout)
+
+    def _schedule_delete(self):
+        if self.delete_source is not None:
+            GObject.source_remove(self.delete_source)
+        self.delete_source = GObject.timeout_add(DELETE_DELAY,
+                                                 self._on_delete_timeout)
+
+    def _on_delete_timeout(self):
+        self.delete_source = None
+        db.sync.flag_deleted_files(self.conn, sorted(self.deleted))
+        self.deleted.clear()
+        return False
+
+    def _on_import_timeout(self):
+        self.import_source = None
+        if self.import_job is not None and self.import_job.running:
+            # Wait for the import in progress to finish.
+            self._schedule_import()
+            return False
+        filenames = sorted(path for path in self.pending
+                           if os.path.isfile(path))
+        self.pending.clear()
+        if not filenames:
+            return False
+        self.import_job = StoryImportThread(filenames, self.settings,
+                                            self.library, None,
+                                            self.db_manager,
+                                            self.imported_callback)
+        self.import_job.start()
+        return False
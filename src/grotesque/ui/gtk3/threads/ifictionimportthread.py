@@ -22,23 +22,24 @@
 #       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import os
 import datetime
 
 from gi.repository import Gtk
 
 from treatyofbabel import ifiction
-from grotesque import db
+from grotesque import db, ifdb
+from backgroundjob import BackgroundJob
 
 
-class IfictionImportThread():
-    '''This class handles importing stories into the library in a threaded
-    manner. This allows a progress bar to be displayed since the process can
+class IfictionImportThread(BackgroundJob):
+    '''This class handles importing stories into the library in a worker
+    thread. This allows a progress bar to be displayed since the process can
     take some time.
 
     '''
     def __init__(self, ifiction_file, settings, library, dialog,
-                 conn):
+                 db_manager):
+        BackgroundJob.__init__(self)
         self.settings = settings
         with open(ifiction_file) as h:
             try:
@@ -50,38 +51,64 @@ class IfictionImportThread():
         self.fetch_coverart = settings.get_fetch_coverart()
         self.library = library
         self.dialog = dialog
-        self.conn = conn
-        self.stopthread = False
+        self.db_manager = db_manager
+        self.conn = db_manager.writer
         self.fails = []
+        self.msg = ''
         self.today = datetime.date.today()
 
-    def stop(self):
-        self.stopthread = True
-
-    def import_ifiction(self):
-        self.msg = ''
+    def work(self):
         count = 0
         for story_node in self.story_nodes:
-            if self.stopthread:
-                yield False
+            if self.stopped:
+                break
+            count = count + 1
             story_biblio = ifiction.get_bibliographic(story_node)
             if story_biblio is None or "title" not in story_biblio:
                 continue
             story_title = story_biblio["title"]
-            yield True
-            self.dialog.info_label.set_text(u'Importing "{0}"'.format(story_title))
+            self.post(self.on_progress, story_title, count)
+            # The cover art is fetched before the story's transaction is
+            # opened.
+            if self.fetch_coverart:
+                ifdb_cover = ifdb.fetch_story_cover(story_node)
+            else:
+                ifdb_cover = None
+            # Each story is committed in a transaction of its own, so
+            # that the main loop never waits long for the connection, and
+            # is only shown once it has been committed.
             story_id, failed = db.import_ifiction(
-                self.conn, self.settings, story_node, self.fetch_coverart)
+                self.conn, self.settings, story_node, ifdb_cover)
             if failed:
                 self.fails.append(story_id)
             if story_id is not None:
-                story_rec = db.query.select_story(self.conn, story_id)
-                self.library.add_story_from_db_rec(story_rec)
-                self.library.update_filter_stores()
-            count = count + 1
-            # Update the progress bar.
-            self.dialog.progressbar.set_fraction(
-                float(count) / float(len(self.story_nodes)))
-            yield True
-        self.dialog.response(Gtk.ResponseType.OK)
-        yield False
+                # The story has been committed, so its row is read here,
+                # rather than on the main loop through the writer, which
+                # may already be in the next transaction.
+                with self.db_manager.reader() as conn:
+                    library_rows = db.query.select_library_rows(conn,
+                                                                [story_id])
+                self.post(self.on_stories_added, library_rows)
+
+    def on_stories_added(self, library_rows):
+        self.library.add_library_rows(library_rows)
+        self.library.queue_filter_update(
+            added=[library_row["id"] for library_row in library_rows])
+
+    def on_progress(self, story_title, count):
+        if self.stopped:
+            return
+        self.dialog.info_label.set_text(
+            u'Importing "{0}"'.format(story_title))
+        # Update the progress bar.
+        self.dialog.progressbar.set_fraction(
+            float(count) / float(len(self.story_nodes)))
+
+    def finished(self):
+        if self.error is not None:
+            self.msg = self.error
+        # The filter stores are brought up to date before the dialog goes,
+        # since the caller resets the filter selection afterwards.
+        self.library.flush_filter_updates()
+        if not self.stopped:
+            self.dialog.response(Gtk.ResponseType.OK)
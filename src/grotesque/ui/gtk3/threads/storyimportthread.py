@@ -24,85 +24,104 @@
 
 import os
 import datetime
-import time
 
 from gi.repository import Gtk
 
-from treatyofbabel import ifiction
-from treatyofbabel.babelerrors import BabelError
 from grotesque import db
+from grotesque.ui.gtk3.library.library import BULK_LOAD_THRESHOLD
+from backgroundjob import BackgroundJob
 
 
-class StoryImportThread():
-    '''This class handles importing stories into the library in a threaded
-    manner. This allows a progress bar to be displayed since the process can
-    take some time.
+class StoryImportThread(BackgroundJob):
+    '''This class handles importing stories into the library in a worker
+    thread. This allows a progress bar to be displayed since the process can
+    take some time.  If dialog is None, the stories are imported without
+    showing any progress.  Once it has finished, callback() is called on
+    the main loop, if given.
 
     '''
     def __init__(self, filenames, settings, library, dialog,
-                 conn):
+                 db_manager, callback=None):
+        BackgroundJob.__init__(self)
         self.settings = settings
         self.filenames = filenames
         self.fetch_metadata = settings.get_fetch_metadata()
         self.fetch_coverart = settings.get_fetch_coverart()
         self.library = library
         self.dialog = dialog
-        self.conn = conn
-        self.stopthread = False
+        self.db_manager = db_manager
+        self.conn = db_manager.writer
+        self.callback = callback
         self.fails = []
+        self.msg = ''
         self.today = datetime.date.today()
-        limit = self.settings.get_ifdb_limit()
-        self.time_per_req = 60/limit
+        self.importer = db.StoryImporter(self.conn, settings,
+                                         self.fetch_metadata,
+                                         self.fetch_coverart)
 
     def stop(self):
-        self.stopthread = True
+        BackgroundJob.stop(self)
+        self.importer.stop()
 
-    def import_stories(self):
-        self.msg = ''
+    def work(self):
         count = 0
-        for filename in self.filenames:
-            start_time = time.time()
-            if self.stopthread:
-                yield False
-            basename = os.path.split(filename)[1]
-            yield True
-            self.dialog.info_label.set_text('Importing {0}'.format(basename))
-            try:
-                story_id, failed = db.add_story_from_file(
-                    self.conn, self.settings, filename, self.fetch_metadata,
-                    self.fetch_coverart)
-            except BabelError:
-                count = count + 1
-                # Update the progress bar.
-                self.dialog.progressbar.set_fraction(
-                    float(count) / float(len(self.filenames)))
-                continue
-            except ValueError:
-                count = count + 1
-                # Update the progress bar.
-                self.dialog.progressbar.set_fraction(
-                    float(count) / float(len(self.filenames)))
-                continue
-            if story_id is None and failed is None:
-                count = count + 1
-                # Update the progress bar.
-                self.dialog.progressbar.set_fraction(
-                    float(count) / float(len(self.filenames)))
+        # The stories which have been committed but not yet shown.
+        added = []
+        # The files are analysed in worker processes and their metadata
+        # fetched by the IFDB client's workers; only the results are
+        # written to the database here.
+        for result in self.importer.import_files(self.filenames):
+            if self.stopped:
+                break
+            if result is None:
+                # The importer is waiting on its workers, so show what has
+                # been imported so far.
+                self._post_added(added)
                 continue
+            filename, story_id, failed = result
+            count = count + 1
             if failed:
                 self.fails.append(story_id)
             if story_id is not None:
-                story_rec = db.query.select_story(self.conn, story_id)
-                self.library.add_story_from_db_rec(story_rec)
-                self.library.update_filter_stores()
-            count = count + 1
-            # Update the progress bar.
-            self.dialog.progressbar.set_fraction(
-                float(count) / float(len(self.filenames)))
-            yield True
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            if elapsed_time < self.time_per_req:
-                 time.sleep(self.time_per_req - elapsed_time)
-        self.dialog.response(Gtk.ResponseType.OK)
-        yield False
+                added.append(story_id)
+                # Stories are added to the library together, so that a
+                # large import is bulk loaded.
+                if len(added) >= BULK_LOAD_THRESHOLD:
+                    self._post_added(added)
+            self.post(self.on_progress, os.path.split(filename)[1], count)
+        self._post_added(added)
+
+    def _post_added(self, story_ids):
+        if not story_ids:
+            return
+        # The stories have been committed, so their rows are read here,
+        # rather than on the main loop through the writer, which may
+        # already be in the next transaction.
+        with self.db_manager.reader() as conn:
+            library_rows = db.query.select_library_rows(conn, story_ids)
+        del story_ids[:]
+        self.post(self.on_stories_added, library_rows)
+
+    def on_stories_added(self, library_rows):
+        self.library.add_library_rows(library_rows)
+        self.library.queue_filter_update(
+            added=[library_row["id"] for library_row in library_rows])
+
+    def on_progress(self, basename, count):
+        if self.stopped or self.dialog is None:
+            return
+        self.dialog.info_label.set_text('Importing {0}'.format(basename))
+        # Update the progress bar.
+        self.dialog.progressbar.set_fraction(
+            float(count) / float(len(self.filenames)))
+
+    def finished(self):
+        if self.error is not None:
+            self.msg = self.error
+        # The filter stores are brought up to date before the dialog goes,
+        # since the caller resets the filter selection afterwards.
+        self.library.flush_filter_updates()
+        if not self.stopped and self.dialog is not None:
+            self.dialog.response(Gtk.ResponseType.OK)
+        if self.callback is not None:
+            self.callback()
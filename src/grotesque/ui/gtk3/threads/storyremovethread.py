@@ -20,45 +20,49 @@
 #       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import threading
-
 from gi.repository import Gtk
 
 from grotesque import db
+from backgroundjob import BackgroundJob
 
 
-class StoryRemoveThread(threading.Thread):
-    '''This class handles removing stories from the library in a threaded
-    manner.  This is predominantly in order to provide a progress bar,
+class StoryRemoveThread(BackgroundJob):
+    '''This class handles removing stories from the library in a worker
+    thread.  This is predominantly in order to provide a progress bar,
     since this process can take a couple seconds if many stories are
     selected.
 
     '''
-    def __init__(self, library, row_iters, conn, dialog):
-        threading.Thread.__init__(self)
+    def __init__(self, library, row_iters, db_manager, dialog):
+        BackgroundJob.__init__(self)
         self.library = library
-        self.row_iters = row_iters
-        self.conn = conn
+        # The story IDs are looked up here, on the main loop, since the
+        # list store must not be touched from the worker thread.
+        self.rows = [(row_iter, library.get_story_id(row_iter))
+                     for row_iter in row_iters if row_iter]
+        self.conn = db_manager.writer
         self.dialog = dialog
-        self.stopthread = threading.Event()
-
-    def stop(self):
-        self.stopthread.set()
 
-    def remove_stories(self):
-        for n, row_iter in enumerate(self.row_iters):
-            # If the current iter somehow points to a row that doesn't exist,
-            # continue.
-            if not row_iter:
-                continue
-            story_id = self.library.get_story_id(row_iter)
+    def work(self):
+        removed = 0
+        for row_iter, story_id in self.rows:
+            if self.stopped:
+                break
+            # Each story is removed in a transaction of its own, so that
+            # the main loop never waits long for the connection, and its
+            # entry only leaves the library list store once the removal
+            # has been committed.
             db.remove_story(self.conn, story_id)
-            # Remove the entry from the library list store
-            self.library.list_store.remove(row_iter)
-            # Advance the progress bar.
-            self.dialog.progressbar.set_fraction(float(n + 1) /
-                                                 float(len(self.row_iters)))
-            yield True
+            removed = removed + 1
+            self.post(self.on_removed, row_iter, story_id, removed)
+
+    def on_removed(self, row_iter, story_id, count):
+        self.library.list_store.remove(row_iter)
+        self.library.queue_filter_update(removed=[story_id])
+        # Advance the progress bar.
+        self.dialog.progressbar.set_fraction(
+            float(count) / float(len(self.rows)))
+
+    def finished(self):
+        self.library.flush_filter_updates()
         self.dialog.response(Gtk.ResponseType.OK)
-        self.library.update_filter_stores()
-        yield False
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+#       thumbnailthread.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from grotesque import db
+from backgroundjob import BackgroundJob
+
+
+class ThumbnailThread(BackgroundJob):
+    '''This class makes the thumbnails of the covers which have none in a
+    worker thread.  Covers are stored without thumbnails, so this is run
+    at startup and whenever covers may have been added or changed.  The
+    covers are read with a pooled read-only connection and only the
+    writing of each cover's thumbnails holds a transaction.  Once it has
+    finished, callback() is called on the main loop, if given.
+
+    '''
+    def __init__(self, db_manager, callback=None):
+        BackgroundJob.__init__(self)
+        self.db_manager = db_manager
+        self.conn = db_manager.writer
+        self.callback = callback
+        # Covers whose thumbnails could not be made are not tried again by
+        # this job.
+        self.tried = set()
+
+    def work(self):
+        # Look again once done, for covers stored in the meantime.
+        while not self.stopped:
+            with self.db_manager.reader() as conn:
+                cover_ids = db.thumbnails.select_covers_to_thumbnail(conn)
+            cover_ids = [cover_id for cover_id in cover_ids
+                         if cover_id not in self.tried]
+            if not cover_ids:
+                return
+            for cover_id in cover_ids:
+                if self.stopped:
+                    return
+                self.tried.add(cover_id)
+                with self.db_manager.reader() as conn:
+                    db.thumbnails.make_cover_thumbnails(conn, self.conn,
+                                                        cover_id)
+
+    def finished(self):
+        if self.callback is not None:
+            self.callback()
@@ -22,6 +22,7 @@
 
 import os.path
 import subprocess
+import sys
 
 from grotesque import settings
 
@@ -90,6 +91,32 @@ def normalize_date(date_str):
     return None
 
 
+def parse_version(version_str):
+    """Turn a version string such as "0.10.1" into a tuple of integers so
+    that versions compare numerically rather than alphabetically.
+
+    """
+    if not version_str:
+        return ()
+    parts = []
+    for part in version_str.split("."):
+        try:
+            parts.append(int(part))
+        except ValueError:
+            break
+    return tuple(parts)
+
+
+def decode_path(path):
+    """Return a file system path as unicode, as it is stored in the
+    database.
+
+    """
+    if isinstance(path, str):
+        return path.decode(sys.getfilesystemencoding() or "utf-8")
+    return path
+
+
 def open_resource(uri, launcher):
     if not launcher:
         raise ValueError("No resource launcher set")
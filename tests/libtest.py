@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+#       libtest.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Shared fixtures for the tests.  Importing this module puts the source
+tree on the path.
+
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "src"))
+
+from grotesque import db
+
+
+class LibraryTestCase(unittest.TestCase):
+    """Each test gets a new library in a temporary directory."""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.manager = db.ConnectionManager(
+            os.path.join(self.tmp_dir, "library.db"))
+        self.conn = self.manager.writer
+        db.set_up_db(self.conn, "0.1")
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def add_story(self, title="Story"):
+        c = self.conn.cursor()
+        c.execute("INSERT INTO stories (title) VALUES (?)", (title,))
+        return c.lastrowid
+
+    def count_stories(self):
+        with self.manager.reader() as reader:
+            c = reader.execute("SELECT COUNT(*) FROM stories")
+            return c.fetchone()[0]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+#       test_coverstore.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of the content-addressed cover store.
+
+    python -m unittest discover tests
+
+"""
+
+
+import os
+import unittest
+
+from libtest import LibraryTestCase
+from grotesque.db import coverstore, query
+
+
+class CoverStoreTest(LibraryTestCase):
+    """Each test's library gets a cover store next to it."""
+    def setUp(self):
+        LibraryTestCase.setUp(self)
+        self.store = coverstore.CoverStore(
+            os.path.join(self.tmp_dir, "covers"), external=True)
+        self.manager.cover_store = self.store
+        self.conn.cover_store = self.store
+
+    def add_cover(self, story_id, data):
+        with self.conn.transaction():
+            stored_data, cover_hash = coverstore.write_cover(self.conn, data)
+            return query.insert_cover(self.conn, story_id, "png", 1, 1, "",
+                                      stored_data, cover_hash)
+
+    def remove_cover(self, cover_id):
+        with self.conn.transaction():
+            cover_row = query.select_cover(self.conn, cover_id)
+            query.delete_cover(self.conn, cover_id)
+            coverstore.release(self.conn, cover_row["hash"])
+            return cover_row["hash"]
+
+    def test_put_and_get(self):
+        cover_hash = self.store.put("image")
+        self.assertEqual(self.store.put("image"), cover_hash)
+        self.assertEqual(str(self.store.get(cover_hash)), "image")
+        self.assertEqual(list(self.store.hashes()), [cover_hash])
+
+    def test_read_cover(self):
+        cover_id = self.add_cover(self.add_story(), "image")
+        cover_row = query.select_cover(self.conn, cover_id)
+        self.assertEqual(str(cover_row["data"]), "")
+        self.assertEqual(str(coverstore.read_cover(self.conn, cover_row)),
+                         "image")
+        with self.manager.reader() as reader:
+            self.assertEqual(str(coverstore.read_cover(reader, cover_row)),
+                             "image")
+
+    def test_not_external(self):
+        self.store.external = False
+        cover_id = self.add_cover(self.add_story(), "image")
+        cover_row = query.select_cover(self.conn, cover_id)
+        self.assertIsNone(cover_row["hash"])
+        self.assertEqual(str(coverstore.read_cover(self.conn, cover_row)),
+                         "image")
+        self.assertEqual(list(self.store.hashes()), [])
+
+    def test_rolled_back_cover_leaves_no_file(self):
+        story_id = self.add_story()
+        with self.assertRaises(ValueError):
+            with self.conn.transaction():
+                self.add_cover(story_id, "image")
+                self.assertEqual(len(list(self.store.hashes())), 1)
+                raise ValueError
+        self.assertEqual(list(self.store.hashes()), [])
+
+    def test_shared_image(self):
+        first_id = self.add_cover(self.add_story(), "image")
+        second_id = self.add_cover(self.add_story(), "image")
+        cover_hash = self.remove_cover(first_id)
+        self.assertEqual(list(self.store.hashes()), [cover_hash])
+        self.remove_cover(second_id)
+        self.assertEqual(list(self.store.hashes()), [])
+
+    def test_release_waits_for_commit(self):
+        cover_id = self.add_cover(self.add_story(), "image")
+        with self.conn.transaction():
+            cover_hash = self.remove_cover(cover_id)
+            self.assertEqual(list(self.store.hashes()), [cover_hash])
+        self.assertEqual(list(self.store.hashes()), [])
+
+    def test_rolled_back_release_keeps_file(self):
+        cover_id = self.add_cover(self.add_story(), "image")
+        with self.assertRaises(ValueError):
+            with self.conn.transaction():
+                self.remove_cover(cover_id)
+                raise ValueError
+        cover_row = query.select_cover(self.conn, cover_id)
+        self.assertEqual(str(coverstore.read_cover(self.conn, cover_row)),
+                         "image")
+
+    def test_collect_garbage(self):
+        self.add_cover(self.add_story(), "image")
+        self.store.put("unused")
+        self.assertEqual(coverstore.collect_garbage(self.conn), 1)
+        self.assertEqual(len(list(self.store.hashes())), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
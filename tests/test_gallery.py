@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+#       test_gallery.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of the gallery's cover loading.  None of them needs a display.
+
+    python -m unittest discover tests
+
+"""
+
+
+import contextlib
+import struct
+import threading
+import time
+import unittest
+import zlib
+
+from libtest import LibraryTestCase
+from gi.repository import GdkPixbuf, GLib, Gtk
+
+from grotesque.db import query
+from grotesque.ui.gtk3.info.pixbufcache import PixbufCache
+from grotesque.ui.gtk3.library.galleryview import GalleryView
+from grotesque.ui.gtk3.threads import coverloader
+
+
+def make_png(width, height):
+    """Return a black PNG image of the given size."""
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data) & 0xffffffff
+        return struct.pack(">I", len(data)) + kind + data + \
+            struct.pack(">I", crc)
+    pixels = "".join("\0" + "\0\0\0" * width for y in range(height))
+    return "".join(["\x89PNG\r\n\x1a\n",
+                    chunk("IHDR", struct.pack(">IIBBBBB", width, height,
+                                              8, 2, 0, 0, 0)),
+                    chunk("IDAT", zlib.compress(pixels)),
+                    chunk("IEND", "")])
+
+
+def run_main_loop(condition, timeout=5):
+    """Run the main loop until condition() is true, for at most timeout
+    seconds.
+
+    """
+    context = GLib.MainContext.default()
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        if not context.iteration(False):
+            time.sleep(0.01)
+    return condition()
+
+
+class GatedManager():
+    """This class stands in for a connection manager, holding back every
+    read from the library until its gate is opened.
+
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    @contextlib.contextmanager
+    def reader(self):
+        self.entered.set()
+        self.gate.wait()
+        with self.manager.reader() as conn:
+            yield conn
+
+
+class CoverLoaderTest(LibraryTestCase):
+    def setUp(self):
+        LibraryTestCase.setUp(self)
+        self.batches = []
+        self.loader = None
+
+    def tearDown(self):
+        if self.loader is not None:
+            self.loader.stop()
+            self.assertTrue(self.loader.join(5))
+        LibraryTestCase.tearDown(self)
+
+    def start_loader(self, db_manager=None):
+        self.loader = coverloader.CoverLoader(db_manager or self.manager,
+                                              128, self.batches.append)
+        return self.loader
+
+    def add_cover(self, story_id, width, height):
+        data = make_png(width, height)
+        return query.insert_cover(self.conn, story_id, "png", height, width,
+                                  "", data)
+
+    def batch_ids(self):
+        return [[story_id for story_id, pixbuf in batch]
+                for batch in self.batches]
+
+    def covers(self):
+        return dict(cover for batch in self.batches for cover in batch)
+
+    def wait_for_covers(self, n_covers):
+        self.assertTrue(run_main_loop(lambda: len(self.covers()) >= n_covers))
+
+    def test_loads_in_batches(self):
+        story_ids = [self.add_story() for n in range(20)]
+        for story_id in story_ids[::2]:
+            self.add_cover(story_id, 64, 48)
+        self.start_loader().request(story_ids)
+        self.wait_for_covers(20)
+        size = coverloader.LOAD_BATCH_SIZE
+        self.assertEqual(self.batch_ids(),
+                         [story_ids[:size], story_ids[size:]])
+        covers = self.covers()
+        for story_id in story_ids[::2]:
+            self.assertEqual(covers[story_id].get_width(), 64)
+            self.assertEqual(covers[story_id].get_height(), 48)
+        for story_id in story_ids[1::2]:
+            self.assertIsNone(covers[story_id])
+
+    def test_scales_down_big_covers(self):
+        story_id = self.add_story()
+        self.add_cover(story_id, 256, 64)
+        self.start_loader().request([story_id])
+        self.wait_for_covers(1)
+        pixbuf = self.covers()[story_id]
+        self.assertEqual(pixbuf.get_width(), 128)
+        self.assertEqual(pixbuf.get_height(), 32)
+
+    def test_prefers_thumbnail(self):
+        story_id = self.add_story()
+        cover_id = self.add_cover(story_id, 600, 600)
+        query.insert_cover_thumbnail(self.conn, cover_id, 128, "png", 100,
+                                     50, make_png(50, 100))
+        self.start_loader().request([story_id])
+        self.wait_for_covers(1)
+        self.assertEqual(self.covers()[story_id].get_width(), 50)
+
+    def test_request_replaces_waiting(self):
+        story_ids = [self.add_story() for n in range(40)]
+        gated_manager = GatedManager(self.manager)
+        loader = self.start_loader(gated_manager)
+        loader.request(story_ids[:32])
+        # The worker has taken the first batch and waits to read it.
+        self.assertTrue(gated_manager.entered.wait(5))
+        loader.request(story_ids[32:])
+        gated_manager.gate.set()
+        self.wait_for_covers(24)
+        size = coverloader.LOAD_BATCH_SIZE
+        self.assertEqual(self.batch_ids(),
+                         [story_ids[:size], story_ids[32:]])
+
+    def test_stop(self):
+        story_id = self.add_story()
+        loader = self.start_loader()
+        loader.stop()
+        self.assertTrue(loader.join(5))
+        loader.request([story_id])
+        self.assertIsNone(loader._next_batch())
+        self.assertFalse(run_main_loop(lambda: self.batches, 0.1))
+
+
+class FakeLibrary():
+    story_id_col = 0
+
+
+class FakeLoader():
+    def __init__(self):
+        self.wanted = None
+
+    def request(self, story_ids):
+        self.wanted = list(story_ids)
+
+
+class FakeGalleryView():
+    """This class stands in for a gallery view, which cannot be made
+    without a display, so that its methods can be tested on a model
+    alone.  The model holds the story IDs in the order given.
+
+    """
+    get_story_ids = GalleryView.__dict__["get_story_ids"]
+    load_visible_covers = GalleryView.__dict__["load_visible_covers"]
+    on_covers_loaded = GalleryView.__dict__["on_covers_loaded"]
+
+    def __init__(self, story_ids):
+        self.library = FakeLibrary()
+        self.model = Gtk.ListStore(int)
+        for story_id in story_ids:
+            self.model.append([story_id])
+        self.cover_cache = PixbufCache()
+        self.no_cover = set()
+        self.loading = set()
+        self.loader = FakeLoader()
+        self.scrolling_up = False
+        self.visible_range = None
+
+    def get_model(self):
+        return self.model
+
+    def get_mapped(self):
+        return True
+
+    def get_visible_range(self):
+        start, end = self.visible_range
+        return (Gtk.TreePath.new_from_string(str(start)),
+                Gtk.TreePath.new_from_string(str(end)))
+
+    def queue_draw(self):
+        pass
+
+
+def make_pixbuf():
+    return GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, 4, 4)
+
+
+class GalleryViewTest(unittest.TestCase):
+    def setUp(self):
+        self.view = FakeGalleryView(range(100, 110))
+
+    def test_get_story_ids(self):
+        self.assertEqual(self.view.get_story_ids(2, 5), [102, 103, 104])
+        self.assertEqual(self.view.get_story_ids(5, 5), [])
+
+    def test_get_story_ids_reversed(self):
+        self.assertEqual(self.view.get_story_ids(4, 1), [104, 103, 102])
+        self.assertEqual(self.view.get_story_ids(1, -1), [101, 100])
+
+    def test_load_visible_covers(self):
+        self.view.visible_range = (2, 4)
+        self.view.cover_cache.put(103, make_pixbuf())
+        self.view.no_cover.add(106)
+        self.view.load_visible_covers()
+        # The covers in sight come first, then those of the next page.
+        self.assertEqual(self.view.loader.wanted, [102, 104, 105, 107])
+        self.assertEqual(self.view.loading, set([102, 104, 105, 107]))
+
+    def test_load_visible_covers_scrolling_up(self):
+        self.view.visible_range = (5, 7)
+        self.view.scrolling_up = True
+        self.view.load_visible_covers()
+        self.assertEqual(self.view.loader.wanted,
+                         [107, 106, 105, 104, 103, 102])
+
+    def test_load_visible_covers_at_end(self):
+        self.view.visible_range = (8, 9)
+        self.view.load_visible_covers()
+        self.assertEqual(self.view.loader.wanted, [108, 109])
+
+    def test_on_covers_loaded(self):
+        self.view.loading = set([101, 102])
+        pixbuf = make_pixbuf()
+        self.view.on_covers_loaded([(101, pixbuf), (102, None),
+                                    (103, make_pixbuf())])
+        self.assertIs(self.view.cover_cache.peek(101), pixbuf)
+        self.assertEqual(self.view.no_cover, set([102]))
+        # Covers which are no longer wanted are dropped.
+        self.assertNotIn(103, self.view.cover_cache)
+        self.assertEqual(self.view.loading, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
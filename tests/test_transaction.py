@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+#       test_transaction.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of the library connection's transactions.
+
+    python -m unittest discover tests
+
+"""
+
+
+import unittest
+
+from libtest import LibraryTestCase
+
+
+class TransactionTest(LibraryTestCase):
+    def test_autocommit_outside_transaction(self):
+        self.add_story()
+        self.assertEqual(self.count_stories(), 1)
+
+    def test_commit(self):
+        with self.conn.transaction():
+            self.add_story()
+            self.add_story()
+            self.assertEqual(self.count_stories(), 0)
+        self.assertEqual(self.count_stories(), 2)
+        self.assertEqual(self.conn.transaction_depth, 0)
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.conn.transaction():
+                self.add_story()
+                raise ValueError
+        self.assertEqual(self.count_stories(), 0)
+        self.assertEqual(self.conn.transaction_depth, 0)
+
+    def test_savepoint_rollback(self):
+        with self.conn.transaction():
+            self.add_story("Kept")
+            with self.assertRaises(ValueError):
+                with self.conn.transaction():
+                    self.add_story("Dropped")
+                    raise ValueError
+            self.assertEqual(self.conn.transaction_depth, 1)
+        titles = [row[0] for row in
+                  self.conn.execute("SELECT title FROM stories")]
+        self.assertEqual(titles, ["Kept"])
+
+    def test_after_transaction_outside_transaction(self):
+        called = []
+        self.conn.after_transaction(lambda: called.append(True))
+        self.assertEqual(called, [True])
+
+    def test_after_transaction_waits_for_outermost(self):
+        called = []
+        with self.conn.transaction():
+            with self.conn.transaction():
+                self.conn.after_transaction(lambda: called.append(True))
+            self.assertEqual(called, [])
+        self.assertEqual(called, [True])
+
+    def test_after_transaction_on_rollback(self):
+        called = []
+        with self.assertRaises(ValueError):
+            with self.conn.transaction():
+                self.conn.after_transaction(lambda: called.append(True))
+                raise ValueError
+        self.assertEqual(called, [True])
+        self.assertEqual(self.conn.transaction_callbacks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
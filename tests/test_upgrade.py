@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+#       test_upgrade.py
+#
+#       Copyright © 2018 Brandon Invergo <brandon@invergo.net>
+#
+#       This file is part of Grotesque.
+#
+#       Grotesque is free software: you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation, either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       Grotesque is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with Grotesque.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of the library schema migrations.
+
+    python -m unittest discover tests
+
+"""
+
+
+import sqlite3
+import unittest
+
+from libtest import LibraryTestCase
+from grotesque import db
+from grotesque.db import query, schema
+
+
+class UpgradeTest(LibraryTestCase):
+    def setUp(self):
+        LibraryTestCase.setUp(self)
+        self.migrations = schema.MIGRATIONS[:]
+        self.version = schema.MIGRATIONS[-1][0]
+
+    def tearDown(self):
+        schema.MIGRATIONS[:] = self.migrations
+        LibraryTestCase.tearDown(self)
+
+    def test_new_library_is_current(self):
+        self.assertEqual(query.get_schema_version(self.conn), self.version)
+        db.upgrade_db(self.conn, "0.2")
+        self.assertEqual(query.get_schema_version(self.conn), self.version)
+        self.assertEqual(query.get_db_version(self.conn), "0.2")
+
+    def test_applies_newer_migrations(self):
+        def fill(conn):
+            conn.execute("INSERT INTO test (x) VALUES (1)")
+        schema.MIGRATIONS.extend([
+            (self.version + 1, ["CREATE TABLE test (x INTEGER)"]),
+            (self.version + 2, [fill])])
+        db.upgrade_db(self.conn, "0.2")
+        self.assertEqual(query.get_schema_version(self.conn),
+                         self.version + 2)
+        rows = self.conn.execute("SELECT x FROM test").fetchall()
+        self.assertEqual([row["x"] for row in rows], [1])
+
+    def test_failed_migration_is_rolled_back(self):
+        schema.MIGRATIONS.extend([
+            (self.version + 1, ["CREATE TABLE test (x INTEGER)"]),
+            (self.version + 2, ["CREATE TABLE test2 (x INTEGER)",
+                                "INVALID SQL"])])
+        with self.assertRaises(sqlite3.OperationalError):
+            db.upgrade_db(self.conn, "0.2")
+        self.assertEqual(query.get_schema_version(self.conn),
+                         self.version + 1)
+        tables = [row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'")]
+        self.assertIn("test", tables)
+        self.assertNotIn("test2", tables)
+
+
+if __name__ == "__main__":
+    unittest.main()